@@ -1,14 +1,21 @@
-"""Agent backends: Cursor, Codex, Gemini, Claude, OpenClaw. 由 agent_config 或环境变量指定后端与选项。"""
+"""Agent backends: Cursor, Codex, Gemini, Claude, OpenClaw. 由 agent_config 或环境变量指定后端与选项。
+
+后端模块经 registry 按需导入：启动时只加载实际用到的后端；第三方后端通过 entry point 注册。
+同一会话的运行经 serialize 依次执行，不同会话并行。"""
 from __future__ import annotations
 
 import asyncio
 import os
+import time
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
+from openab.core import metrics
 from openab.core.i18n import t
 
-from . import claude, codex, cursor, gemini, openclaw
+from . import registry
+from .registry import Capabilities
+from .result import AgentReply, RunUsage, TokenUsage
 
 
 def get_backend(agent_config: dict[str, Any] | None = None) -> str:
@@ -41,6 +48,53 @@ def run_agent(
     )
 
 
+def _backend_module(backend: str) -> Any:
+    """backend id -> 后端模块（首次使用时导入）；未知 id 回退到 cursor。"""
+    return registry.load(backend)
+
+
+def get_capabilities(agent_config: dict[str, Any] | None = None) -> Capabilities:
+    """当前配置后端的能力（流式、会话列表、恢复等）。"""
+    return registry.capabilities(get_backend(agent_config))
+
+
+def list_backend_sessions(
+    agent_config: dict[str, Any] | None = None, max_sessions: int = 12, user: Optional[str] = None
+) -> list[tuple[str, str]]:
+    """
+    当前配置后端的历史会话 [(session_id, display_name), ...]；后端不支持时为空。
+    启用 agent.user_homes 时只列出 user（如 "tg:123"，见 cursor_session_state.user_ref）自己的会话。
+    """
+    from .homes import user_home
+
+    backend = get_backend(agent_config)
+    return registry.list_sessions(backend, max_sessions=max_sessions, home=user_home(backend, agent_config, user))
+
+
+def _start_probe(agent_config: Optional[dict[str, Any]]) -> None:
+    from . import probe
+
+    probe.ensure_started(agent_config)
+
+
+def _failure_hint(backend: str, lang: str, lease: Any = None) -> Optional[str]:
+    """
+    运行失败（异常或无输出且非零退出）时的具体原因：优先用健康探测结果（找不到 CLI、未登录，附登录命令），
+    否则按本次运行归类出的错误类别（见 breaker）。
+    """
+    from . import breaker, probe
+
+    hint = probe.problem_message(backend, lang)
+    if hint is None and lease is not None and lease.error_class is not None:
+        hint = breaker.failure_message(backend, lease.error_class, lang)
+    return hint
+
+
+def _failed(reply: Any) -> bool:
+    usage = getattr(reply, "usage", None)
+    return getattr(reply, "outcome", None) == "no_output" and usage is not None and usage.exit_code not in (0, None)
+
+
 async def run_agent_async(
     prompt: str,
     *,
@@ -49,27 +103,158 @@ async def run_agent_async(
     lang: str = "en",
     agent_config: Optional[dict[str, Any]] = None,
 ) -> str:
-    """异步执行 agent；backend 与各后端选项来自 agent_config，缺省时回退到环境变量。"""
+    """
+    异步执行 agent；backend 与各后端选项来自 agent_config，缺省时回退到环境变量。
+    返回值通常为 AgentReply（str 子类），.usage 为本次 CLI 运行的 CPU / 内存 / 墙钟用量，
+    .tokens 为后端报告的 token 用量（目前仅 Codex）。
+    找不到 CLI 或 CLI 未登录导致失败时（见 probe），返回对应的提示。
+    同一会话的运行依次执行（见 serialize），排队时间不计入 timeout。
+    启用 agent.adaptive_timeout 时，timeout 按该后端与 prompt 长度的历史耗时调整（见 timeouts）。
+    启用 agent.workspace_pool 时，各会话在基础工作区的独立视图中运行（见 workspaces）；
+    后端配置了多个凭据目录时，会话分散到各目录并固定（见 homes）。
+    后端（或凭据目录）连续失败时断路器打开，冷却期内直接返回故障原因而不启动 CLI（见 breaker）。
+    配置了 agent.hedge 时，不共享会话的运行迟迟没有结果会在备用后端上对冲（见 hedge；
+    延续最近会话的运行不对冲，需 continue_session: false）。
+    """
+    from .hedge import get_hedge_config, run_hedged, skipped
+    from .serialize import session_key
+
+    async def run(cfg: Optional[Mapping[str, Any]]) -> tuple[str, bool]:
+        return await _run_once(prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=cfg)
+
     backend = get_backend(agent_config)
-    if backend == "codex":
-        return await codex.run_async(
-            prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
-        )
-    if backend == "gemini":
-        return await gemini.run_async(
-            prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
-        )
-    if backend == "claude":
-        return await claude.run_async(
-            prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
-        )
-    if backend == "openclaw":
-        return await openclaw.run_async(
-            prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
-        )
-    return await cursor.run_async(
-        prompt, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
-    )
+    hedge = get_hedge_config(agent_config)
+    if hedge is not None:
+        key = session_key(backend, agent_config)
+        if key is None:
+            return await run_hedged(backend, hedge, agent_config, lang, run)
+        skipped(backend, key)
+    return (await run(agent_config))[0]
+
+
+async def _run_once(
+    prompt: str,
+    *,
+    workspace: Optional[Path],
+    timeout: int,
+    lang: str,
+    agent_config: Optional[Mapping[str, Any]],
+) -> tuple[str, bool]:
+    """在 agent_config 指定的后端上运行一次，返回 (回复, 是否成功)；失败时回复为具体原因（能判断时）。"""
+    from .breaker import down_message
+    from .homes import home_lease
+    from .router import running
+    from .serialize import owner_key, session_key, session_turn
+    from .timeouts import effective_timeout, record as record_duration
+    from .workspaces import workspace_for
+
+    backend = get_backend(agent_config)
+    _start_probe(agent_config)
+    started = time.monotonic()
+    lease = None
+    cancelled = False
+    try:
+        async with session_turn(backend, agent_config) as cfg:
+            key = session_key(backend, cfg)
+            async with workspace_for(workspace, cfg, owner_key(backend, cfg)) as ws:
+                with home_lease(backend, cfg, key) as lease:
+                    if lease.rejected is not None:
+                        return AgentReply(down_message(backend, *lease.rejected, lang)), False
+                    limit = effective_timeout(backend, prompt, timeout, cfg)
+                    run_started = time.monotonic()
+                    with running(backend):
+                        reply = await _backend_module(backend).run_async(
+                            prompt, workspace=ws, timeout=limit, lang=lang, agent_config=lease.config
+                        )
+                    lease.feed(reply)
+                    record_duration(backend, prompt, time.monotonic() - run_started, lease.outcome, cfg)
+    except asyncio.CancelledError:
+        # 被取消的运行（对冲落败、用户中止）不计入耗时分布
+        cancelled = True
+        raise
+    except Exception:
+        hint = _failure_hint(backend, lang, lease)
+        if hint is None:
+            raise
+        return AgentReply(hint), False
+    finally:
+        if not cancelled:
+            metrics.observe("agent_run_seconds", time.monotonic() - started, backend=backend, mode="full")
+    if _failed(reply):
+        hint = _failure_hint(backend, lang, lease)
+        return (AgentReply(hint, usage=reply.usage) if hint is not None else reply), False
+    return reply, lease.error_class is None
+
+
+async def run_agent_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    run_agent_async 的流式版本：CLI 写出内容即产出文本增量（已解码、去 ANSI）。
+    超时/无输出时与 run_agent_async 一样产出对应文案。首个增量耗时记入 agent_ttft_seconds。
+    """
+    from .breaker import down_message
+    from .homes import home_lease
+    from .router import running
+    from .serialize import owner_key, session_key, session_turn
+    from .timeouts import effective_timeout, record as record_duration
+    from .workspaces import workspace_for
+
+    backend = get_backend(agent_config)
+    _start_probe(agent_config)
+    emitted = False
+    lease = None
+    # 没有输出时的提示：等运行结果交给断路器（lease 退出）后再产出，以便换成具体原因
+    no_output: Any = None
+    try:
+        async with session_turn(backend, agent_config) as cfg:
+            key = session_key(backend, cfg)
+            async with workspace_for(workspace, cfg, owner_key(backend, cfg)) as ws:
+                with home_lease(backend, cfg, key) as lease:
+                    if lease.rejected is not None:
+                        yield down_message(backend, *lease.rejected, lang)
+                        return
+                    limit = effective_timeout(backend, prompt, timeout, cfg)
+                    run_started = time.monotonic()
+                    with running(backend):
+                        async for delta in _backend_module(backend).run_stream_async(
+                            prompt, workspace=ws, timeout=limit, lang=lang, agent_config=lease.config
+                        ):
+                            lease.feed(delta)
+                            if not delta:
+                                # 结束标记（只带 usage / error，见 AgentReply）
+                                continue
+                            if not emitted and getattr(delta, "outcome", None) == "no_output":
+                                no_output = delta
+                                continue
+                            emitted = True
+                            yield delta
+                    record_duration(backend, prompt, time.monotonic() - run_started, lease.outcome, cfg)
+                if no_output is not None:
+                    # 与 run_agent_async 一致：探测到的问题总会提示，登录目录的错误类别只在运行失败时提示
+                    emitted = True
+                    yield _failure_hint(backend, lang, lease if _failed(no_output) else None) or no_output
+    except Exception:
+        hint = None if emitted else _failure_hint(backend, lang, lease)
+        if hint is None:
+            raise
+        yield hint
 
 
-__all__ = ["run_agent", "run_agent_async", "get_backend"]
+__all__ = [
+    "AgentReply",
+    "Capabilities",
+    "RunUsage",
+    "TokenUsage",
+    "run_agent",
+    "run_agent_async",
+    "run_agent_stream_async",
+    "get_backend",
+    "get_capabilities",
+    "list_backend_sessions",
+]
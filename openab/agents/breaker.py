@@ -0,0 +1,255 @@
+"""断路器：按 (后端, 凭据目录) 统计运行失败，故障期间直接返回具体原因，不再为每条消息启动 CLI 等它失败。
+
+失败先按退出码、输出特征与异常类型归类（classify_exception / RunOutcome）：
+- auth：未登录 / 登录失效（not logged in、unauthorized、401 等）；
+- rate_limit：服务商限流（429、rate limit、usage limit 等，见 homes.is_rate_limited）；
+- crash：CLI 异常退出（非零退出码且没有有效输出、被信号结束、网关连接失败）；
+- hang：全程无输出直到超时 / 看门狗触发，或进程迟迟启动不了；
+- not_found：找不到 CLI。
+输出特征只在运行确知失败（退出码非 0、CLI 报告了错误、没有输出）时采信，避免把正文中谈到「限流」的回复误判。
+
+状态：closed（正常）→ 连续 failures 次失败（auth / not_found / rate_limit 一次即可判定）后 open，
+cooldown 秒内的运行直接返回 backend_down 文案；冷却结束后 half-open，只放行一次试探运行：
+成功则 closed，失败则再次 open 且冷却时间翻倍（最多 max_cooldown）。
+
+配置：agent.circuit_breaker: false 关闭；或 {failures: 3, cooldown: 30, max_cooldown: 300}。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+from openab.core.i18n import t
+
+from .homes import is_rate_limited
+from .process import SpawnTimeoutError
+
+logger = logging.getLogger(__name__)
+
+ERROR_CLASSES = ("auth", "rate_limit", "crash", "hang", "not_found")
+# 一次即可判定为故障的错误类别（其余类别需连续 failures 次）
+_DEFINITE = frozenset({"auth", "not_found", "rate_limit"})
+# 单次运行用于匹配错误特征的输出尾部字符数
+_TAIL_CHARS = 4096
+_AUTH_RE = re.compile(
+    r"not (logged|signed|authenticated)|log ?in required|unauthenticated|unauthori[sz]ed|\b401\b|"
+    r"invalid (api key|token|credentials)|(token|session|credentials?) (has )?expired|please (re-?)?log ?in",
+    re.I,
+)
+
+DEFAULT_FAILURES = 3
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_MAX_COOLDOWN = 300.0
+
+
+@dataclass(frozen=True)
+class BreakerConfig:
+    failures: int = DEFAULT_FAILURES
+    cooldown: float = DEFAULT_COOLDOWN
+    max_cooldown: float = DEFAULT_MAX_COOLDOWN
+
+
+def get_breaker_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[BreakerConfig]:
+    """读取 agent.circuit_breaker；默认启用，为 false 时返回 None。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("circuit_breaker")
+    if raw is False:
+        return None
+    if not isinstance(raw, dict):
+        return BreakerConfig()
+    try:
+        failures = max(1, int(raw.get("failures") or DEFAULT_FAILURES))
+        cooldown = max(1.0, float(raw.get("cooldown") or DEFAULT_COOLDOWN))
+        max_cooldown = max(cooldown, float(raw.get("max_cooldown") or DEFAULT_MAX_COOLDOWN))
+    except (TypeError, ValueError):
+        return BreakerConfig()
+    return BreakerConfig(failures=failures, cooldown=cooldown, max_cooldown=max_cooldown)
+
+
+# ---------- 错误归类 ----------
+
+
+def classify_exception(exc: BaseException) -> str:
+    if isinstance(exc, FileNotFoundError):
+        return "not_found"
+    if isinstance(exc, (SpawnTimeoutError, asyncio.TimeoutError)):
+        return "hang"
+    return "crash"
+
+
+class RunOutcome:
+    """收集一次运行的输出尾部、退出码与异常，运行结束后归类。"""
+
+    def __init__(self) -> None:
+        self.tail = ""
+        self.chars = 0
+        self.exit_code: Optional[int] = None
+        self.truncated = False
+        self.exception: Optional[BaseException] = None
+        # 没有正常回复时的结果（AgentReply.outcome：timed_out / stalled / no_output）
+        self.outcome: Optional[str] = None
+        # CLI 明确报告的错误（AgentReply.error）
+        self.error: Optional[str] = None
+
+    def feed(self, text: Any) -> None:
+        """text 为回复或流式增量；AgentReply 带 usage / truncated / outcome / error 时一并记下。"""
+        usage = getattr(text, "usage", None)
+        if usage is not None and usage.exit_code is not None:
+            self.exit_code = usage.exit_code
+        if getattr(text, "truncated", False):
+            self.truncated = True
+        error = getattr(text, "error", None)
+        if error:
+            self.error = error
+            self.tail = (self.tail + "\n" + error)[-_TAIL_CHARS:]
+        outcome = getattr(text, "outcome", None)
+        if outcome is not None:
+            # 提示文案不是 CLI 的输出，不计入
+            self.outcome = outcome
+            return
+        if not text:
+            return
+        self.tail = (self.tail + str(text))[-_TAIL_CHARS:]
+        self.chars += len(text)
+
+    @property
+    def failed(self) -> bool:
+        return self.exception is not None or (self.exit_code not in (0, None) and not self.truncated)
+
+    def error_class(self) -> Optional[str]:
+        """
+        本次运行的错误类别；正常（含被软期限截断）时为 None。
+        输出特征只在运行确知失败时采信（非零退出码、CLI 报告了错误、没有输出），
+        正常回复的正文即使谈到 401 / 429 也不归类。
+        """
+        if self.exception is not None:
+            return classify_exception(self.exception)
+        if self.truncated:
+            return None
+        if self.outcome in ("timed_out", "stalled"):
+            return "hang"
+        known = self.failed or self.error is not None or (self.outcome == "no_output" and self.chars == 0)
+        if not known:
+            return None
+        if _AUTH_RE.search(self.tail):
+            return "auth"
+        if is_rate_limited(self.tail):
+            return "rate_limit"
+        return "crash"
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error_class() is None and (self.exit_code == 0 or (self.exit_code is None and self.chars > 0))
+
+
+# ---------- 断路器 ----------
+
+
+@dataclass
+class _Circuit:
+    state: str = "closed"  # closed / open / half_open
+    failures: int = 0
+    error_class: Optional[str] = None
+    opened_at: float = 0.0
+    cooldown: float = 0.0
+    trial: bool = False  # half-open 的试探运行进行中
+
+
+_circuits: dict[tuple[str, str], _Circuit] = {}
+_STATE_VALUE = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def _circuit(backend: str, home: Optional[str]) -> _Circuit:
+    key = (backend, home or "")
+    c = _circuits.get(key)
+    if c is None:
+        c = _circuits[key] = _Circuit()
+    return c
+
+
+def _set_state(backend: str, home: Optional[str], c: _Circuit, state: str) -> None:
+    c.state = state
+    metrics.set_gauge("agent_circuit_state", _STATE_VALUE[state], backend=backend, home=home or "default")
+
+
+def is_open(backend: str, home: Optional[str] = None) -> bool:
+    """该后端（/ 凭据目录）当前是否处于故障冷却期（half-open 试探进行中也算）。"""
+    c = _circuits.get((backend, home or ""))
+    if c is None or c.state == "closed":
+        return False
+    if c.state == "open":
+        return time.monotonic() - c.opened_at < c.cooldown
+    return c.trial
+
+
+def admit(backend: str, home: Optional[str] = None) -> Optional[tuple[str, float]]:
+    """
+    能否运行：可以时返回 None（half-open 时本次即为试探运行），
+    否则返回 (错误类别, 预计恢复前的秒数)。
+    """
+    c = _circuits.get((backend, home or ""))
+    if c is None or c.state == "closed":
+        return None
+    now = time.monotonic()
+    if c.state == "open":
+        remaining = c.opened_at + c.cooldown - now
+        if remaining > 0:
+            return (c.error_class or "crash", remaining)
+        _set_state(backend, home, c, "half_open")
+        logger.info("circuit for %s%s is half-open, probing", backend, f" ({home})" if home else "")
+    if c.trial:
+        return (c.error_class or "crash", c.cooldown)
+    c.trial = True
+    return None
+
+
+def release(backend: str, home: Optional[str] = None) -> None:
+    """运行被取消、没有结果：放弃 half-open 的试探名额，下一次运行重新试探。"""
+    c = _circuits.get((backend, home or ""))
+    if c is not None:
+        c.trial = False
+
+
+def record(backend: str, home: Optional[str], outcome: RunOutcome, config: BreakerConfig) -> Optional[str]:
+    """记录一次运行结果并更新断路器；返回错误类别（正常时为 None）。"""
+    c = _circuit(backend, home)
+    cls = outcome.error_class()
+    was_trial, c.trial = c.trial, False
+    if cls is None:
+        if outcome.succeeded and c.state != "closed":
+            logger.info("circuit for %s%s closed", backend, f" ({home})" if home else "")
+            _set_state(backend, home, c, "closed")
+            c.failures = 0
+            c.cooldown = 0.0
+        elif outcome.succeeded:
+            c.failures = 0
+        return None
+    metrics.inc("agent_run_errors_total", backend=backend, error_class=cls)
+    c.failures += 1
+    c.error_class = cls
+    if was_trial or c.state == "half_open":
+        c.cooldown = min(max(c.cooldown, config.cooldown) * 2, config.max_cooldown)
+    elif c.failures >= config.failures or cls in _DEFINITE:
+        c.cooldown = config.cooldown
+    else:
+        return cls
+    c.opened_at = time.monotonic()
+    _set_state(backend, home, c, "open")
+    logger.warning(
+        "circuit for %s%s opened after %s failure(s) (%s), cooling down %.0fs",
+        backend, f" ({home})" if home else "", c.failures, cls, c.cooldown,
+    )
+    return cls
+
+
+def down_message(backend: str, error_class: str, seconds: float, lang: str) -> str:
+    metrics.inc("agent_circuit_rejections_total", backend=backend, error_class=error_class)
+    return t(lang, "backend_down", backend=backend, reason=t(lang, f"error_class_{error_class}"), seconds=f"{max(1, round(seconds))}")
+
+
+def failure_message(backend: str, error_class: str, lang: str) -> str:
+    return t(lang, "agent_failed", backend=backend, reason=t(lang, f"error_class_{error_class}"))
@@ -0,0 +1,222 @@
+"""有界内存的输出捕获：代替 proc.communicate() 把整段 stdout 读进内存。
+
+前 agent.capture_memory_bytes（默认 1MB）字节留在内存；超过后整段输出转写到临时文件，内存中只保留开头部分
+用于预览。run_async 返回的 AgentReply 此时只含开头部分文本，完整输出在 reply.output（CapturedOutput）上，
+可按块读取（iter_text）或作为文件发送（open），用完调用 discard() 删除临时文件（对象被回收时也会删除）。
+"""
+from __future__ import annotations
+
+import asyncio
+import codecs
+import io
+import logging
+import os
+import tempfile
+import weakref
+from typing import Any, BinaryIO, Callable, Iterator, Mapping, Optional
+
+from openab.core import metrics
+
+from .deadline import RunClock, get_deadlines, truncated_reply
+from .process import AgentProcess, terminate
+from .result import AgentReply, RunUsage, no_output_reply
+from .stream import READ_CHUNK_SIZE, LineSplitter, TextDecoder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BYTES = 1024 * 1024
+# 溢出到文件时 AgentReply 中保留的预览字符数
+PREVIEW_CHARS = 16 * 1024
+
+
+def memory_limit(agent_config: Optional[Mapping[str, Any]]) -> int:
+    """agent.capture_memory_bytes，缺省读 OPENAB_CAPTURE_MEMORY_BYTES，默认 1MB。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("capture_memory_bytes")
+    if raw is None:
+        raw = os.environ.get("OPENAB_CAPTURE_MEMORY_BYTES", "").strip() or None
+    if raw is None:
+        return DEFAULT_MEMORY_BYTES
+    try:
+        return max(4096, int(raw))
+    except (TypeError, ValueError):
+        return DEFAULT_MEMORY_BYTES
+
+
+def format_size(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024  # type: ignore[assignment]
+    return f"{n:.1f} GB"
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class CapturedOutput:
+    """一次运行的完整 stdout：小于上限时在内存中，否则在临时文件中（内存只留开头部分）。"""
+
+    def __init__(self, max_memory_bytes: int = DEFAULT_MEMORY_BYTES) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.size = 0
+        self.path: Optional[str] = None
+        self._head = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._finalizer: Optional[weakref.finalize] = None
+        # 运行超过软期限、输出不完整
+        self.truncated = False
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        if len(self._head) + len(data) <= self.max_memory_bytes:
+            self._head += data
+            return
+        fd, path = tempfile.mkstemp(prefix="openab-output-", suffix=".txt")
+        self.path = path
+        self._finalizer = weakref.finalize(self, _unlink, path)
+        self._file = open(fd, "wb")
+        self._file.write(self._head)
+        self._file.write(data)
+        # 内存中只保留开头部分供预览
+        room = self.max_memory_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+        metrics.inc("agent_output_spills_total")
+
+    def finish(self) -> None:
+        """写入结束：关闭临时文件（之后按需重新打开读取）。"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info("agent output of %s spilled to %s", format_size(self.size), self.path)
+
+    def head(self, max_chars: Optional[int] = None) -> str:
+        """内存中的开头部分（溢出时即预览）解码为文本。"""
+        data = bytes(self._head if max_chars is None else self._head[: max_chars * 4])
+        # 截断处可能落在多字节字符中间，不完整的尾部字节直接丢弃
+        complete = not self.spilled and len(data) == len(self._head)
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace").decode(data, final=complete)
+        return text if max_chars is None else text[:max_chars]
+
+    def open(self) -> BinaryIO:
+        """以二进制只读方式打开完整输出（用于作为附件发送）。"""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(bytes(self._head))
+
+    def iter_text(self, chunk_bytes: int = READ_CHUNK_SIZE * 16) -> Iterator[str]:
+        """按块解码完整输出，不一次读入内存。"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with self.open() as f:
+            while True:
+                data = f.read(chunk_bytes)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def discard(self) -> None:
+        """删除临时文件（若有）。"""
+        self.finish()
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+async def _drain(stream: Optional[asyncio.StreamReader]) -> None:
+    """读完并丢弃（如未使用的 stderr），避免子进程因管道写满而阻塞。"""
+    if stream is None:
+        return
+    while await stream.read(READ_CHUNK_SIZE * 16):
+        pass
+
+
+async def capture(
+    proc: AgentProcess,
+    timeout: float,
+    *,
+    agent_config: Optional[Mapping[str, Any]] = None,
+    filter_line: Optional[Callable[[str], Optional[str]]] = None,
+) -> CapturedOutput:
+    """
+    读取 proc.stdout 直到 EOF 并等待进程退出，stderr（若为管道）读完丢弃。
+    filter_line 非空时按行过滤（返回 None 丢弃该行，否则写入返回值）。
+    timeout 为软期限：到达后中断进程、继续收集到退出或硬期限，返回值的 truncated 为 True。
+    被取消时先结束整棵进程树。
+    """
+    out = CapturedOutput(memory_limit(agent_config))
+    clock = RunClock(proc, get_deadlines(agent_config, timeout))
+    decoder = TextDecoder() if filter_line is not None else None
+    splitter = LineSplitter() if filter_line is not None else None
+
+    def _write_lines(lines: list[str]) -> None:
+        for line in lines:
+            kept = filter_line(line)  # type: ignore[misc]
+            if kept:
+                out.write(kept.encode("utf-8"))
+
+    drain = asyncio.ensure_future(_drain(proc.stderr))
+    try:
+        while proc.stdout is not None:
+            data = await clock.read(proc.stdout, READ_CHUNK_SIZE * 16)
+            if not data:
+                break
+            if splitter is None:
+                out.write(data)
+            else:
+                _write_lines(splitter.feed(decoder.feed(data)))  # type: ignore[union-attr]
+        if splitter is not None:
+            _write_lines(splitter.feed(decoder.flush()) + splitter.flush())  # type: ignore[union-attr]
+        await clock.wait()
+    except asyncio.CancelledError:
+        out.discard()
+        await asyncio.shield(terminate(proc))
+        raise
+    finally:
+        drain.cancel()
+    out.truncated = clock.truncated
+    out.finish()
+    return out
+
+
+def reply_from_output(out: CapturedOutput, lang: str, *, usage: Optional[RunUsage] = None) -> AgentReply:
+    """
+    由捕获结果构造回复：未溢出时为完整文本；溢出时为开头预览，完整输出在 reply.output。
+    超过软期限时附「已截断」提示（truncated_reply）。
+    """
+    if out.truncated:
+        if out.spilled:
+            return truncated_reply(out.head(PREVIEW_CHARS), lang, usage=usage, output=out)
+        return truncated_reply(out.head(), lang, usage=usage)
+    if not out.spilled:
+        text = out.head().strip()
+        if not text:
+            return no_output_reply(lang, usage=usage)
+        return AgentReply(text, usage=usage, output=out)
+    return AgentReply(out.head(PREVIEW_CHARS).strip(), usage=usage, output=out)
+
+
+def attachment_for(reply: Any, max_chars: int) -> Optional[CapturedOutput]:
+    """聊天端：输出已溢出到文件或长于 max_chars 时返回应作为文件发送的完整输出，否则 None。"""
+    out = getattr(reply, "output", None)
+    if not isinstance(out, CapturedOutput):
+        return None
+    if out.spilled or len(reply) > max_chars:
+        return out
+    return None
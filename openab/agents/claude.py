@@ -1,17 +1,42 @@
 """Claude Code CLI backend (https://code.claude.com/docs/en/cli-reference).
 
 Print mode: claude -p "query" — response to stdout, then exit.
-Flags used: --output-format text, --no-session-persistence; optional: --model, --max-turns, --add-dir.
+Flags used: --output-format text, --no-session-persistence (dropped when resuming a session with --resume <id>);
+optional: --model, --max-turns, --add-dir.
+Streaming: --output-format stream-json --verbose --include-partial-messages.
+Resident mode (claude.resident): one long-lived process per chat user fed via --input-format stream-json,
+see claude_sessions.py.
 """
 from __future__ import annotations
 
-import asyncio
 import os
 import shutil
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
-from openab.core.i18n import t
+from . import priority
+from .capture import capture, reply_from_output
+from .claude_sessions import ResidentConfig, get_resident_config
+from .claude_sessions import manager as resident_sessions
+from .deadline import get_deadlines, truncated_reply
+from .homes import apply_home_env
+from .limits import get_limits
+from .plan import InvocationPlan, get_plan, make_plan
+from .pool import get_pool_config
+from .process import spawn
+from .registry import Capabilities
+from .result import AgentReply, no_output_reply
+from .stream import StreamJsonParser, stream_subprocess
+from .transport import use_stdin
+
+CLI_NAME = "claude"
+# Environment variable that points the CLI at a credential home (see homes).
+HOME_ENV = "CLAUDE_CONFIG_DIR"
+DEFAULT_HOME = "~/.claude"
+# Files linked from the login home into per-user homes (see homes).
+SHARED_FILES = (".credentials.json", "settings.json")
+# Sessions resume by id in both modes (--resume); fresh print-mode runs are not persisted.
+CAPABILITIES = Capabilities(streaming=True, resume=True)
 
 
 def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
@@ -28,18 +53,8 @@ def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
     return exe or cmd
 
 
-def _build_args(
-    prompt: str,
-    workspace: Optional[Path],
-    agent_config: dict[str, Any] | None = None,
-) -> list[str]:
-    cmd = _find_cmd(agent_config)
-    args = [
-        cmd,
-        "--print",
-        "--output-format", "text",
-        "--no-session-persistence",
-    ]
+def _config_flags(agent_config: Mapping[str, Any] | None) -> list[str]:
+    """--model / --max-turns / --add-dir from config (falling back to CLAUDE_CLI_* env vars)."""
     model = ""
     max_turns = ""
     add_dirs: list[str] = []
@@ -62,16 +77,110 @@ def _build_args(
         raw = os.environ.get("CLAUDE_CLI_ADD_DIR", "").strip()
         if raw:
             add_dirs = [d.strip() for d in raw.split(os.pathsep) if d.strip()]
+    flags: list[str] = []
     if model:
-        args.extend(["--model", model])
+        flags.extend(["--model", model])
     if max_turns and max_turns.isdigit():
-        args.extend(["--max-turns", max_turns])
+        flags.extend(["--max-turns", max_turns])
     for d in add_dirs:
-        args.extend(["--add-dir", d])
-    args.append(prompt)
+        flags.extend(["--add-dir", d])
+    return flags
+
+
+def _compile_plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return make_plan(_find_cmd(agent_config), flags=_config_flags(agent_config))
+
+
+def _plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return get_plan(
+        "claude",
+        agent_config,
+        _compile_plan,
+        env_keys=("CLAUDE_CLI_CMD", "CLAUDE_CLI_MODEL", "CLAUDE_CLI_MAX_TURNS", "CLAUDE_CLI_ADD_DIR"),
+    )
+
+
+def invocation_plan(agent_config: Mapping[str, Any] | None = None) -> InvocationPlan:
+    """Invocation plan for the current config (executable, env); used by health probing."""
+    return _plan(agent_config)
+
+
+def _build_args(
+    prompt: Optional[str],
+    workspace: Optional[Path],
+    agent_config: dict[str, Any] | None = None,
+    *,
+    output_format: str = "text",
+    resident: bool = False,
+    resume_id: Optional[str] = None,
+    plan: Optional[InvocationPlan] = None,
+) -> list[str]:
+    plan = plan or _plan(agent_config)
+    cmd = plan.executable
+    if resident:
+        # Resident session: messages arrive on stdin as stream-json; keep session persistence so an
+        # evicted process can be restarted with --resume.
+        args = [cmd, "--print", "--input-format", "stream-json", "--output-format", "stream-json"]
+        output_format = "stream-json"
+    else:
+        args = [cmd, "--print", "--output-format", output_format]
+        if not resume_id:
+            # One-off run; a resumed session keeps persisting so it can be resumed again.
+            args.append("--no-session-persistence")
+    if output_format == "stream-json":
+        # stream-json in print mode requires --verbose; partial messages provide per-token text_delta events
+        args.extend(["--verbose", "--include-partial-messages"])
+    args.extend(plan.flags)
+    if resume_id:
+        args.extend(["--resume", resume_id])
+    # With prompt None it is left out of argv and written to stdin (warm process pool)
+    if prompt is not None:
+        args.append(prompt)
     return args
 
 
+def _session_key(agent_config: dict[str, Any] | None) -> Optional[str]:
+    """Chat session key set by build_agent_config_with_session (platform:chat:user)."""
+    key = (agent_config or {}).get("_session_key")
+    return str(key) if key else None
+
+
+def _resume_id(agent_config: Mapping[str, Any] | None) -> Optional[str]:
+    """Session id to resume (_resume_id, set by /resume or an API request), if any."""
+    rid = (agent_config or {}).get("_resume_id")
+    return (str(rid).strip() or None) if rid else None
+
+
+def _run_resident(
+    prompt: str,
+    resident: ResidentConfig,
+    *,
+    workspace: Optional[Path],
+    timeout: int,
+    lang: str,
+    agent_config: dict[str, Any] | None,
+) -> AsyncIterator[str]:
+    """Run one turn on the chat user's resident Claude process."""
+    plan = _plan(agent_config)
+    return resident_sessions.run(
+        _session_key(agent_config) or "",
+        prompt,
+        lambda resume_id: _build_args(
+            None, workspace, agent_config, resident=True, resume_id=resume_id, plan=plan
+        ),
+        config=resident,
+        resume_id=_resume_id(agent_config),
+        new_session=(agent_config or {}).get("_session_new") is True,
+        env=apply_home_env(plan.env, agent_config),
+        cwd=str(workspace) if workspace else None,
+        timeout=timeout,
+        lang=lang,
+        limits=priority.with_weights(get_limits(agent_config, "claude"), agent_config),
+        deadlines=get_deadlines(agent_config, timeout, events=True),
+        agent_config=agent_config,
+    )
+
+
 async def run_async(
     prompt: str,
     *,
@@ -81,20 +190,86 @@ async def run_async(
     agent_config: Optional[dict[str, Any]] = None,
 ) -> str:
     """Run Claude Code CLI in print mode; return stdout as reply."""
-    args = _build_args(prompt, workspace, agent_config)
+    resident = get_resident_config(agent_config)
+    if resident and _session_key(agent_config):
+        parts = [
+            delta
+            async for delta in _run_resident(
+                prompt, resident, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
+            )
+        ]
+        if any(getattr(p, "truncated", False) for p in parts):
+            # Soft deadline hit after some output: partial reply with the truncation note (see deadline).
+            return truncated_reply("".join(p for p in parts if not getattr(p, "truncated", False)), lang)
+        text = "".join(parts).strip()
+        error = next((p.error for p in parts if getattr(p, "error", None)), None)
+        if not text:
+            return no_output_reply(lang, error=error)
+        # A turn without a reply yields a single message carrying its outcome (timed_out / stalled / no_output)
+        outcome = next((p.outcome for p in parts if getattr(p, "outcome", None)), None)
+        return AgentReply(text, outcome=outcome, error=error)
+    pool_cfg = get_pool_config(agent_config, "claude")
+    via_stdin = use_stdin(prompt, agent_config, "claude", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    args = _build_args(
+        None if via_stdin else prompt, workspace, agent_config, resume_id=_resume_id(agent_config), plan=plan
+    )
     cwd = str(workspace) if workspace else None
-    proc = await asyncio.create_subprocess_exec(
-        *args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=os.environ.copy(),
+    proc = await spawn(
+        args,
+        backend="claude",
+        env=plan.env,
         cwd=cwd,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
+    )
+    out = await capture(proc, timeout, agent_config=agent_config)
+    return reply_from_output(out, lang, usage=proc.usage)
+
+
+async def run_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """Streaming variant: yield text deltas from stream-json events as they arrive."""
+    resident = get_resident_config(agent_config)
+    if resident and _session_key(agent_config):
+        async for delta in _run_resident(
+            prompt, resident, workspace=workspace, timeout=timeout, lang=lang, agent_config=agent_config
+        ):
+            yield delta
+        return
+    pool_cfg = get_pool_config(agent_config, "claude")
+    via_stdin = use_stdin(prompt, agent_config, "claude", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    parser = StreamJsonParser()
+    args = _build_args(
+        None if via_stdin else prompt,
+        workspace,
+        agent_config,
+        output_format="stream-json",
+        resume_id=_resume_id(agent_config),
+        plan=plan,
     )
-    try:
-        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return t(lang, "agent_timeout")
-    text = (stdout or b"").decode("utf-8", errors="replace").strip()
-    return text or t(lang, "agent_no_output")
+    async for delta in stream_subprocess(
+        args,
+        backend="claude",
+        env=plan.env,
+        cwd=str(workspace) if workspace else None,
+        timeout=timeout,
+        lang=lang,
+        parse_line=parser,
+        events=True,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
+    ):
+        yield delta
+    if parser.error:
+        # is_error result event: pass the error on for the circuit breaker (empty text, not shown)
+        yield AgentReply("", error=parser.error)
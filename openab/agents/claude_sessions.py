@@ -0,0 +1,296 @@
+"""Claude 常驻会话：每个聊天用户（cursor_session_state._key）保持一个 claude 进程，
+通过 --input-format stream-json 在 stdin 上逐轮写入消息、从 stdout 读 stream-json 事件。
+
+后续轮次只需发送增量消息，不再冷启动、也不重建上下文。空闲超时、会话数超限或可用内存不足时
+按最久未用顺序回收进程；回收后再来消息会以 --resume <session_id> 重新拉起并接上原会话。
+
+配置：claude.resident: true 或 {idle_timeout: 900, max_sessions: 8, min_available_mb: 512}
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Mapping, Optional
+
+from openab.core import metrics
+from openab.core.i18n import t
+
+from . import priority
+from .deadline import Deadlines, RunClock, get_deadlines, truncated_reply
+from .limits import ResourceLimits
+from .process import DEVNULL, PIPE, AgentProcess, create_process, kill_tree
+from .result import AgentReply, no_output_reply
+from .stream import READ_CHUNK_SIZE, LineSplitter, StreamJsonParser, TextDecoder
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ResidentConfig:
+    idle_timeout: float = 900.0
+    max_sessions: int = 8
+    # /proc/meminfo 中 MemAvailable 低于该值（MB）时回收空闲会话；0 表示不检查
+    min_available_mb: int = 512
+
+
+def get_resident_config(agent_config: Optional[dict[str, Any]]) -> Optional[ResidentConfig]:
+    """claude.resident 为 true 或 dict 时启用；否则返回 None。"""
+    raw = ((agent_config or {}).get("claude") or {}).get("resident")
+    if raw is True:
+        return ResidentConfig()
+    if not isinstance(raw, dict) or raw.get("enabled") is False:
+        return None
+    try:
+        return ResidentConfig(
+            idle_timeout=float(raw.get("idle_timeout") or 900),
+            max_sessions=max(1, int(raw.get("max_sessions") or 8)),
+            min_available_mb=int(raw.get("min_available_mb") if raw.get("min_available_mb") is not None else 512),
+        )
+    except (TypeError, ValueError):
+        return ResidentConfig()
+
+
+def _mem_available_mb() -> Optional[int]:
+    """读 /proc/meminfo 的 MemAvailable（MB）；非 Linux 返回 None。"""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class ResidentSession:
+    """一个常驻 claude 进程；同一时刻只跑一轮。"""
+
+    def __init__(self, key: str, proc: AgentProcess, resume_id: Optional[str], cwd: Optional[str]) -> None:
+        self.key = key
+        self.proc = proc
+        self.cwd = cwd
+        # 拉起时指定的 --resume id；与本次请求的 _resume_id 不同时需要重建进程
+        self.resume_id = resume_id
+        self.session_id: Optional[str] = resume_id
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self._decoder = TextDecoder()
+        self._splitter = LineSplitter()
+        # 已被结束（进程可能尚未被回收，returncode 仍为 None）
+        self._killed = False
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None and not self._killed
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    async def turn(self, prompt: str, *, deadlines: Deadlines, lang: str) -> AsyncIterator[str]:
+        """
+        写入一条用户消息，产出本轮的文本增量，直到 result 事件。期限与看门狗同 stream_subprocess（见 deadline.RunClock）：
+        软期限时中断进程、继续产出到本轮结束或硬期限，末尾产出带 truncated 标记的「已截断」提示。
+        被截断的进程状态未知，本轮结束后即结束它；会话已由 CLI 持久化，下次（如 /continue）以 --resume 重新拉起。
+        """
+        assert self.proc.stdin is not None and self.proc.stdout is not None
+        clock = RunClock(self.proc, deadlines)
+        parser = StreamJsonParser()
+        emitted = False
+        message = {"type": "user", "message": {"role": "user", "content": [{"type": "text", "text": prompt}]}}
+        done = False
+        try:
+            self.proc.stdin.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+            await self.proc.stdin.drain()
+            while not done:
+                data = await clock.read(self.proc.stdout, READ_CHUNK_SIZE)
+                if not data:
+                    break
+                for line in self._splitter.feed(self._decoder.feed(data)):
+                    delta = parser(line)
+                    if delta:
+                        if not emitted:
+                            metrics.observe("agent_ttft_seconds", time.monotonic() - clock.started, backend="claude")
+                        emitted = True
+                        yield delta
+                    if parser.result is not None:
+                        done = True
+                        break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            # 本轮没有正常结束（截断、进程退出、被取消或调用方提前停止迭代）：进程状态未知，结束它
+            if not done or clock.truncated:
+                self.kill()
+            if parser.session_id:
+                self.session_id = parser.session_id
+            self.last_used = time.monotonic()
+            metrics.observe("agent_run_seconds", time.monotonic() - clock.started, backend="claude", mode="resident")
+        if clock.truncated:
+            if emitted:
+                yield AgentReply("\n\n" + t(lang, "agent_truncated"), truncated=True)
+            else:
+                yield truncated_reply("", lang, clock=clock)
+            return
+        if not emitted:
+            yield no_output_reply(lang, error=parser.error)
+        elif parser.error:
+            # result 事件 is_error：带回错误信息供断路器归类（空文本，不显示）
+            yield AgentReply("", error=parser.error)
+
+    def kill(self) -> None:
+        self._killed = True
+        if self.proc.returncode is None:
+            kill_tree(self.proc)
+
+
+class ResidentManager:
+    """按会话 key 管理常驻进程：LRU + 空闲超时 + 内存压力回收。"""
+
+    def __init__(self) -> None:
+        self._sessions: "OrderedDict[str, ResidentSession]" = OrderedDict()
+        # 被回收会话的 claude session_id，重建时用于 --resume
+        self._evicted: dict[str, str] = {}
+        self._janitor: Optional[asyncio.Task] = None
+        self._config = ResidentConfig()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("claude_resident_sessions", len(self._sessions))
+
+    def _evict(self, key: str, reason: str) -> None:
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        if session.session_id:
+            self._evicted[key] = session.session_id
+        session.kill()
+        metrics.inc("claude_resident_evictions_total", reason=reason)
+        logger.info("claude resident session %s evicted (%s)", key, reason)
+        self._publish()
+
+    def _evict_lru_idle(self, reason: str) -> bool:
+        for key, session in self._sessions.items():
+            if not session.busy:
+                self._evict(key, reason)
+                return True
+        return False
+
+    def _enforce_limits(self) -> None:
+        cfg = self._config
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if not session.alive:
+                self._evict(key, "exited")
+            elif not session.busy and now - session.last_used > cfg.idle_timeout:
+                self._evict(key, "idle")
+        while len(self._sessions) > cfg.max_sessions and self._evict_lru_idle("capacity"):
+            pass
+        if cfg.min_available_mb > 0:
+            while self._sessions:
+                avail = _mem_available_mb()
+                if avail is None or avail >= cfg.min_available_mb:
+                    break
+                if not self._evict_lru_idle("memory"):
+                    break
+
+    async def _janitor_loop(self) -> None:
+        while self._sessions:
+            await asyncio.sleep(min(30.0, max(1.0, self._config.idle_timeout / 4)))
+            self._enforce_limits()
+        self._janitor = None
+
+    def discard(self, key: str) -> None:
+        """结束该 key 的常驻进程并忘记其会话（/new）。"""
+        self._evict(key, "reset")
+        self._evicted.pop(key, None)
+
+    async def _get(
+        self,
+        key: str,
+        build_args: Callable[[Optional[str]], list[str]],
+        *,
+        resume_id: Optional[str],
+        new_session: bool,
+        env: Optional[Mapping[str, str]],
+        cwd: Optional[str],
+        limits: Optional[ResourceLimits],
+    ) -> ResidentSession:
+        if new_session:
+            self.discard(key)
+        session = self._sessions.get(key)
+        if session is not None and (
+            not session.alive or session.cwd != cwd or (resume_id and resume_id != session.session_id)
+        ):
+            self._evict(key, "replaced")
+            session = None
+        if session is None:
+            if not new_session and not resume_id:
+                resume_id = self._evicted.get(key)
+            self._enforce_limits()
+            while len(self._sessions) >= self._config.max_sessions and self._evict_lru_idle("capacity"):
+                pass
+            proc = await create_process(
+                build_args(resume_id),
+                env=env,
+                cwd=cwd,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=DEVNULL,
+                backend="claude",
+                limits=limits,
+            )
+            session = ResidentSession(key, proc, resume_id, cwd)
+            self._sessions[key] = session
+            self._evicted.pop(key, None)
+            metrics.inc("claude_resident_spawns_total")
+            self._publish()
+        self._sessions.move_to_end(key)
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._janitor_loop())
+        return session
+
+    async def run(
+        self,
+        key: str,
+        prompt: str,
+        build_args: Callable[[Optional[str]], list[str]],
+        *,
+        config: ResidentConfig,
+        resume_id: Optional[str],
+        new_session: bool,
+        env: Optional[Mapping[str, str]],
+        cwd: Optional[str],
+        timeout: float,
+        lang: str,
+        limits: Optional[ResourceLimits] = None,
+        deadlines: Optional[Deadlines] = None,
+        agent_config: Optional[Mapping[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        在 key 对应的常驻进程上跑一轮；build_args(resume_id) 生成拉起进程用的 argv。
+        deadlines 为本轮的软 / 硬期限与看门狗设置（见 deadline.get_deadlines），缺省按 timeout 取默认值。
+        limits 作用于整个常驻进程（CPU 时间按进程累计，跨多轮对话），其中的 cgroup 权重由调用方按运行优先级并入
+        （priority.with_weights）；每轮开始前按 agent_config 的档位设置进程组的 nice / ionice（见 priority）。
+        """
+        self._config = config
+        session = await self._get(
+            key, build_args, resume_id=resume_id, new_session=new_session, env=env, cwd=cwd, limits=limits
+        )
+        deadlines = deadlines or get_deadlines(None, timeout, events=True)
+        async with session.lock:
+            priority.apply(session.proc.pid, agent_config)
+            async for delta in session.turn(prompt, deadlines=deadlines, lang=lang):
+                yield delta
+        if not session.alive:
+            self._evict(key, "exited")
+
+    def close_all(self) -> None:
+        for key in list(self._sessions):
+            self._evict(key, "shutdown")
+
+
+manager = ResidentManager()
@@ -1,14 +1,45 @@
 """OpenAI Codex CLI backend."""
 from __future__ import annotations
 
-import asyncio
+import json
+import logging
 import os
 import shutil
-import tempfile
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
-from openab.core.i18n import t
+from openab.core import metrics
+from openab.core.codex_sessions import list_codex_sessions
+
+from .deadline import truncated_reply
+from .plan import InvocationPlan, get_plan, make_plan
+from .pool import get_pool_config
+from .process import DEVNULL, spawn
+from .registry import Capabilities
+from .result import AgentReply, TokenUsage, no_output_reply, report_session
+from .stream import consume_lines, stream_subprocess
+from .transport import use_stdin
+
+logger = logging.getLogger(__name__)
+
+CLI_NAME = "codex"
+# 凭据目录池（见 homes）通过该环境变量切换登录目录
+HOME_ENV = "CODEX_HOME"
+DEFAULT_HOME = "~/.codex"
+# 每用户独立目录（见 homes）从登录目录链接的文件
+SHARED_FILES = ("auth.json", "config.toml")
+CAPABILITIES = Capabilities(streaming=True, sessions=True, resume=True, continue_session=True)
+AUTH_STATUS_ARGS = ("login", "status")
+AUTH_LOGIN_ARGS = ("login",)
+
+
+def list_sessions(max_sessions: int = 12, home: Optional[Path] = None) -> list[tuple[str, str]]:
+    """~/.codex/sessions 与 history.jsonl 中的历史会话，供 /resume 选择；home 为用户自己的 CODEX_HOME 时只扫描该目录。"""
+    if home is not None:
+        return list_codex_sessions(
+            max_sessions=max_sessions, sessions_dir=home / "sessions", history_path=home / "history.jsonl"
+        )
+    return list_codex_sessions(max_sessions=max_sessions)
 
 
 def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
@@ -60,66 +91,226 @@ def _codex_session_override(agent_config: dict[str, Any] | None) -> tuple[bool,
     return (False, None)
 
 
-async def run_async(
-    prompt: str,
-    *,
-    workspace: Optional[Path] = None,
-    timeout: int = 300,
-    lang: str = "en",
-    agent_config: Optional[dict[str, Any]] = None,
-) -> str:
+def _compile_plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return make_plan(
+        _find_cmd(agent_config),
+        flags=["--skip-git-repo-check"] if _skip_git_check(agent_config) else [],
+        options={"continue_session": _use_continue_session(agent_config)},
+    )
+
+
+def _plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return get_plan(
+        "codex",
+        agent_config,
+        _compile_plan,
+        env_keys=("CODEX_CMD", "CODEX_SKIP_GIT_CHECK", "CODEX_CONTINUE_SESSION"),
+    )
+
+
+def continues_latest(agent_config: Mapping[str, Any] | None = None) -> bool:
     """
-    Codex CLI：默认延续上一会话（exec resume --last）；
-    支持 _session_new（新会话）与 _resume_id（指定会话）。最终回复在 stdout。
+    是否延续「最近一次会话」（exec resume --last）：未指定新会话 / resume id 且开启 continue_session，
+    且调用方不能固定会话（能固定时改为开新会话，见 _build_args）。
     """
-    cmd = _find_cmd(agent_config)
+    use_new, resume_id = _codex_session_override(agent_config)  # type: ignore[arg-type]
+    if use_new or resume_id or (agent_config or {}).get("_pin_session"):
+        return False
+    return bool(_plan(agent_config).options.get("continue_session"))
+
+
+def invocation_plan(agent_config: Mapping[str, Any] | None = None) -> InvocationPlan:
+    """当前配置下的调用计划（可执行文件、环境变量），供健康探测使用。"""
+    return _plan(agent_config)
+
+
+def _build_args(
+    prompt: Optional[str],
+    workspace: Optional[Path],
+    agent_config: dict[str, Any] | None,
+    *,
+    json_events: bool = False,
+    plan: Optional[InvocationPlan] = None,
+) -> list[str]:
+    plan = plan or _plan(agent_config)
+    cmd = plan.executable
     use_new, resume_id = _codex_session_override(agent_config)
-    skip_git = _skip_git_check(agent_config)
+    if not resume_id and plan.options.get("continue_session") and (agent_config or {}).get("_pin_session"):
+        # 调用方能固定会话但尚未固定：开新会话并固定其 thread_id（见 _pin），不接续其他用户的 --last
+        use_new = True
 
     if use_new:
         args = [cmd, "exec"]
     elif resume_id:
         args = [cmd, "exec", "resume", resume_id]
-    elif _use_continue_session(agent_config):
+    elif plan.options.get("continue_session"):
         args = [cmd, "exec", "resume", "--last"]
     else:
         args = [cmd, "exec"]
 
-    if skip_git:
-        args.append("--skip-git-repo-check")
+    args.extend(plan.flags)
     # 仅 exec（新会话）支持 --cd；exec resume 子命令不支持 --cd，传了会报错退出。resume 时用 subprocess cwd 控制工作目录。
     if workspace is not None and use_new:
         args.extend(["--cd", str(workspace)])
+    if json_events:
+        args.append("--json")
+    # prompt 为 None 时传 "-"，由 stdin 读取提示（预热进程池）
+    args.append(prompt if prompt is not None else "-")
+    return args
+
+
+class _CodexEventParser:
+    """
+    解析 codex exec --json 的 JSONL 事件：agent_message 条目完成时产出其文本，多条之间空行分隔。
+    同时记录 thread_id、最后一条 agent_message（即 --output-last-message 的内容）、
+    turn.completed 中的 token 用量，以及 turn.failed / error 事件的错误信息。
+    """
+
+    def __init__(self) -> None:
+        self.thread_id: Optional[str] = None
+        self.last_message: str = ""
+        self.tokens: Optional[TokenUsage] = None
+        self.error: Optional[str] = None
+        self._count = 0
+
+    def __call__(self, line: str) -> Optional[str]:
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(event, dict):
+            return None
+        typ = event.get("type")
+        text = ""
+        if typ == "thread.started":
+            self.thread_id = str(event.get("thread_id") or "") or None
+        elif typ == "item.completed":
+            item = event.get("item") or {}
+            if item.get("type") in ("agent_message", "assistant_message"):
+                text = str(item.get("text") or "")
+        elif typ == "turn.completed":
+            self.tokens = _token_usage(event.get("usage"))
+        elif typ in ("turn.failed", "error"):
+            err = event.get("error")
+            self.error = str((err.get("message") if isinstance(err, dict) else err) or event.get("message") or "")
+        elif isinstance(event.get("msg"), dict):
+            # 旧版事件格式：{"id": ..., "msg": {"type": "agent_message", "message": ...}}
+            msg = event["msg"]
+            if msg.get("type") == "agent_message":
+                text = str(msg.get("message") or "")
+        if not text:
+            return None
+        self.last_message = text
+        self._count += 1
+        return text if self._count == 1 else "\n\n" + text
 
-    # 用 -o 把最终回复写入临时文件，避免依赖 stdout/stderr（非 TTY 下 Codex 可能不往 stdout 打）
-    out_file = tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False, encoding="utf-8")
-    out_path = out_file.name
-    out_file.close()
-    args.extend(["--output-last-message", out_path])
-    args.append(prompt)
 
-    cwd = str(workspace) if workspace else None
+def _token_usage(raw: Any) -> Optional[TokenUsage]:
+    if not isinstance(raw, dict):
+        return None
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *args,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL,
-            env=os.environ.copy(),
-            cwd=cwd,
+        return TokenUsage(
+            input_tokens=int(raw.get("input_tokens") or 0),
+            output_tokens=int(raw.get("output_tokens") or 0),
+            cached_input_tokens=int(raw.get("cached_input_tokens") or 0),
         )
-        try:
-            await asyncio.wait_for(proc.communicate(), timeout=timeout)
-        except asyncio.TimeoutError:
-            proc.kill()
-            await proc.wait()
-            return t(lang, "agent_timeout")
-        try:
-            text = Path(out_path).read_text(encoding="utf-8", errors="replace").strip()
-        except OSError:
-            text = ""
-        return text or t(lang, "agent_no_output")
-    finally:
-        try:
-            os.unlink(out_path)
-        except OSError:
-            pass
+    except (TypeError, ValueError):
+        return None
+
+
+def _record_tokens(tokens: Optional[TokenUsage]) -> None:
+    if tokens is None:
+        return
+    metrics.inc("agent_tokens_total", tokens.input_tokens, backend="codex", kind="input")
+    metrics.inc("agent_tokens_total", tokens.cached_input_tokens, backend="codex", kind="cached_input")
+    metrics.inc("agent_tokens_total", tokens.output_tokens, backend="codex", kind="output")
+
+
+def _pin(plan: InvocationPlan, agent_config: Optional[Mapping[str, Any]], thread_id: Optional[str]) -> None:
+    """延续会话模式下，把本次的 thread_id 固定给调用方，后续以 exec resume <id> 恢复（不再依赖 --last）。"""
+    if plan.options.get("continue_session"):
+        report_session(agent_config, thread_id)
+
+
+async def run_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> str:
+    """
+    Codex CLI：默认延续上一会话（exec resume --last）；
+    支持 _session_new（新会话）与 _resume_id（指定会话）。
+    能固定会话的调用方（聊天用户）尚未固定时开新会话，事件流中的 thread_id 经 report_session 固定给调用方，
+    之后以 exec resume <id> 继续。
+    以 --json 在 stdout 输出事件流，边读边解析，取最后一条 agent_message 作为回复（不落盘）。
+    """
+    pool_cfg = get_pool_config(agent_config, "codex")
+    via_stdin = use_stdin(prompt, agent_config, "codex", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    args = _build_args(None if via_stdin else prompt, workspace, agent_config, json_events=True, plan=plan)
+    proc = await spawn(
+        args,
+        backend="codex",
+        env=plan.env,
+        cwd=str(workspace) if workspace else None,
+        stderr=DEVNULL,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
+    )
+    parser = _CodexEventParser()
+    clock = await consume_lines(proc, parser, timeout, agent_config=agent_config)
+    _record_tokens(parser.tokens)
+    _pin(plan, agent_config, parser.thread_id)
+    if clock.truncated:
+        return truncated_reply(
+            parser.last_message, lang, usage=proc.usage, clock=clock, tokens=parser.tokens, session_id=parser.thread_id
+        )
+    text = parser.last_message.strip()
+    if not text and parser.error:
+        logger.warning("codex run failed: %s", parser.error)
+    error = parser.error or None
+    if not text:
+        return no_output_reply(lang, usage=proc.usage, tokens=parser.tokens, session_id=parser.thread_id, error=error)
+    return AgentReply(text, usage=proc.usage, tokens=parser.tokens, session_id=parser.thread_id, error=error)
+
+
+async def run_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """流式版本：exec --json 输出 JSONL 事件，agent_message 完成即产出。"""
+    parser = _CodexEventParser()
+    pool_cfg = get_pool_config(agent_config, "codex")
+    via_stdin = use_stdin(prompt, agent_config, "codex", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    args = _build_args(None if via_stdin else prompt, workspace, agent_config, json_events=True, plan=plan)
+    async for delta in stream_subprocess(
+        args,
+        backend="codex",
+        env=plan.env,
+        cwd=str(workspace) if workspace else None,
+        timeout=timeout,
+        lang=lang,
+        parse_line=parser,
+        events=True,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
+    ):
+        yield delta
+    if parser.error:
+        # turn.failed / error 事件：带回错误信息供断路器归类（空文本，不显示）
+        yield AgentReply("", error=parser.error)
+    _record_tokens(parser.tokens)
+    _pin(plan, agent_config, parser.thread_id)
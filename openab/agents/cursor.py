@@ -1,13 +1,33 @@
 """Cursor Agent CLI backend."""
 from __future__ import annotations
 
-import asyncio
 import os
 import shutil
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
-from openab.core.i18n import t
+from openab.core.cursor_chats import list_cursor_sessions
+
+from .capture import capture, reply_from_output
+from .plan import InvocationPlan, get_plan, make_plan
+from .process import STDOUT, spawn
+from .registry import Capabilities
+from .result import AgentReply, report_session
+from .stream import StreamJsonParser, stream_subprocess
+from .transport import prompt_argument
+
+CLI_NAME = "agent"
+# 每用户独立目录（见 homes，HOME）从登录目录链接的文件
+SHARED_FILES = (".config/cursor/auth.json", ".cursor/cli-config.json")
+CAPABILITIES = Capabilities(streaming=True, sessions=True, resume=True, continue_session=True)
+AUTH_STATUS_ARGS = ("status",)
+AUTH_LOGIN_ARGS = ("login",)
+
+
+def list_sessions(max_sessions: int = 12, home: Optional[Path] = None) -> list[tuple[str, str]]:
+    """~/.cursor/chats 下的历史会话，供 /resume 选择；home 为用户自己的 HOME 时只扫描该目录。"""
+    chats_dir = home / ".cursor" / "chats" if home is not None else None
+    return list_cursor_sessions(max_sessions=max_sessions, chats_dir=chats_dir)
 
 
 def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
@@ -71,35 +91,71 @@ def _cursor_session_override(agent_config: dict[str, Any] | None) -> tuple[bool,
     return (False, None)
 
 
-async def run_async(
+def _compile_plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    cmd = _find_cmd(agent_config)
+    return make_plan(
+        cmd,
+        flags=["--force"] if _allow_code_execution(agent_config) else [],
+        env=_build_env(cmd),
+        options={"continue_session": _use_continue_session(agent_config)},
+    )
+
+
+def _plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return get_plan("cursor", agent_config, _compile_plan, env_keys=("CURSOR_AGENT_CMD", "CURSOR_AGENT_CONTINUE"))
+
+
+def continues_latest(agent_config: Mapping[str, Any] | None = None) -> bool:
+    """
+    是否延续「最近一次会话」（--continue）：未指定新会话 / --resume 且开启 continue_session，
+    且调用方不能固定会话（能固定时改为开新会话，见 _wants_pin）。
+    """
+    use_new, resume_id = _cursor_session_override(agent_config)  # type: ignore[arg-type]
+    if use_new or resume_id or (agent_config or {}).get("_pin_session"):
+        return False
+    return bool(_plan(agent_config).options.get("continue_session"))
+
+
+def invocation_plan(agent_config: Mapping[str, Any] | None = None) -> InvocationPlan:
+    """当前配置下的调用计划（可执行文件、环境变量），供健康探测使用。"""
+    return _plan(agent_config)
+
+
+def _build_args(
     prompt: str,
+    workspace: Optional[Path],
+    agent_config: dict[str, Any] | None,
     *,
-    workspace: Optional[Path] = None,
-    timeout: int = 300,
-    lang: str = "en",
-    agent_config: Optional[dict[str, Any]] = None,
-) -> str:
-    """Cursor Agent CLI: agent --print --trust；可选 --continue / --resume <id>。"""
-    cmd = _find_cmd(agent_config)
+    output_format: str = "text",
+    plan: Optional[InvocationPlan] = None,
+) -> list[str]:
+    plan = plan or _plan(agent_config)
     base_args = [
-        cmd,
+        plan.executable,
         "agent",
         "--print",
-        "--output-format", "text",
+        "--output-format", output_format,
         "--trust",
     ]
-    if _allow_code_execution(agent_config):
-        base_args.append("--force")
+    if output_format == "stream-json":
+        base_args.append("--stream-partial-output")
+    base_args.extend(plan.flags)
     use_new, resume_id = _cursor_session_override(agent_config)
     if use_new:
         pass  # 不传 --continue 也不传 --resume，即新会话
     elif resume_id:
         base_args.extend(["--resume", resume_id])
-    elif _use_continue_session(agent_config):
+    elif _wants_pin(plan, agent_config):
+        pass  # 尚未固定会话：开新会话并固定其 chat ID，不接续其他用户的「最近一次会话」
+    elif plan.options.get("continue_session"):
         base_args.append("--continue")
     if workspace is not None:
         base_args.extend(["--workspace", str(workspace)])
     base_args.extend(["--", prompt])
+    return base_args
+
+
+def _build_env(cmd: str) -> dict[str, str]:
     env = os.environ.copy()
     # 减少子进程 stdout 缓冲，便于尽早拿到输出（非 TTY 时 Cursor/Node 常为块缓冲）
     env.setdefault("PYTHONUNBUFFERED", "1")
@@ -108,18 +164,80 @@ async def run_async(
         extra = ["/usr/local/bin", os.path.expanduser("~/.local/bin"), os.path.expanduser("~/bin")]
         existing = env.get("PATH", "")
         env["PATH"] = (existing + ":" + ":".join(extra)) if existing else ":".join(extra)
-    proc = await asyncio.create_subprocess_exec(
-        *base_args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT,
-        env=env,
-        cwd=str(workspace) if workspace else None,
-    )
-    try:
-        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return t(lang, "agent_timeout")
-    text = (stdout or b"").decode("utf-8", errors="replace").strip()
-    return text or t(lang, "agent_no_output")
+    return env
+
+
+def _wants_pin(plan: InvocationPlan, agent_config: Optional[Mapping[str, Any]]) -> bool:
+    """
+    延续会话模式下、调用方能固定会话（有 _pin_session）且尚未指定 --resume 时，本次开新会话（不传 --continue），
+    并从输出中取得其 chat ID：之后该聊天用户以 --resume <id> 继续，不会接续或共享全局「最近一次会话」。
+    """
+    if not plan.options.get("continue_session") or not (agent_config or {}).get("_pin_session"):
+        return False
+    return _cursor_session_override(agent_config)[1] is None
+
+
+async def run_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> str:
+    """
+    Cursor Agent CLI: agent --print --trust；可选 --continue / --resume <id>。
+    需要固定会话时（见 _wants_pin）开新会话并改用 stream-json 输出，从事件中取得 chat ID 并只保留回复文本。
+    """
+    plan = _plan(agent_config)
+    parser = StreamJsonParser() if _wants_pin(plan, agent_config) else None
+    with prompt_argument(prompt, workspace, agent_config, "cursor") as arg:
+        base_args = _build_args(
+            arg, workspace, agent_config, output_format="text" if parser is None else "stream-json", plan=plan
+        )
+        proc = await spawn(
+            base_args,
+            backend="cursor",
+            stderr=STDOUT,
+            env=plan.env,
+            cwd=str(workspace) if workspace else None,
+            agent_config=agent_config,
+        )
+        out = await capture(proc, timeout, agent_config=agent_config, filter_line=parser)
+    reply = reply_from_output(out, lang, usage=proc.usage)
+    if parser is not None:
+        report_session(agent_config, parser.session_id)
+        reply.session_id = parser.session_id
+    return reply
+
+
+async def run_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """流式版本：--output-format stream-json --stream-partial-output，逐段产出回复文本。"""
+    plan = _plan(agent_config)
+    parser = StreamJsonParser()
+    with prompt_argument(prompt, workspace, agent_config, "cursor") as arg:
+        args = _build_args(arg, workspace, agent_config, output_format="stream-json", plan=plan)
+        async for delta in stream_subprocess(
+            args,
+            backend="cursor",
+            env=plan.env,
+            cwd=str(workspace) if workspace else None,
+            timeout=timeout,
+            lang=lang,
+            parse_line=parser,
+            events=True,
+            agent_config=agent_config,
+        ):
+            yield delta
+    if parser.error:
+        # result 事件 is_error：带回错误信息供断路器归类（空文本，不显示）
+        yield AgentReply("", error=parser.error)
+    if _wants_pin(plan, agent_config):
+        report_session(agent_config, parser.session_id)
@@ -0,0 +1,209 @@
+"""运行期限：软期限（agent.timeout）到达时不再直接丢弃输出，而是中断 CLI 并交付已产出的部分。
+
+- 软期限：向进程组发 SIGINT（同 Ctrl-C，CLI 借此保存会话记录），继续收集输出直到进程退出或硬期限；
+  回复为已产出的文本 + 「已截断」提示，AgentReply.truncated 为 True；
+- 硬期限（agent.hard_timeout，默认软期限 + 15 秒）：SIGKILL 整个进程组。
+会话仍可继续：聊天端 /continue、API 请求体 "continue": true 以 continuation_prompt 接着上次的输出继续。
+
+另有分阶段的看门狗，用于尽早识别卡住的 CLI（等待登录、锁等），而不是占着并发名额直到软期限：
+- agent.spawn_timeout：进程创建（含取用预热进程、经 fork server 启动）的上限，见 process.spawn；
+- agent.first_output_timeout：启动后迟迟没有任何输出的上限；
+- agent.inactivity_timeout：两次输出之间的最长静默（默认关闭：工具执行期间可能长时间无输出）。
+后两者只作用于事件流输出（stream-json / --json），这类 CLI 启动后立即输出事件；纯文本模式往往到结束时
+才一次性输出，无法据此判断是否卡住。看门狗触发后同样先 SIGINT，STALL_GRACE_SECONDS 后结束进程组。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+from openab.core.i18n import t
+
+from .process import AgentProcess, kill_tree, signal_tree
+from .result import AgentReply, RunUsage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HARD_GRACE_SECONDS = 15.0
+DEFAULT_FIRST_OUTPUT_TIMEOUT = 60.0
+# 看门狗触发（判定为卡住）后等待进程自行退出的秒数
+STALL_GRACE_SECONDS = 5.0
+# 续写提示中附带的上次输出末尾长度（字符）
+CONTINUATION_TAIL_CHARS = 4000
+
+_CONTINUATION_PROMPT = (
+    "Your previous reply to the request below was cut off by a time limit. "
+    "Continue from exactly where it stopped; do not repeat what was already written.\n\n"
+    "Request:\n{prompt}\n\n"
+    "End of the partial reply:\n{tail}"
+)
+
+
+@dataclass(frozen=True)
+class Deadlines:
+    """soft / hard 为从启动起算的秒数；first_output / inactivity 为看门狗秒数，0 表示不启用。"""
+
+    soft: float
+    hard: float
+    first_output: float = 0.0
+    inactivity: float = 0.0
+
+    def stall_at(self, started: float, last_output: Optional[float]) -> Optional[float]:
+        """下一次看门狗检查的时刻（monotonic）；未启用时为 None。"""
+        if last_output is None:
+            return started + self.first_output if self.first_output > 0 else None
+        return last_output + self.inactivity if self.inactivity > 0 else None
+
+
+def _seconds(agent_config: Optional[Mapping[str, Any]], key: str, default: float) -> float:
+    raw = ((agent_config or {}).get("agent") or {}).get(key)
+    if raw in (None, ""):
+        return default
+    try:
+        return max(0.0, float(raw))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_deadlines(
+    agent_config: Optional[Mapping[str, Any]], timeout: float, *, events: bool = False
+) -> Deadlines:
+    """
+    软期限为 timeout；硬期限读 agent.hard_timeout（小于软期限时按软期限处理）。
+    events 为 True（输出为事件流）时启用 agent.first_output_timeout / agent.inactivity_timeout。
+    """
+    hard = _seconds(agent_config, "hard_timeout", timeout + DEFAULT_HARD_GRACE_SECONDS)
+    if not events:
+        return Deadlines(soft=float(timeout), hard=max(float(timeout), hard))
+    return Deadlines(
+        soft=float(timeout),
+        hard=max(float(timeout), hard),
+        first_output=_seconds(agent_config, "first_output_timeout", DEFAULT_FIRST_OUTPUT_TIMEOUT),
+        inactivity=_seconds(agent_config, "inactivity_timeout", 0.0),
+    )
+
+
+class RunClock:
+    """一次运行的期限跟踪：读 stdout / 等待退出都经由它，超期或卡住时依次中断、结束进程。"""
+
+    def __init__(self, proc: AgentProcess, deadlines: Deadlines, *, started: Optional[float] = None) -> None:
+        self.proc = proc
+        self.deadlines = deadlines
+        self.started = time.monotonic() if started is None else started
+        self.last_output: Optional[float] = None
+        # 已过软期限或看门狗触发（输出将被标记为截断）
+        self.truncated = False
+        # 看门狗触发的阶段："first_output" / "inactivity"；因软期限截断时为 None
+        self.stalled: Optional[str] = None
+        # 已过硬期限（进程组已被 SIGKILL）
+        self.killed = False
+        self._hard_at = self.started + deadlines.hard
+
+    def _next_at(self) -> float:
+        if self.truncated:
+            return self._hard_at
+        at = self.started + self.deadlines.soft
+        stall = self.deadlines.stall_at(self.started, self.last_output)
+        return at if stall is None else min(at, stall)
+
+    def remaining(self) -> float:
+        return max(0.0, self._next_at() - time.monotonic())
+
+    def _expire(self) -> bool:
+        """到达当前期限：软期限 / 看门狗时中断进程并返回 True（继续读）；硬期限时结束进程组并返回 False。"""
+        if not self.truncated:
+            self.truncated = True
+            now = time.monotonic()
+            backend, pid = self.proc.backend, self.proc.pid
+            if now < self.started + self.deadlines.soft:
+                self.stalled = "first_output" if self.last_output is None else "inactivity"
+                self._hard_at = min(self._hard_at, now + STALL_GRACE_SECONDS)
+                metrics.inc("agent_stalls_total", backend=backend, phase=self.stalled)
+                logger.warning("agent %s pid %d stalled (%s); interrupting", backend, pid, self.stalled)
+            else:
+                metrics.inc("agent_timeouts_total", backend=backend)
+                logger.info("agent %s pid %d hit soft deadline; interrupting", backend, pid)
+            signal_tree(self.proc, signal.SIGINT)
+            if self.remaining() > 0:
+                return True
+        self.killed = True
+        metrics.inc("agent_hard_kills_total", backend=self.proc.backend)
+        logger.warning("agent %s pid %d hit hard deadline; killing", self.proc.backend, self.proc.pid)
+        kill_tree(self.proc)
+        return False
+
+    async def read(self, stream: asyncio.StreamReader, n: int) -> bytes:
+        """带期限的 stream.read；硬期限到达后返回 b""（视为 EOF）。"""
+        if self.killed:
+            return b""
+        while True:
+            try:
+                data = await asyncio.wait_for(stream.read(n), timeout=self.remaining())
+            except asyncio.TimeoutError:
+                if not self._expire():
+                    return b""
+                continue
+            if data:
+                self.last_output = time.monotonic()
+            return data
+
+    async def wait(self) -> None:
+        """等待进程退出（同样受期限约束）。"""
+        while not self.killed:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.proc.wait()), timeout=self.remaining())
+                return
+            except asyncio.TimeoutError:
+                self._expire()
+        await self.proc.wait()
+
+    @property
+    def outcome(self) -> str:
+        """没有任何输出就被截断时的结果（AgentReply.outcome）：看门狗触发为 stalled，否则为 timed_out。"""
+        return "stalled" if self.stalled else "timed_out"
+
+    def timeout_message(self, lang: str) -> str:
+        """没有任何输出就被截断时的提示：看门狗触发时说明卡住的阶段，否则为普通超时。"""
+        if self.stalled == "first_output":
+            return t(lang, "agent_stalled", seconds=f"{self.deadlines.first_output:g}")
+        return t(lang, "agent_timeout")
+
+
+def truncated_reply(
+    text: str,
+    lang: str,
+    *,
+    usage: Optional[RunUsage] = None,
+    clock: Optional[RunClock] = None,
+    **kwargs: Any,
+) -> AgentReply:
+    """
+    软期限后的回复：有部分输出时附「已截断」提示并标记 truncated，
+    否则为超时文案（见 RunClock.timeout_message），outcome 为 timed_out / stalled。
+    """
+    text = text.strip()
+    if not text:
+        if clock is None:
+            return AgentReply(t(lang, "agent_timeout"), usage=usage, outcome="timed_out")
+        return AgentReply(clock.timeout_message(lang), usage=usage, outcome=clock.outcome)
+    return AgentReply(text + "\n\n" + t(lang, "agent_truncated"), usage=usage, truncated=True, **kwargs)
+
+
+def strip_truncation_note(text: str) -> str:
+    """去掉 truncated_reply 附加的提示，只留已产出的文本。"""
+    for lang in ("zh", "en"):
+        note = "\n\n" + t(lang, "agent_truncated")
+        if text.endswith(note):
+            return text[: -len(note)]
+    return text
+
+
+def continuation_prompt(prompt: str, partial: str) -> str:
+    """接着被截断的回复继续：原请求 + 部分回复的末尾。"""
+    tail = strip_truncation_note(partial).strip()[-CONTINUATION_TAIL_CHARS:]
+    return _CONTINUATION_PROMPT.format(prompt=prompt.strip(), tail=tail)
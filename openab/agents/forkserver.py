@@ -0,0 +1,342 @@
+"""Fork server：一个只依赖标准库的小进程，代替体积庞大的 bot / API 主进程 fork 出 agent CLI。
+
+主进程加载了 discord.py、python-telegram-bot、FastAPI 等，每次直接 fork 都要复制其页表，
+并发时还会引发大量写时复制缺页。启用后，主进程在启动时 exec 本文件（不导入 openab 包，
+只占几 MB），之后经 Unix socket 发送 argv / env / cwd，并以 SCM_RIGHTS 传入管道的子进程端；
+服务端在独立会话中启动 CLI，回报 pid，进程退出后回报退出码与 rusage。
+
+协议（每次启动一个连接）：
+    客户端 → 8 字节长度（附带 fd）+ JSON {args, env, cwd, stdio: [stdin, stdout, stderr]}
+        stdio 取值 "fd"（按顺序使用附带的 fd）| "devnull" | "stdout"（仅 stderr）| "inherit"
+    服务端 → {"pid": N} 或 {"error": "...", "errno": N, "filename": ...}，随后 {"exit": code, "rusage": [utime, stime, maxrss]}
+    客户端在进程退出前断开连接时，服务端结束整个进程组。
+
+配置：agent.forkserver: true，或环境变量 OPENAB_FORKSERVER=1。
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!Q")
+_MAX_FDS = 3
+_START_TIMEOUT = 5.0
+
+_socket_path: Optional[str] = None
+_server: Optional[subprocess.Popen] = None
+
+
+class ForkServerUnavailable(Exception):
+    """fork server 不可用（未启动、已退出或协议错误）；调用方应退回本地启动。"""
+
+
+# ---------- 服务端（独立进程） ----------
+
+
+def _read_exact(conn: socket.socket, n: int, buf: bytes = b"") -> bytes:
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("client closed")
+        buf += chunk
+    return buf
+
+
+def _send(conn: socket.socket, payload: dict[str, Any]) -> None:
+    conn.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+
+
+def _default_sigint() -> None:
+    # 服务端忽略 SIGINT，而忽略的信号会经 fork / exec 继承；CLI 需要恢复默认处理，
+    # 软期限与停滞检测发出的 SIGINT 才能让它收尾退出
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def _handle(conn: socket.socket) -> None:
+    fds: list[int] = []
+    try:
+        head, fds, _, _ = socket.recv_fds(conn, _HEADER.size, _MAX_FDS)
+        (size,) = _HEADER.unpack(_read_exact(conn, _HEADER.size, head))
+        req = json.loads(_read_exact(conn, size).decode("utf-8"))
+        passed = iter(fds)
+        stdio: list[Any] = []
+        for spec in req.get("stdio") or ["inherit"] * 3:
+            if spec == "fd":
+                stdio.append(next(passed))
+            elif spec == "devnull":
+                stdio.append(subprocess.DEVNULL)
+            elif spec == "stdout":
+                stdio.append(subprocess.STDOUT)
+            else:
+                stdio.append(None)
+        try:
+            proc = subprocess.Popen(
+                req["args"],
+                stdin=stdio[0],
+                stdout=stdio[1],
+                stderr=stdio[2],
+                env=req.get("env"),
+                cwd=req.get("cwd"),
+                start_new_session=True,
+                preexec_fn=_default_sigint,
+            )
+        except OSError as e:
+            _send(conn, {"error": e.strerror or str(e), "errno": e.errno or 0, "filename": e.filename})
+            return
+        finally:
+            for fd in fds:
+                os.close(fd)
+            fds = []
+        _send(conn, {"pid": proc.pid})
+
+        exited = threading.Event()
+
+        def _watch_client() -> None:
+            # 客户端断开而进程仍在：结束整个进程组
+            try:
+                while conn.recv(1):
+                    pass
+            except OSError:
+                pass
+            if not exited.is_set():
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+        watcher = threading.Thread(target=_watch_client, daemon=True)
+        watcher.start()
+        _, status, ru = os.wait4(proc.pid, 0)
+        exited.set()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        try:
+            _send(conn, {"exit": proc.returncode, "rusage": [ru.ru_utime, ru.ru_stime, ru.ru_maxrss]})
+        finally:
+            # 先 shutdown 唤醒 watcher 的 recv 并等它结束，再关闭 fd；
+            # 否则 fd 号可能已被新连接复用，被 watcher 读走对方的请求
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            watcher.join()
+    except (OSError, ValueError, KeyError, ConnectionError):
+        pass
+    finally:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+
+
+def serve(path: str, parent_pid: int) -> None:
+    """监听 path；父进程退出后自行结束。"""
+    if os.path.exists(path):
+        os.unlink(path)
+    old_umask = os.umask(0o077)
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(128)
+    sock.settimeout(1.0)
+    try:
+        while os.getppid() == parent_pid:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=_handle, args=(conn,), daemon=True).start()
+    finally:
+        sock.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# ---------- 客户端（主进程） ----------
+
+
+def enabled(agent_config: Optional[dict[str, Any]]) -> bool:
+    if os.environ.get("OPENAB_FORKSERVER", "").strip().lower() in ("1", "true", "yes"):
+        return True
+    return ((agent_config or {}).get("agent") or {}).get("forkserver") is True
+
+
+def socket_path() -> Optional[str]:
+    """已启动且仍在运行时返回 socket 路径。"""
+    if _socket_path is None or _server is None or _server.poll() is not None:
+        return None
+    return _socket_path
+
+
+def start(path: Optional[str] = None) -> Optional[str]:
+    """exec 一个 fork server 进程并等待其就绪；失败时记录警告并返回 None（之后本地启动）。"""
+    global _socket_path, _server
+    if sys.platform == "win32" or not hasattr(socket, "send_fds"):
+        return None
+    if socket_path() is not None:
+        return _socket_path
+    if path is None:
+        base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+        path = os.path.join(base, f"openab-forkserver-{os.getpid()}.sock")
+    server = subprocess.Popen(
+        [sys.executable, "-I", os.path.abspath(__file__), path, str(os.getpid())],
+        stdin=subprocess.DEVNULL,
+        close_fds=True,
+    )
+    deadline = time.monotonic() + _START_TIMEOUT
+    while not os.path.exists(path):
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            # 回收，避免在长期运行的主进程中留下僵尸进程
+            server.wait()
+            logger.warning("fork server failed to start; spawning agent CLIs directly")
+            return None
+        time.sleep(0.01)
+    _socket_path, _server = path, server
+    atexit.register(stop)
+    logger.info("fork server pid %d listening on %s", server.pid, path)
+    return path
+
+
+def stop() -> None:
+    global _server
+    if _server is not None and _server.poll() is None:
+        _server.terminate()
+        try:
+            _server.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            _server.kill()
+    _server = None
+
+
+class RemoteChild:
+    """fork server 启动的子进程：pid、主进程一侧的管道端，以及等待退出的连接。"""
+
+    def __init__(
+        self, pid: int, pipes: list[Optional[int]], reader: asyncio.StreamReader, transport: asyncio.BaseTransport
+    ) -> None:
+        self.pid = pid
+        # stdin 写端、stdout 读端、stderr 读端（未使用管道时为 None）
+        self.pipes = pipes
+        self._reader = reader
+        self._transport = transport
+
+    async def wait_exit(self) -> tuple[int, Any]:
+        """返回 (退出码, rusage)；fork server 中途退出时轮询到进程消失为止，返回 (255, None)。"""
+        try:
+            line = await self._reader.readline()
+            msg = json.loads(line) if line else {}
+        except (OSError, ValueError):
+            msg = {}
+        finally:
+            self._transport.close()
+        if "exit" not in msg:
+            while True:
+                try:
+                    os.kill(self.pid, 0)
+                except ProcessLookupError:
+                    break
+                except PermissionError:
+                    pass
+                await asyncio.sleep(0.5)
+            return 255, None
+        utime, stime, maxrss = msg.get("rusage") or (0.0, 0.0, 0)
+        return int(msg["exit"]), SimpleNamespace(ru_utime=utime, ru_stime=stime, ru_maxrss=maxrss)
+
+
+async def spawn(
+    args: list[str],
+    *,
+    env: Optional[Mapping[str, str]],
+    cwd: Optional[str],
+    stdin: Any,
+    stdout: Any,
+    stderr: Any,
+) -> RemoteChild:
+    """
+    请 fork server 启动 args。stdin/stdout/stderr 取 subprocess.PIPE / DEVNULL / STDOUT / None。
+    CLI 本身启动失败抛 OSError（与本地启动一致）；服务端不可用抛 ForkServerUnavailable。
+    """
+    path = socket_path()
+    if path is None:
+        raise ForkServerUnavailable("not running")
+    loop = asyncio.get_running_loop()
+    keep: list[Optional[int]] = [None, None, None]
+    send: list[int] = []
+    spec: list[str] = []
+    for i, mode in enumerate((stdin, stdout, stderr)):
+        if mode == subprocess.PIPE:
+            r, w = os.pipe()
+            child_end, keep[i] = (r, w) if i == 0 else (w, r)
+            send.append(child_end)
+            spec.append("fd")
+        elif mode == subprocess.DEVNULL:
+            spec.append("devnull")
+        elif mode == subprocess.STDOUT and i == 2:
+            spec.append("stdout")
+        else:
+            spec.append("inherit")
+    payload = json.dumps(
+        {"args": list(args), "env": dict(env) if env is not None else None, "cwd": cwd, "stdio": spec}
+    ).encode("utf-8")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    transport: Optional[asyncio.BaseTransport] = None
+    try:
+        try:
+            await loop.sock_connect(sock, path)
+            if send:
+                socket.send_fds(sock, [_HEADER.pack(len(payload))], send)
+            else:
+                sock.send(_HEADER.pack(len(payload)))
+            await loop.sock_sendall(sock, payload)
+        except OSError as e:
+            raise ForkServerUnavailable(str(e)) from e
+        finally:
+            for fd in send:
+                os.close(fd)
+        reader = asyncio.StreamReader(limit=2 ** 16)
+        transport, _ = await loop.connect_accepted_socket(lambda: asyncio.StreamReaderProtocol(reader), sock=sock)
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=_START_TIMEOUT)
+            msg = json.loads(line) if line else {}
+        except (asyncio.TimeoutError, ValueError):
+            msg = {}
+        if "error" in msg:
+            raise OSError(int(msg.get("errno") or 0), str(msg["error"]), msg.get("filename"))
+        if "pid" not in msg:
+            raise ForkServerUnavailable("no pid in reply")
+    except BaseException:
+        if transport is not None:
+            transport.close()
+        else:
+            sock.close()
+        for fd in keep:
+            if fd is not None:
+                os.close(fd)
+        raise
+    return RemoteChild(int(msg["pid"]), keep, reader, transport)
+
+
+if __name__ == "__main__":
+    # 终端 Ctrl-C 由主进程处理；主进程退出后 serve 循环自行结束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    serve(sys.argv[1], int(sys.argv[2]))
@@ -1,13 +1,23 @@
 """Gemini CLI backend (google-gemini/gemini-cli)."""
 from __future__ import annotations
 
-import asyncio
 import os
 import shutil
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
-from openab.core.i18n import t
+from .capture import capture, reply_from_output
+from .plan import InvocationPlan, get_plan, make_plan
+from .pool import get_pool_config
+from .process import spawn
+from .registry import Capabilities
+from .stream import stream_subprocess
+from .transport import use_stdin
+
+CLI_NAME = "gemini"
+# 每用户独立目录（见 homes，HOME）从登录目录链接的文件
+SHARED_FILES = (".gemini/oauth_creds.json", ".gemini/google_accounts.json", ".gemini/settings.json")
+CAPABILITIES = Capabilities(streaming=True)
 
 
 def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
@@ -24,6 +34,29 @@ def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
     return exe or cmd
 
 
+def _compile_plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return make_plan(_find_cmd(agent_config))
+
+
+def _plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return get_plan("gemini", agent_config, _compile_plan, env_keys=("GEMINI_CLI_CMD",))
+
+
+def invocation_plan(agent_config: Mapping[str, Any] | None = None) -> InvocationPlan:
+    """当前配置下的调用计划（可执行文件、环境变量），供健康探测使用。"""
+    return _plan(agent_config)
+
+
+def _build_args(
+    prompt: Optional[str], agent_config: dict[str, Any] | None, *, plan: Optional[InvocationPlan] = None
+) -> list[str]:
+    """prompt 为 None 时不带 -p：gemini 在 stdin 非 TTY 时读取 stdin 作为提示（预热进程池）。"""
+    cmd = (plan or _plan(agent_config)).executable
+    if prompt is None:
+        return [cmd]
+    return [cmd, "-p", prompt]
+
+
 async def run_async(
     prompt: str,
     *,
@@ -33,21 +66,46 @@ async def run_async(
     agent_config: Optional[dict[str, Any]] = None,
 ) -> str:
     """Gemini CLI: gemini -p \"prompt\" → stdout."""
-    cmd = _find_cmd(agent_config)
-    args = [cmd, "-p", prompt]
+    pool_cfg = get_pool_config(agent_config, "gemini")
+    via_stdin = use_stdin(prompt, agent_config, "gemini", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    args = _build_args(None if via_stdin else prompt, agent_config, plan=plan)
     cwd = str(workspace) if workspace else None
-    proc = await asyncio.create_subprocess_exec(
-        *args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=os.environ.copy(),
+    proc = await spawn(
+        args,
+        backend="gemini",
+        env=plan.env,
         cwd=cwd,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
     )
-    try:
-        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return t(lang, "agent_timeout")
-    text = (stdout or b"").decode("utf-8", errors="replace").strip()
-    return text or t(lang, "agent_no_output")
+    out = await capture(proc, timeout, agent_config=agent_config)
+    return reply_from_output(out, lang, usage=proc.usage)
+
+
+async def run_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """流式版本：gemini -p 在非交互模式下边生成边写 stdout，按块产出。"""
+    pool_cfg = get_pool_config(agent_config, "gemini")
+    via_stdin = use_stdin(prompt, agent_config, "gemini", pooled=pool_cfg is not None)
+    plan = _plan(agent_config)
+    args = _build_args(None if via_stdin else prompt, agent_config, plan=plan)
+    async for delta in stream_subprocess(
+        args,
+        backend="gemini",
+        env=plan.env,
+        cwd=str(workspace) if workspace else None,
+        timeout=timeout,
+        lang=lang,
+        stdin_data=prompt if via_stdin else None,
+        pool=pool_cfg,
+        agent_config=agent_config,
+    ):
+        yield delta
@@ -0,0 +1,178 @@
+"""对冲请求：主后端迟迟没有结果时，在备用后端上以同一 prompt 再跑一次，先成功完成者胜出，另一个被取消（进程树随之结束）。
+
+只用于不与其他运行共享会话的调用（无状态 API 调用、新会话，即 serialize.session_key 为 None）；
+聊天用户与指定了 --resume id 的调用固定在各自后端的会话上，不做对冲；延续「最近一次会话」的调用
+（cursor / codex 默认 continue_session: true）同样共享会话，不做对冲，要对冲 API 调用需把该后端的
+continue_session 设为 false（首次遇到时记一次日志，见 skipped）。
+- 触发时间：主后端完整运行耗时（agent_run_seconds，run_agent_async 只在运行结束时才有输出）的 percentile 分位数，
+  样本不足 min_samples 时用 delay；
+- 额外负载受 budget 限制：每次可对冲的运行积累 budget 个令牌（最多 burst 个），启动一次对冲消耗 1 个，
+  长期看对冲次数不超过可对冲运行数的 budget 倍；
+- 备用后端按 backends 顺序选第一个可用的：断路器打开或探测到问题（找不到 CLI / 未登录）的跳过；
+- 先完成的运行失败（异常、无输出、断路器拒绝）时继续等另一个；两者都失败时返回主后端的结果。
+对冲次数计入 agent_hedges_total，胜出方计入 agent_hedge_wins_total（role 为 primary / secondary）。
+
+配置：agent.hedge: {backends: [codex], percentile: 0.95, delay: 30, min_samples: 20, budget: 0.05, burst: 2}
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+from openab.core import metrics
+
+from .router import with_backend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_DELAY = 30.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_BUDGET = 0.05
+DEFAULT_BURST = 2.0
+# 触发时间下限（秒），避免样本偏小时几乎每次都对冲
+MIN_DELAY = 1.0
+
+# 一次运行：agent_config -> (回复, 是否成功)
+RunOnce = Callable[[Optional[Mapping[str, Any]]], Awaitable[tuple[str, bool]]]
+
+
+@dataclass(frozen=True)
+class HedgeConfig:
+    backends: tuple[str, ...]
+    percentile: float = DEFAULT_PERCENTILE
+    delay: float = DEFAULT_DELAY
+    min_samples: int = DEFAULT_MIN_SAMPLES
+    budget: float = DEFAULT_BUDGET
+    burst: float = DEFAULT_BURST
+
+
+def get_hedge_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[HedgeConfig]:
+    """读取 agent.hedge；未配置、为 false 或没有备用后端时返回 None。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("hedge")
+    if not isinstance(raw, dict):
+        return None
+    backends = raw.get("backends") or []
+    if isinstance(backends, str):
+        backends = [backends]
+    names = tuple(str(b).strip().lower() for b in backends if str(b).strip())
+    if not names:
+        return None
+    try:
+        percentile = float(raw.get("percentile") or DEFAULT_PERCENTILE)
+        delay = float(raw.get("delay") or DEFAULT_DELAY)
+        min_samples = int(raw.get("min_samples") or DEFAULT_MIN_SAMPLES)
+        budget = float(raw.get("budget") if raw.get("budget") is not None else DEFAULT_BUDGET)
+        burst = float(raw.get("burst") or DEFAULT_BURST)
+    except (TypeError, ValueError):
+        return HedgeConfig(backends=names)
+    return HedgeConfig(
+        backends=names,
+        percentile=min(max(percentile, 0.5), 0.999),
+        delay=max(MIN_DELAY, delay),
+        min_samples=max(1, min_samples),
+        budget=min(max(budget, 0.0), 1.0),
+        burst=max(1.0, burst),
+    )
+
+
+# 已记录过「延续最近会话、不对冲」的后端
+_skipped_logged: set[str] = set()
+
+
+def skipped(backend: str, key: str) -> None:
+    """配置了对冲但本次运行共享会话（session_key 为 key）而不对冲；延续最近会话时每个后端记一次日志。"""
+    if key == f"{backend}:latest" and backend not in _skipped_logged:
+        _skipped_logged.add(backend)
+        logger.info(
+            "hedging skipped for %s: runs continue the latest session; set %s.continue_session: false to hedge them",
+            backend,
+            backend,
+        )
+
+
+# ---------- 预算 ----------
+
+# 主后端 -> 可用的对冲令牌数
+_tokens: dict[str, float] = {}
+
+
+def _accrue(backend: str, config: HedgeConfig) -> None:
+    _tokens[backend] = min(config.burst, _tokens.get(backend, 0.0) + config.budget)
+
+
+def _take(backend: str) -> bool:
+    if _tokens.get(backend, 0.0) < 1.0:
+        return False
+    _tokens[backend] -= 1.0
+    return True
+
+
+# ---------- 对冲 ----------
+
+
+def hedge_delay(backend: str, config: HedgeConfig) -> float:
+    """主后端运行多久仍无结果时启动对冲。"""
+    observed = metrics.percentile(
+        "agent_run_seconds", config.percentile, min_samples=config.min_samples, backend=backend, mode="full"
+    )
+    return max(MIN_DELAY, observed if observed is not None else config.delay)
+
+
+def _secondary(backend: str, config: HedgeConfig, lang: str) -> Optional[str]:
+    from . import breaker, probe
+
+    for name in config.backends:
+        if name == backend or breaker.is_open(name) or probe.problem_message(name, lang) is not None:
+            continue
+        return name
+    return None
+
+
+async def run_hedged(
+    backend: str, config: HedgeConfig, agent_config: Optional[Mapping[str, Any]], lang: str, run: RunOnce
+) -> str:
+    """以 run 在主后端运行；超过 hedge_delay 仍未完成且预算允许时，在备用后端上同时运行，取先成功者。"""
+    _accrue(backend, config)
+    tasks: dict[asyncio.Task, tuple[str, str]] = {}
+    primary = asyncio.ensure_future(run(agent_config))
+    tasks[primary] = (backend, "primary")
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay(backend, config))
+        if done:
+            return primary.result()[0]
+        secondary = _secondary(backend, config, lang)
+        if secondary is None or not _take(backend):
+            return (await primary)[0]
+        metrics.inc("agent_hedges_total", backend=backend, secondary=secondary)
+        logger.info("agent %s has no result yet, hedging on %s", backend, secondary)
+        tasks[asyncio.ensure_future(run(with_backend(agent_config, secondary)))] = (secondary, "secondary")
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # 同时完成时优先主后端
+            for task in sorted(done, key=lambda x: x is not primary):
+                if task.exception() is None and task.result()[1]:
+                    name, role = tasks[task]
+                    metrics.inc("agent_hedge_wins_total", backend=name, role=role)
+                    return task.result()[0]
+        return primary.result()[0]
+    finally:
+        # 落败方在后台结束进程树（SIGTERM → 宽限期 → SIGKILL），胜出方的回复不等它
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                _cancelling.add(task)
+                task.add_done_callback(_forget)
+
+
+_cancelling: set[asyncio.Task] = set()
+
+
+def _forget(task: asyncio.Task) -> None:
+    _cancelling.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("hedged run ended with %r after cancellation", task.exception())
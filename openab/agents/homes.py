@@ -0,0 +1,372 @@
+"""凭据目录池：一个后端配置多个登录目录（如多个 CODEX_HOME），把会话分散到不同账号上，突破单个账号的限流。
+
+每个后端在自己的配置段列出目录：
+
+    codex:
+      homes: [~/.codex-a, ~/.codex-b]
+      home_strategy: least_loaded   # 或 round_robin
+      home_backoff: 60              # 触发限流后暂停该目录的秒数，连续触发时翻倍（最多 16 倍）
+
+运行时通过后端声明的 HOME_ENV 环境变量（codex 为 CODEX_HOME，claude 为 CLAUDE_CONFIG_DIR，
+缺省为 HOME）指向选中的目录。各目录需事先分别登录（如 `CODEX_HOME=~/.codex-a codex login`）。
+- 新会话按策略选目录：least_loaded 选正在运行最少（其次已固定会话最少）的目录，round_robin 轮流；
+  处于退避中的目录不参与选择（全部退避时选最早恢复的）；
+- 会话（聊天用户 / resume id，见 serialize.session_key）固定在首次分配的目录上，CLI 的会话记录只存在于该目录；
+  固定关系保存在 ~/.cache/openab/homes.json（OPENAB_HOMES_STATE 可覆盖），重启后仍有效；
+- 运行输出命中限流特征（rate limit / 429 / usage limit 等）时该目录进入退避，成功运行后清零。
+
+每用户独立目录（agent.user_homes: true 或 {root: ~/.local/share/openab/users}）：每个聊天用户使用
+<root>/<用户>/<backend> 作为登录目录，会话记录互相隔离，/resume 也只扫描该用户的目录。
+登录凭据（后端的 SHARED_FILES）以符号链接指向默认目录（或目录池选中的目录），无需每个用户单独登录。
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import ChainMap
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator, Mapping, Optional
+
+from openab.core import metrics
+
+from . import registry
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("least_loaded", "round_robin")
+DEFAULT_BACKOFF = 60.0
+MAX_BACKOFF_FACTOR = 16
+DEFAULT_USER_HOMES_ROOT = "~/.local/share/openab/users"
+# 持久化的会话固定关系上限，超出时丢弃最早的
+MAX_PINS = 2000
+_RATE_LIMIT_RE = re.compile(
+    r"rate[ _-]?limit|too many requests|\b429\b|usage limit|quota (exceeded|exhausted)|resource[ _]exhausted|overloaded",
+    re.I,
+)
+
+
+@dataclass(frozen=True)
+class HomePoolConfig:
+    homes: tuple[str, ...]
+    strategy: str = "least_loaded"
+    backoff: float = DEFAULT_BACKOFF
+
+
+def get_home_pool_config(agent_config: Optional[Mapping[str, Any]], backend: str) -> Optional[HomePoolConfig]:
+    """读取 <backend>.homes；少于两个目录时返回 None（使用默认登录目录）。"""
+    section = (agent_config or {}).get(backend) or {}
+    raw = section.get("homes")
+    if isinstance(raw, str):
+        raw = [p for p in raw.split(",")]
+    if not isinstance(raw, (list, tuple)):
+        return None
+    homes = tuple(dict.fromkeys(str(Path(str(p).strip()).expanduser()) for p in raw if str(p).strip()))
+    if len(homes) < 2:
+        return None
+    strategy = str(section.get("home_strategy") or "least_loaded").strip().lower()
+    if strategy not in STRATEGIES:
+        logger.warning("unknown %s.home_strategy %r, using least_loaded", backend, strategy)
+        strategy = "least_loaded"
+    try:
+        backoff = float(section.get("home_backoff") or DEFAULT_BACKOFF)
+    except (TypeError, ValueError):
+        backoff = DEFAULT_BACKOFF
+    return HomePoolConfig(homes=homes, strategy=strategy, backoff=max(1.0, backoff))
+
+
+def is_rate_limited(text: str) -> bool:
+    return bool(text) and _RATE_LIMIT_RE.search(text) is not None
+
+
+# ---------- 会话固定关系（持久化） ----------
+
+
+def _state_path() -> Path:
+    p = os.environ.get("OPENAB_HOMES_STATE", "").strip()
+    if p:
+        return Path(p).expanduser()
+    return Path.home() / ".cache" / "openab" / "homes.json"
+
+
+_pins: Optional[dict[str, str]] = None
+
+
+def _load_pins() -> dict[str, str]:
+    global _pins
+    if _pins is None:
+        try:
+            data = json.loads(_state_path().read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        _pins = {str(k): str(v) for k, v in data.items()} if isinstance(data, dict) else {}
+    return _pins
+
+
+def _save_pins() -> None:
+    path = _state_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".homes-", dir=str(path.parent))
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(_pins or {}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug("writing home pins %s failed: %s", path, e)
+
+
+def pin(key: str, home: str) -> None:
+    pins = _load_pins()
+    if pins.get(key) != home:
+        pins.pop(key, None)
+        pins[key] = home
+        while len(pins) > MAX_PINS:
+            pins.pop(next(iter(pins)))
+        _save_pins()
+
+
+def pinned_home(key: Optional[str]) -> Optional[str]:
+    return _load_pins().get(key) if key else None
+
+
+# ---------- 目录状态 ----------
+
+
+@dataclass
+class _HomeState:
+    active: int = 0
+    strikes: int = 0
+    backoff_until: float = 0.0
+
+
+_states: dict[tuple[str, str], _HomeState] = {}
+_rr: dict[str, int] = {}
+
+
+def _state(backend: str, home: str) -> _HomeState:
+    st = _states.get((backend, home))
+    if st is None:
+        st = _states[(backend, home)] = _HomeState()
+    return st
+
+
+def _label(config: HomePoolConfig, home: str) -> str:
+    return str(config.homes.index(home)) if home in config.homes else "?"
+
+
+def _available(backend: str, home: str) -> bool:
+    """目录不在限流退避中，且其断路器未打开（见 breaker）。"""
+    from .breaker import is_open
+
+    return _state(backend, home).backoff_until <= time.monotonic() and not is_open(backend, home)
+
+
+def _choose(backend: str, config: HomePoolConfig) -> str:
+    ready = [h for h in config.homes if _available(backend, h)]
+    if not ready:
+        return min(config.homes, key=lambda h: _state(backend, h).backoff_until)
+    start = _rr.get(backend, 0)
+    _rr[backend] = start + 1
+    rotated = [ready[(start + i) % len(ready)] for i in range(len(ready))]
+    if config.strategy == "round_robin":
+        return rotated[0]
+    pinned = _load_pins().values()
+    return min(rotated, key=lambda h: (_state(backend, h).active, sum(1 for p in pinned if p == h)))
+
+
+def backed_off(backend: str, agent_config: Optional[Mapping[str, Any]] = None) -> bool:
+    """后端配置的全部目录是否都在退避中或断路器打开（未配置目录池时为 False）。"""
+    config = get_home_pool_config(agent_config, backend)
+    if config is None:
+        return False
+    return not any(_available(backend, h) for h in config.homes)
+
+
+class HomeLease:
+    """
+    一次运行占用的登录目录：config 为叠加了目录环境变量的 agent_config；feed() 收集输出，
+    运行结束后据此归类错误（见 breaker）。rejected 非空时断路器处于打开状态，不应运行，
+    为 (错误类别, 预计恢复前的秒数)；error_class 为运行结束后的错误类别。
+    """
+
+    def __init__(self, backend: str, home: Optional[str], config: Optional[Mapping[str, Any]]) -> None:
+        from .breaker import RunOutcome
+
+        self.backend = backend
+        self.home = home
+        self.config = config
+        self.outcome = RunOutcome()
+        self.rejected: Optional[tuple[str, float]] = None
+        self.error_class: Optional[str] = None
+
+    def feed(self, text: str) -> None:
+        self.outcome.feed(text)
+
+
+def _home_var(backend: str) -> str:
+    return getattr(registry.load(backend), "HOME_ENV", None) or "HOME"
+
+
+def default_home(backend: str) -> Path:
+    """后端默认的登录目录：环境变量（如 CODEX_HOME）> 后端声明的 DEFAULT_HOME > 家目录。"""
+    var = _home_var(backend)
+    raw = os.environ.get(var, "").strip() or getattr(registry.load(backend), "DEFAULT_HOME", None) or "~"
+    return Path(str(raw)).expanduser()
+
+
+# ---------- 每用户独立目录 ----------
+
+
+def _user_homes_root(agent_config: Optional[Mapping[str, Any]]) -> Optional[Path]:
+    """agent.user_homes：true 或 {root: ...}；未启用时返回 None。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("user_homes")
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        return None
+    root = raw.get("root") or DEFAULT_USER_HOMES_ROOT
+    return Path(str(root)).expanduser()
+
+
+def user_home(backend: str, agent_config: Optional[Mapping[str, Any]], user: Optional[str] = None) -> Optional[Path]:
+    """
+    用户（user 缺省取 agent_config 中的 _user_id，如 "tg:123"）在该后端的独立目录：
+    <root>/<user>/<backend>；未启用 agent.user_homes 或没有用户时返回 None。
+    """
+    root = _user_homes_root(agent_config)
+    user = user or (agent_config or {}).get("_user_id")
+    if root is None or not user:
+        return None
+    return root / re.sub(r"[^\w.-]", "-", str(user)) / backend
+
+
+def _link_shared(backend: str, source: Path, home: Path) -> None:
+    """把登录凭据等共享文件（后端的 SHARED_FILES，相对登录目录）以符号链接放进用户目录，token 刷新对所有用户生效。"""
+    home.mkdir(parents=True, exist_ok=True)
+    for rel in getattr(registry.load(backend), "SHARED_FILES", ()):
+        target, link = source / rel, home / rel
+        try:
+            if link.is_symlink():
+                if Path(os.readlink(link)) == target:
+                    continue
+                link.unlink()
+            elif link.exists():
+                continue  # 用户目录里已有自己的文件（如单独登录），不覆盖
+            if target.exists():
+                link.parent.mkdir(parents=True, exist_ok=True)
+                link.symlink_to(target)
+        except OSError as e:
+            logger.warning("linking %s into %s failed: %s", target, home, e)
+
+
+# ---------- 每次运行 ----------
+
+
+def _select(backend: str, agent_config: Optional[Mapping[str, Any]], key: Optional[str]) -> HomeLease:
+    """
+    为本次运行选定登录目录：配置了 <backend>.homes 时从目录池中选择（见模块说明），
+    启用 agent.user_homes 时聊天用户改用自己的目录（凭据链接自所选 / 默认目录）。
+    两者都未配置时原样使用 agent_config。
+    """
+    config = get_home_pool_config(agent_config, backend)
+    uhome = user_home(backend, agent_config)
+    if config is None and uhome is None:
+        return HomeLease(backend, None, agent_config)
+    cfg = agent_config or {}
+    overlay: dict[str, Any] = {}
+    home: Optional[str] = None
+    if config is not None:
+        home = pinned_home(key)
+        # 已固定的目录在退避中时，只有新会话才换目录（旧会话的记录只在原目录中）
+        renew = cfg.get("_session_new") is True and home is not None and not _available(backend, home)
+        if home not in config.homes or renew:
+            home = _choose(backend, config)
+            if key:
+                pin(key, home)
+        original_pin = cfg.get("_pin_session")
+        pool_home = home
+
+        def _pin_session(session_id: str) -> None:
+            # 新会话的 ID 也固定到该目录，之后按 --resume id 恢复时仍使用同一目录
+            pin(f"{backend}:resume:{session_id}", pool_home)
+            if original_pin is not None:
+                original_pin(session_id)
+
+        overlay["_pin_session"] = _pin_session
+    env_home = home
+    if uhome is not None:
+        _link_shared(backend, Path(home) if home else default_home(backend), uhome)
+        env_home = str(uhome)
+    overlay["_home_env"] = {_home_var(backend): env_home}
+    return HomeLease(backend, home, ChainMap(overlay, cfg))
+
+
+@contextlib.contextmanager
+def home_lease(
+    backend: str, agent_config: Optional[Mapping[str, Any]], key: Optional[str]
+) -> Iterator[HomeLease]:
+    """
+    选定本次运行的登录目录（见 _select），并把运行结果交给断路器（见 breaker）：
+    断路器打开时 lease.rejected 非空，调用方应直接返回 breaker.down_message 而不运行。
+    调用方把回复 / 增量交给 lease.feed()，运行中的异常经由 with 语句记录。
+    """
+    from . import breaker
+
+    lease = _select(backend, agent_config, key)
+    home = lease.home
+    bcfg = breaker.get_breaker_config(agent_config)
+    if bcfg is not None:
+        lease.rejected = breaker.admit(backend, home)
+        if lease.rejected is not None:
+            yield lease
+            return
+    pool = get_home_pool_config(agent_config, backend) if home is not None else None
+    st = _state(backend, home) if pool is not None and home is not None else None
+    if st is not None:
+        st.active += 1
+        metrics.set_gauge("agent_home_active", st.active, backend=backend, home=_label(pool, home))
+    finished = False
+    try:
+        yield lease
+        finished = True
+    except Exception as e:
+        lease.outcome.exception = e
+        finished = True
+        raise
+    finally:
+        if bcfg is None:
+            lease.error_class = lease.outcome.error_class() if finished else None
+        elif finished:
+            lease.error_class = breaker.record(backend, home, lease.outcome, bcfg)
+        else:
+            # 取消 / 调用方提前停止迭代：不计入结果
+            breaker.release(backend, home)
+        if st is not None:
+            st.active -= 1
+            label = _label(pool, home)  # type: ignore[arg-type]
+            metrics.set_gauge("agent_home_active", st.active, backend=backend, home=label)
+            if lease.error_class == "rate_limit":
+                st.strikes += 1
+                delay = pool.backoff * min(2 ** (st.strikes - 1), MAX_BACKOFF_FACTOR)  # type: ignore[union-attr]
+                st.backoff_until = time.monotonic() + delay
+                metrics.inc("agent_home_rate_limited_total", backend=backend, home=label)
+                logger.warning("agent %s home %s hit a rate limit, backing off for %.0fs", backend, home, delay)
+            elif finished and lease.outcome.succeeded:
+                st.strikes = 0
+
+
+def apply_home_env(
+    env: Optional[Mapping[str, str]], agent_config: Optional[Mapping[str, Any]]
+) -> Optional[Mapping[str, str]]:
+    """在计划的环境变量上叠加本次运行选定的凭据目录（见 home_lease）。"""
+    extra = (agent_config or {}).get("_home_env")
+    if not extra:
+        return env
+    merged = dict(os.environ if env is None else env)
+    merged.update(extra)
+    return merged
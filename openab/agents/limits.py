@@ -0,0 +1,143 @@
+"""每次 agent 运行的资源限制：CPU 时间、地址空间、打开文件数（setrlimit），可选放入临时 cgroup（systemd-run --scope）。
+
+配置（后端段优先于 agent 段）：
+    agent.limits / <backend>.limits:
+      cpu_seconds: 600        # RLIMIT_CPU
+      address_space_mb: 8192  # RLIMIT_AS；Node 类 CLI 会预留大量虚拟内存，设置过小会启动失败
+      open_files: 4096        # RLIMIT_NOFILE
+      cgroup:                 # 需要 systemd 用户实例；未安装 systemd-run 时忽略并记录警告
+        memory_max: 2G
+        cpu_quota: 200%
+        tasks_max: 512
+"""
+from __future__ import annotations
+
+import logging
+import shutil
+import sys
+from dataclasses import dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # 非 POSIX
+    resource = None  # type: ignore[assignment]
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    cpu_seconds: Optional[int] = None
+    address_space_mb: Optional[int] = None
+    open_files: Optional[int] = None
+    # systemd 单元属性，如 (("MemoryMax", "2G"), ("CPUQuota", "200%"))
+    cgroup: tuple[tuple[str, str], ...] = ()
+
+    @property
+    def has_rlimits(self) -> bool:
+        return any(v is not None for v in (self.cpu_seconds, self.address_space_mb, self.open_files))
+
+
+_CGROUP_PROPS = {
+    "memory_max": "MemoryMax",
+    "memory_high": "MemoryHigh",
+    "cpu_quota": "CPUQuota",
+    "cpu_weight": "CPUWeight",
+    "io_weight": "IOWeight",
+    "tasks_max": "TasksMax",
+}
+
+
+def _opt_int(raw: dict[str, Any], key: str) -> Optional[int]:
+    v = raw.get(key)
+    if v is None or v == "":
+        return None
+    try:
+        n = int(v)
+    except (TypeError, ValueError):
+        return None
+    return n if n > 0 else None
+
+
+def get_limits(agent_config: Optional[dict[str, Any]], backend: str) -> Optional[ResourceLimits]:
+    """读取 <backend>.limits，缺省时读 agent.limits；未配置返回 None。"""
+    if not agent_config:
+        return None
+    raw = (agent_config.get(backend) or {}).get("limits")
+    if raw is None:
+        raw = (agent_config.get("agent") or {}).get("limits")
+    if not isinstance(raw, dict):
+        return None
+    cgroup: list[tuple[str, str]] = []
+    cg = raw.get("cgroup")
+    if isinstance(cg, dict):
+        for key, prop in _CGROUP_PROPS.items():
+            if cg.get(key) not in (None, ""):
+                cgroup.append((prop, str(cg[key])))
+    limits = ResourceLimits(
+        cpu_seconds=_opt_int(raw, "cpu_seconds"),
+        address_space_mb=_opt_int(raw, "address_space_mb"),
+        open_files=_opt_int(raw, "open_files"),
+        cgroup=tuple(cgroup),
+    )
+    if not limits.has_rlimits and not limits.cgroup:
+        return None
+    return limits
+
+
+def _rlimit_pairs(limits: ResourceLimits) -> list[tuple[int, int]]:
+    if resource is None:
+        return []
+    pairs = []
+    if limits.cpu_seconds is not None:
+        pairs.append((resource.RLIMIT_CPU, limits.cpu_seconds))
+    if limits.address_space_mb is not None:
+        pairs.append((resource.RLIMIT_AS, limits.address_space_mb * 1024 * 1024))
+    if limits.open_files is not None:
+        pairs.append((resource.RLIMIT_NOFILE, limits.open_files))
+    return pairs
+
+
+def apply_rlimits(pid: int, limits: ResourceLimits) -> None:
+    """Linux：用 prlimit 在父进程中给刚启动的子进程设限（无需 preexec_fn）。"""
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    for res, value in _rlimit_pairs(limits):
+        try:
+            _, hard = resource.getrlimit(res)
+            soft = value if hard == resource.RLIM_INFINITY else min(value, hard)
+            resource.prlimit(pid, res, (soft, soft if hard == resource.RLIM_INFINITY else hard))
+        except (OSError, ValueError) as e:
+            logger.warning("prlimit(%s, %s) failed: %s", pid, res, e)
+
+
+def preexec_for(limits: Optional[ResourceLimits]) -> Any:
+    """无 prlimit 的平台（如 macOS）退回到子进程中 setrlimit。"""
+    if limits is None or not limits.has_rlimits or resource is None or hasattr(resource, "prlimit"):
+        return None
+    pairs = _rlimit_pairs(limits)
+
+    def _apply() -> None:
+        for res, value in pairs:
+            try:
+                resource.setrlimit(res, (value, value))
+            except (OSError, ValueError):
+                pass
+
+    return _apply
+
+
+def wrap_cgroup(args: list[str], limits: Optional[ResourceLimits]) -> list[str]:
+    """配置了 cgroup 时在 argv 前加 systemd-run --user --scope（scope 模式下 pid 不变，直接 exec 目标命令）。"""
+    if limits is None or not limits.cgroup or not sys.platform.startswith("linux"):
+        return args
+    exe = shutil.which("systemd-run")
+    if not exe:
+        logger.warning("agent limits.cgroup configured but systemd-run not found; running without cgroup")
+        return args
+    wrapped = [exe, "--user", "--scope", "--quiet", "--collect"]
+    for prop, value in limits.cgroup:
+        wrapped.extend(["-p", f"{prop}={value}"])
+    wrapped.append("--")
+    return wrapped + list(args)
@@ -1,18 +1,38 @@
 """OpenClaw 后端：通过 CLI `openclaw agent --message "..."` 调用，需先运行 OpenClaw Gateway（或使用本地回退）。
 
+配置 openclaw.gateway 时改为直连网关的 HTTP 接口（见 openclaw_gateway），省掉每条消息的 Node 冷启动；
+网关不可用时回退到 CLI（openclaw.gateway.fallback: false 可关闭回退）。
+
 参考：https://docs.openclaw.ai/tools/agent-send
 安装：npm install -g openclaw@latest，并运行 openclaw onboard / openclaw gateway。
 """
 from __future__ import annotations
 
 import asyncio
+import logging
 import os
 import shutil
+import time
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Mapping, Optional
 
+from openab.core import metrics
 from openab.core.i18n import t
 
+from . import openclaw_gateway as gateway
+from .capture import capture, reply_from_output
+from .plan import InvocationPlan, get_plan, make_plan
+from .process import spawn
+from .registry import Capabilities
+from .result import AgentReply, no_output_reply
+from .stream import LineSplitter, stream_subprocess
+from .transport import prompt_argument
+
+logger = logging.getLogger(__name__)
+
+CLI_NAME = "openclaw"
+CAPABILITIES = Capabilities(streaming=True)
+
 
 def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
     cmd = "openclaw"
@@ -28,14 +48,41 @@ def _find_cmd(agent_config: dict[str, Any] | None = None) -> str:
     return exe or cmd
 
 
-def _strip_media_lines(text: str) -> str:
-    """去掉 OpenClaw 输出中的 MEDIA: 行，只保留回复正文。"""
-    lines = []
-    for line in text.splitlines():
-        if line.strip().startswith("MEDIA:"):
-            continue
-        lines.append(line)
-    return "\n".join(lines).strip()
+def _compile_plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    oc_cfg = (agent_config or {}).get("openclaw") or {}
+    flags: list[str] = []
+    thinking = (oc_cfg.get("thinking") or "").strip().lower()
+    if thinking in ("off", "minimal", "low", "medium", "high", "xhigh"):
+        flags.extend(["--thinking", thinking])
+    return make_plan(_find_cmd(agent_config), flags=flags, options={"timeout": oc_cfg.get("timeout")})
+
+
+def _plan(agent_config: Mapping[str, Any] | None) -> InvocationPlan:
+    return get_plan("openclaw", agent_config, _compile_plan, env_keys=("OPENCLAW_CMD",))
+
+
+def invocation_plan(agent_config: Mapping[str, Any] | None = None) -> InvocationPlan:
+    """当前配置下的调用计划（可执行文件、环境变量），供健康探测使用。"""
+    return _plan(agent_config)
+
+
+def _build_args(
+    prompt: str, timeout: int, agent_config: dict[str, Any] | None, *, plan: Optional[InvocationPlan] = None
+) -> list[str]:
+    plan = plan or _plan(agent_config)
+    args = [plan.executable, "agent", "--message", prompt]
+    to = plan.options.get("timeout") or timeout
+    if to and int(to) > 0:
+        args.extend(["--timeout", str(int(to))])
+    args.extend(plan.flags)
+    return args
+
+
+def _filter_media_line(line: str) -> Optional[str]:
+    """逐行过滤：MEDIA: 行丢弃，其余行原样（补回换行）保留。"""
+    if line.strip().startswith("MEDIA:"):
+        return None
+    return line + "\n"
 
 
 async def run_async(
@@ -46,32 +93,98 @@ async def run_async(
     lang: str = "en",
     agent_config: Optional[dict[str, Any]] = None,
 ) -> str:
-    """调用 openclaw agent --message \"<prompt>\"，从 stdout 取回复；默认会过滤 MEDIA: 行。"""
-    cmd = _find_cmd(agent_config)
-    args = [cmd, "agent", "--message", prompt]
-    oc_cfg = (agent_config or {}).get("openclaw") or {}
-    to = oc_cfg.get("timeout") or timeout
-    if to and int(to) > 0:
-        args.extend(["--timeout", str(int(to))])
-    thinking = (oc_cfg.get("thinking") or "").strip().lower()
-    if thinking in ("off", "minimal", "low", "medium", "high", "xhigh"):
-        args.extend(["--thinking", thinking])
+    """调用 openclaw agent --message \"<prompt>\"，从 stdout 取回复；逐行过滤 MEDIA: 行。"""
+    gw = gateway.get_gateway_config(agent_config)
+    if gw is not None:
+        started = time.monotonic()
+        try:
+            text = await gateway.complete(prompt, gw, timeout=timeout, agent_config=agent_config)
+        except asyncio.TimeoutError:
+            return AgentReply(t(lang, "agent_timeout"), outcome="timed_out")
+        except gateway.GatewayError as e:
+            if not gw.fallback:
+                raise
+            logger.warning("%s; falling back to the openclaw CLI", e)
+            metrics.inc("openclaw_gateway_fallbacks_total")
+        else:
+            metrics.observe("agent_run_seconds", time.monotonic() - started, backend="openclaw", mode="gateway")
+            text = "".join(_filter_media_line(line) or "" for line in text.splitlines()).strip()
+            return AgentReply(text) if text else no_output_reply(lang)
+    plan = _plan(agent_config)
     cwd = str(workspace) if workspace else None
-    proc = await asyncio.create_subprocess_exec(
-        *args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        env=os.environ.copy(),
-        cwd=cwd,
-    )
-    try:
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return t(lang, "agent_timeout")
-    text = (stdout or b"").decode("utf-8", errors="replace")
-    text = _strip_media_lines(text)
-    if not text.strip():
-        return t(lang, "agent_no_output")
-    return text
+    with prompt_argument(prompt, workspace, agent_config, "openclaw") as arg:
+        args = _build_args(arg, timeout, agent_config, plan=plan)
+        proc = await spawn(args, backend="openclaw", env=plan.env, cwd=cwd, agent_config=agent_config)
+        out = await capture(proc, timeout, agent_config=agent_config, filter_line=_filter_media_line)
+    return reply_from_output(out, lang, usage=proc.usage)
+
+
+async def run_stream_async(
+    prompt: str,
+    *,
+    workspace: Optional[Path] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """流式版本：按行产出 stdout（同样过滤 MEDIA: 行）；网关模式下把网关的 SSE 增量按行过滤后产出。"""
+    gw = gateway.get_gateway_config(agent_config)
+    if gw is not None:
+        started = time.monotonic()
+        # received：网关已开始回复（之后不能再回退）；emitted：已产出文本
+        received = emitted = False
+        # SSE 增量按行缓冲，整行经 _filter_media_line 过滤后再产出（与 CLI 输出一致）
+        splitter = LineSplitter()
+
+        def _lines(lines: list[str]) -> str:
+            return "".join(_filter_media_line(line) or "" for line in lines)
+
+        try:
+            async for delta in gateway.stream(prompt, gw, timeout=timeout, agent_config=agent_config):
+                received = True
+                text = _lines(splitter.feed(delta))
+                if not text:
+                    continue
+                if not emitted:
+                    metrics.observe("agent_ttft_seconds", time.monotonic() - started, backend="openclaw")
+                emitted = True
+                yield text
+        except asyncio.TimeoutError:
+            text = _lines(splitter.flush())
+            if text:
+                emitted = True
+                yield text
+            if emitted:
+                yield AgentReply("\n\n" + t(lang, "agent_truncated"), truncated=True)
+            else:
+                yield AgentReply(t(lang, "agent_timeout"), outcome="timed_out")
+            return
+        except gateway.GatewayError as e:
+            # 已收到部分回复后不能再回退（会重复执行），只在尚无输出时改用 CLI
+            if received or not gw.fallback:
+                raise
+            logger.warning("%s; falling back to the openclaw CLI", e)
+            metrics.inc("openclaw_gateway_fallbacks_total")
+        else:
+            metrics.observe("agent_run_seconds", time.monotonic() - started, backend="openclaw", mode="gateway")
+            text = _lines(splitter.flush())
+            if text:
+                emitted = True
+                yield text
+            if not emitted:
+                yield no_output_reply(lang)
+            return
+    plan = _plan(agent_config)
+    with prompt_argument(prompt, workspace, agent_config, "openclaw") as arg:
+        args = _build_args(arg, timeout, agent_config, plan=plan)
+        async for delta in stream_subprocess(
+            args,
+            backend="openclaw",
+            env=plan.env,
+            cwd=str(workspace) if workspace else None,
+            timeout=timeout,
+            lang=lang,
+            parse_line=_filter_media_line,
+            agent_config=agent_config,
+        ):
+            yield delta
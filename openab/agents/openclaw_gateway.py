@@ -0,0 +1,368 @@
+"""OpenClaw Gateway 直连客户端：经网关的 OpenAI 兼容 HTTP 接口（POST /v1/chat/completions）调用 agent，
+不再为每条消息启动一次 `openclaw agent`（Node 冷启动只为发一次本地 RPC）。
+
+- 只用标准库（asyncio 流）实现 HTTP/1.1：keep-alive 连接按网关地址放入连接池复用，
+  支持 Content-Length / chunked 响应，流式请求解析 SSE（data: {...} / data: [DONE]）；
+- 复用的空闲连接可能已被网关关闭：请求尚未收到任何响应时换新连接重试一次；
+- 网关不可达或返回错误状态时抛出 GatewayError，openclaw 后端据此回退到 CLI（openclaw.gateway.fallback）；
+- 聊天用户的 _session_key 作为请求的 user 字段，网关据此为每个用户保持独立会话。
+
+网关需开启该接口（gateway.http.endpoints.chatCompletions.enabled: true）。配置：
+    openclaw.gateway: true 或 {url: http://127.0.0.1:18789, token: ..., agent_id: main, fallback: true, max_connections: 4}
+亦可用环境变量 OPENCLAW_GATEWAY_URL / OPENCLAW_GATEWAY_TOKEN。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import ssl
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Mapping, Optional
+from urllib.parse import urlsplit
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = "http://127.0.0.1:18789"
+DEFAULT_AGENT_ID = "main"
+DEFAULT_MAX_CONNECTIONS = 4
+CONNECT_TIMEOUT = 5.0
+# 空闲连接保留的秒数，超过后关闭（网关侧 keep-alive 超时通常更短，宁可重连）
+IDLE_TIMEOUT = 30.0
+CHAT_PATH = "/v1/chat/completions"
+# 错误响应体保留的长度
+_ERROR_BODY_CHARS = 300
+
+
+class GatewayError(RuntimeError):
+    """网关不可达、连接中断或返回错误状态。"""
+
+
+@dataclass(frozen=True)
+class GatewayConfig:
+    url: str = DEFAULT_URL
+    token: Optional[str] = None
+    agent_id: str = DEFAULT_AGENT_ID
+    fallback: bool = True
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+
+
+def get_gateway_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[GatewayConfig]:
+    """读取 openclaw.gateway；未配置（且未设置 OPENCLAW_GATEWAY_URL）或为 false 时返回 None（只用 CLI）。"""
+    raw = ((agent_config or {}).get("openclaw") or {}).get("gateway")
+    if raw is None and os.environ.get("OPENCLAW_GATEWAY_URL", "").strip():
+        raw = True
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        return None
+    url = str(raw.get("url") or os.environ.get("OPENCLAW_GATEWAY_URL", "") or DEFAULT_URL).strip().rstrip("/")
+    token = raw.get("token") or os.environ.get("OPENCLAW_GATEWAY_TOKEN", "").strip() or None
+    try:
+        max_connections = max(1, int(raw.get("max_connections") or DEFAULT_MAX_CONNECTIONS))
+    except (TypeError, ValueError):
+        max_connections = DEFAULT_MAX_CONNECTIONS
+    return GatewayConfig(
+        url=url,
+        token=str(token) if token else None,
+        agent_id=str(raw.get("agent_id") or DEFAULT_AGENT_ID).strip(),
+        fallback=raw.get("fallback", True) is not False,
+        max_connections=max_connections,
+    )
+
+
+# ---------- 连接池 ----------
+
+
+class _Connection:
+    __slots__ = ("reader", "writer", "idle_since")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = 0.0
+
+    @property
+    def usable(self) -> bool:
+        return (
+            not self.writer.is_closing()
+            and not self.reader.at_eof()
+            and time.monotonic() - self.idle_since < IDLE_TIMEOUT
+        )
+
+    def close(self) -> None:
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class ConnectionPool:
+    """一个网关地址的 keep-alive 连接池；同时占用的连接数不超过 max_connections。"""
+
+    def __init__(self, url: str, max_connections: int) -> None:
+        parts = urlsplit(url)
+        self.tls = parts.scheme == "https"
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if self.tls else 80)
+        self.base_path = parts.path.rstrip("/")
+        self._idle: list[_Connection] = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _connect(self) -> _Connection:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.host, self.port, ssl=ssl.create_default_context() if self.tls else None
+                ),
+                timeout=CONNECT_TIMEOUT,
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise GatewayError(f"cannot connect to OpenClaw gateway {self.host}:{self.port}: {e or 'timeout'}") from e
+        metrics.inc("openclaw_gateway_connections_total")
+        return _Connection(reader, writer)
+
+    def _take_idle(self) -> Optional[_Connection]:
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.usable:
+                return conn
+            conn.close()
+        return None
+
+    def _release(self, conn: _Connection, reusable: bool) -> None:
+        if reusable and not conn.writer.is_closing():
+            conn.idle_since = time.monotonic()
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    async def request(
+        self, method: str, path: str, headers: Mapping[str, str], body: bytes, *, deadline: float
+    ) -> AsyncIterator[bytes]:
+        """
+        发送请求并逐块产出 2xx 响应体；状态码非 2xx 时抛出 GatewayError（附响应体开头）。
+        超过 deadline（monotonic）时抛出 asyncio.TimeoutError，该连接不再复用。
+        """
+        await self._slots.acquire()
+        conn: Optional[_Connection] = None
+        reusable = False
+        try:
+            conn, status, resp_headers = await self._send(method, path, headers, body, deadline)
+            # 响应体有明确边界且网关未要求关闭时，读完后连接可复用
+            keep_alive = resp_headers.get("connection", "").lower() != "close" and (
+                "content-length" in resp_headers or resp_headers.get("transfer-encoding", "").lower() == "chunked"
+            )
+            chunks = self._body(conn, resp_headers, deadline)
+            if not 200 <= status < 300:
+                text = b"".join([c async for c in chunks]).decode("utf-8", errors="replace")
+                reusable = keep_alive
+                raise GatewayError(f"OpenClaw gateway returned HTTP {status}: {text[:_ERROR_BODY_CHARS]}")
+            async for chunk in chunks:
+                yield chunk
+            reusable = keep_alive
+        finally:
+            if conn is not None:
+                self._release(conn, reusable)
+            self._slots.release()
+
+    async def _send(
+        self, method: str, path: str, headers: Mapping[str, str], body: bytes, deadline: float
+    ) -> tuple[_Connection, int, dict[str, str]]:
+        head = [f"{method} {self.base_path}{path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        head += [f"Content-Length: {len(body)}", "Connection: keep-alive", "", ""]
+        payload = "\r\n".join(head).encode("latin-1") + body
+        conn = self._take_idle()
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = await self._connect()
+            try:
+                conn.writer.write(payload)
+                await conn.writer.drain()
+                status_line = await _read_line(conn.reader, deadline)
+                if not status_line:
+                    raise ConnectionResetError("connection closed by gateway")
+                break
+            except asyncio.TimeoutError:
+                conn.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise GatewayError(f"OpenClaw gateway connection failed: {e}") from e
+                # 池中的空闲连接已被网关关闭：换新连接重试一次
+                reused = False
+        metrics.inc("openclaw_gateway_requests_total", reused=str(reused).lower())
+        try:
+            status = int(status_line.split(b" ", 2)[1])
+        except (IndexError, ValueError):
+            conn.close()
+            raise GatewayError(f"bad status line from OpenClaw gateway: {status_line[:80]!r}") from None
+        resp_headers: dict[str, str] = {}
+        try:
+            while True:
+                line = await _read_line(conn.reader, deadline)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                resp_headers[name.strip().lower()] = value.strip()
+        except asyncio.TimeoutError:
+            conn.close()
+            raise
+        except OSError as e:
+            conn.close()
+            raise GatewayError(f"OpenClaw gateway response interrupted: {e}") from e
+        return conn, status, resp_headers
+
+    async def _body(self, conn: _Connection, headers: Mapping[str, str], deadline: float) -> AsyncIterator[bytes]:
+        try:
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                while True:
+                    size_line = await _read_line(conn.reader, deadline)
+                    size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                    if size == 0:
+                        # 跳过 trailer 直到空行
+                        while (await _read_line(conn.reader, deadline)) not in (b"\r\n", b"\n", b""):
+                            pass
+                        return
+                    data = await _with_deadline(conn.reader.readexactly(size + 2), deadline)
+                    yield data[:-2]
+            elif "content-length" in headers:
+                remaining = int(headers["content-length"])
+                while remaining > 0:
+                    data = await _with_deadline(conn.reader.read(min(remaining, 65536)), deadline)
+                    if not data:
+                        raise ConnectionResetError("connection closed mid-body")
+                    remaining -= len(data)
+                    yield data
+            else:
+                while True:
+                    data = await _with_deadline(conn.reader.read(65536), deadline)
+                    if not data:
+                        return
+                    yield data
+        except asyncio.TimeoutError:
+            # Python 3.11 起 asyncio.TimeoutError 是 OSError 的子类，须先于 OSError 处理，超时才不会被当作连接中断
+            conn.close()
+            raise
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            conn.close()
+            raise GatewayError(f"OpenClaw gateway response interrupted: {e}") from e
+
+    def close(self) -> None:
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+
+
+async def _with_deadline(aw: Any, deadline: float) -> Any:
+    return await asyncio.wait_for(aw, timeout=max(0.0, deadline - time.monotonic()))
+
+
+async def _read_line(reader: asyncio.StreamReader, deadline: float) -> bytes:
+    return await _with_deadline(reader.readline(), deadline)
+
+
+_pools: dict[tuple[str, int], ConnectionPool] = {}
+
+
+def _pool(config: GatewayConfig) -> ConnectionPool:
+    key = (config.url, config.max_connections)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = ConnectionPool(config.url, config.max_connections)
+    return pool
+
+
+def close_all() -> None:
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+# ---------- chat completions ----------
+
+
+def _request(
+    prompt: str, config: GatewayConfig, agent_config: Optional[Mapping[str, Any]], *, stream: bool
+) -> tuple[dict[str, str], bytes]:
+    payload: dict[str, Any] = {
+        "model": f"openclaw:{config.agent_id}",
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": stream,
+    }
+    user = (agent_config or {}).get("_session_key")
+    if user:
+        payload["user"] = str(user)
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream" if stream else "application/json",
+        "x-openclaw-agent-id": config.agent_id,
+    }
+    if config.token:
+        headers["Authorization"] = f"Bearer {config.token}"
+    return headers, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+async def complete(
+    prompt: str, config: GatewayConfig, *, timeout: float, agent_config: Optional[Mapping[str, Any]] = None
+) -> str:
+    """非流式请求，返回回复全文。"""
+    headers, body = _request(prompt, config, agent_config, stream=False)
+    deadline = time.monotonic() + timeout
+    async with contextlib.aclosing(_pool(config).request("POST", CHAT_PATH, headers, body, deadline=deadline)) as chunks:
+        raw = b"".join([c async for c in chunks])
+    try:
+        data = json.loads(raw.decode("utf-8"))
+        return str(data["choices"][0]["message"]["content"] or "")
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise GatewayError(f"unexpected OpenClaw gateway response: {raw[:_ERROR_BODY_CHARS]!r}") from e
+
+
+async def stream(
+    prompt: str, config: GatewayConfig, *, timeout: float, agent_config: Optional[Mapping[str, Any]] = None
+) -> AsyncIterator[str]:
+    """流式请求：逐个产出 SSE 事件中的文本增量（choices[0].delta.content）。"""
+    headers, body = _request(prompt, config, agent_config, stream=True)
+    deadline = time.monotonic() + timeout
+    buf = b""
+    done = False
+    async with contextlib.aclosing(_pool(config).request("POST", CHAT_PATH, headers, body, deadline=deadline)) as chunks:
+        # 收到 [DONE] 后仍读完响应体，连接才能放回池中复用
+        async for chunk in chunks:
+            if done:
+                continue
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                delta = _sse_delta(line)
+                if delta is None:
+                    done = True
+                    break
+                if delta:
+                    yield delta
+    if buf and not done:
+        delta = _sse_delta(buf)
+        if delta:
+            yield delta
+
+
+def _sse_delta(line: bytes) -> Optional[str]:
+    """一行 SSE 中的文本增量；[DONE] 返回 None，非 data 行或无文本返回空串。"""
+    line = line.strip()
+    if not line.startswith(b"data:"):
+        return ""
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return None
+    try:
+        event = json.loads(data.decode("utf-8"))
+        return str(((event.get("choices") or [{}])[0].get("delta") or {}).get("content") or "")
+    except (ValueError, AttributeError, IndexError, TypeError):
+        return ""
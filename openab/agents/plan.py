@@ -0,0 +1,110 @@
+"""预编译的调用计划：每个后端在某份配置下不随请求变化的部分（可执行文件路径、由配置决定的参数、环境变量模板）。
+
+计划按「后端配置段内容 + 相关环境变量」缓存，命中时只需 stat 一次可执行文件核对 mtime；
+配置变化（含 API 每次请求重新 load_config）或 CLI 升级（mtime 变化）时才重新编译。
+每次请求只在计划之上叠加会话相关参数（新会话 / --resume / prompt）。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Optional
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# 同一后端最多缓存的计划数（不同配置，如多个 API 配置文件）
+_MAX_PLANS_PER_BACKEND = 4
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class InvocationPlan:
+    executable: str
+    # 由配置决定、与 prompt / 会话无关的参数，由各后端插入 argv 的固定位置
+    flags: tuple[str, ...] = ()
+    env: Mapping[str, str] = field(default_factory=lambda: _EMPTY)
+    # 由配置推导出的开关（如 continue_session），供拼 argv 时读取
+    options: Mapping[str, Any] = field(default_factory=lambda: _EMPTY)
+    mtime_ns: Optional[int] = None
+
+
+def make_plan(
+    executable: str,
+    *,
+    flags: tuple[str, ...] | list[str] = (),
+    env: Optional[Mapping[str, str]] = None,
+    options: Optional[Mapping[str, Any]] = None,
+) -> InvocationPlan:
+    """构造不可变计划；env 缺省为当前 os.environ 的快照。"""
+    return InvocationPlan(
+        executable=executable,
+        flags=tuple(flags),
+        env=MappingProxyType(dict(os.environ if env is None else env)),
+        options=MappingProxyType(dict(options or {})),
+        mtime_ns=_mtime_ns(executable),
+    )
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _fingerprint(agent_config: Optional[Mapping[str, Any]], backend: str, env_keys: tuple[str, ...]) -> tuple:
+    section = (agent_config or {}).get(backend) or {}
+    try:
+        cfg = json.dumps(section, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        cfg = repr(section)
+    return (cfg, tuple(os.environ.get(k) for k in ("PATH", "HOME") + env_keys))
+
+
+_plans: dict[str, dict[tuple, InvocationPlan]] = {}
+_lock = threading.Lock()
+
+
+def get_plan(
+    backend: str,
+    agent_config: Optional[Mapping[str, Any]],
+    compile_plan: Callable[[Optional[Mapping[str, Any]]], InvocationPlan],
+    *,
+    env_keys: tuple[str, ...] = (),
+) -> InvocationPlan:
+    """
+    取 backend 在当前配置下的计划；env_keys 为 compile_plan 读取的环境变量（参与缓存键）。
+    可执行文件找不到（mtime 为 None）时不缓存，下次重新查找，便于安装后立即生效。
+    """
+    fp = _fingerprint(agent_config, backend, env_keys)
+    with _lock:
+        plan = (_plans.get(backend) or {}).get(fp)
+    if plan is not None and plan.mtime_ns is not None and _mtime_ns(plan.executable) == plan.mtime_ns:
+        return plan
+    plan = compile_plan(agent_config)
+    metrics.inc("agent_plan_compiles_total", backend=backend)
+    logger.debug("compiled %s invocation plan: %s %s", backend, plan.executable, " ".join(plan.flags))
+    if plan.mtime_ns is not None:
+        with _lock:
+            cache = _plans.setdefault(backend, {})
+            cache.pop(fp, None)
+            while len(cache) >= _MAX_PLANS_PER_BACKEND:
+                cache.pop(next(iter(cache)))
+            cache[fp] = plan
+    return plan
+
+
+def invalidate(backend: Optional[str] = None) -> None:
+    """丢弃缓存的计划（全部或某个后端）。"""
+    with _lock:
+        if backend is None:
+            _plans.clear()
+        else:
+            _plans.pop(backend, None)
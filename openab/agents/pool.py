@@ -0,0 +1,253 @@
+"""预热进程池：提前启动 N 个参数相同的 CLI 进程阻塞在 stdin 上，来消息时写入 prompt 即可开跑，省掉冷启动。
+
+只适用于 prompt 经 stdin 传入、argv 与 prompt 无关的后端（Claude / Codex / Gemini）。
+CLI 的 print 模式一个进程只处理一条 prompt，取用后即离池，后台按需补齐；
+闲置超过 max_age 的进程会被回收重建（避免登录态、配置过期）。
+预热进程的 env / cwd 在启动时已确定，无法在取用时再换：每个会话各不相同时（每用户独立目录 agent.user_homes、
+工作区池 agent.workspace_pool）不启用预热（记一次日志）；恢复指定会话（--resume id）的运行 argv 只属于该会话，也不取用预热进程。
+
+配置（后端段优先于 agent 段）：
+    agent.pool / <backend>.pool: {size: 2, max_age: 600}
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+
+from .limits import ResourceLimits
+from .process import PIPE, AgentProcess, create_process, kill_tree
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 600.0
+# 同时保留的池（不同 argv / env / cwd 组合，如凭据目录池的各个目录）上限，超出时关闭最久未用的池
+MAX_POOLS = 8
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    size: int
+    max_age: float = DEFAULT_MAX_AGE
+
+
+def get_pool_config(agent_config: Optional[dict[str, Any]], backend: str) -> Optional[PoolConfig]:
+    """
+    读取 <backend>.pool，缺省时读 agent.pool；size <= 0 或未配置返回 None（不启用）。
+    本次运行的 env / cwd 或 argv 只属于某个会话时（见模块说明）也返回 None，不为单个会话建池。
+    """
+    if not agent_config:
+        return None
+    raw = (agent_config.get(backend) or {}).get("pool")
+    if raw is None:
+        raw = (agent_config.get("agent") or {}).get("pool")
+    if not isinstance(raw, dict):
+        return None
+    try:
+        size = int(raw.get("size") or 0)
+        max_age = float(raw.get("max_age") or DEFAULT_MAX_AGE)
+    except (TypeError, ValueError):
+        return None
+    if size <= 0:
+        return None
+    reason = _per_session(agent_config, backend)
+    if reason is not None:
+        if (backend, reason) not in _disabled_logged:
+            _disabled_logged.add((backend, reason))
+            logger.info("warm pool disabled for %s: %s gives each session its own environment", backend, reason)
+        return None
+    rid = agent_config.get("_resume_id")
+    if rid is not None and str(rid).strip():
+        return None
+    return PoolConfig(size=size, max_age=max(1.0, max_age))
+
+
+# 已记录过「预热不可用」的 (backend, 原因)
+_disabled_logged: set[tuple[str, str]] = set()
+
+
+def _per_session(agent_config: Mapping[str, Any], backend: str) -> Optional[str]:
+    """本次运行的 env / cwd 只属于该会话时返回原因（配置项名），否则 None。"""
+    from .homes import user_home
+    from .workspaces import get_workspace_pool_config
+
+    if user_home(backend, agent_config) is not None:
+        return "agent.user_homes"
+    if get_workspace_pool_config(agent_config) is not None:
+        return "agent.workspace_pool"
+    return None
+
+
+def _pool_key(
+    backend: str,
+    args: list[str],
+    env: Optional[Mapping[str, str]],
+    cwd: Optional[str],
+    stdout: Any,
+    stderr: Any,
+    limits: Optional[ResourceLimits],
+) -> tuple:
+    env_digest = ""
+    if env is not None:
+        h = hashlib.sha1()
+        for k, v in sorted(env.items()):
+            h.update(k.encode("utf-8", "replace") + b"=" + v.encode("utf-8", "replace") + b"\0")
+        env_digest = h.hexdigest()
+    return (backend, tuple(args), cwd, env_digest, stdout, stderr, limits)
+
+
+class WarmPool:
+    """同一组 (argv, env, cwd) 的预热进程集合。"""
+
+    def __init__(
+        self,
+        config: PoolConfig,
+        args: list[str],
+        *,
+        backend: str,
+        env: Optional[Mapping[str, str]],
+        cwd: Optional[str],
+        stdout: Any,
+        stderr: Any,
+        limits: Optional[ResourceLimits] = None,
+    ) -> None:
+        self.config = config
+        self.backend = backend
+        self._args = list(args)
+        self._env = dict(env) if env is not None else None
+        self._cwd = cwd
+        self._stdout = stdout
+        self._stderr = stderr
+        self._limits = limits
+        # (进程, 启动时刻)
+        self._ready: list[tuple[AgentProcess, float]] = []
+        self._refill_task: Optional[asyncio.Task] = None
+        self._recycle_task: Optional[asyncio.Task] = None
+        self.last_used = time.monotonic()
+        self._closed = False
+
+    def _usable(self, proc: AgentProcess, started: float) -> bool:
+        return proc.returncode is None and time.monotonic() - started < self.config.max_age
+
+    def take(self) -> Optional[AgentProcess]:
+        """取出一个可用进程；过期或已退出的顺手回收。"""
+        self.last_used = time.monotonic()
+        proc: Optional[AgentProcess] = None
+        while self._ready:
+            candidate, started = self._ready.pop(0)
+            if self._usable(candidate, started):
+                proc = candidate
+                break
+            _discard(candidate)
+        self._publish()
+        self.ensure_refill()
+        return proc
+
+    def ensure_refill(self) -> None:
+        if self._closed:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+        if self._recycle_task is None or self._recycle_task.done():
+            self._recycle_task = asyncio.create_task(self._recycle_loop())
+
+    async def _refill(self) -> None:
+        while not self._closed and len(self._ready) < self.config.size:
+            try:
+                proc = await create_process(
+                    self._args,
+                    env=self._env,
+                    cwd=self._cwd,
+                    stdin=PIPE,
+                    stdout=self._stdout,
+                    stderr=self._stderr,
+                    backend=self.backend,
+                    limits=self._limits,
+                )
+            except OSError as e:
+                logger.warning("warm pool spawn failed for %s: %s", self.backend, e)
+                return
+            if self._closed:
+                _discard(proc)
+                return
+            self._ready.append((proc, time.monotonic()))
+            self._publish()
+
+    async def _recycle_loop(self) -> None:
+        """定期替换超龄 / 已退出的进程。"""
+        interval = min(self.config.max_age / 2, 30.0)
+        while not self._closed:
+            await asyncio.sleep(interval)
+            keep = []
+            for proc, started in self._ready:
+                if self._usable(proc, started):
+                    keep.append((proc, started))
+                else:
+                    _discard(proc)
+                    metrics.inc("agent_pool_recycled_total", backend=self.backend)
+            self._ready = keep
+            self._publish()
+            self.ensure_refill()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("agent_pool_ready", len(self._ready), backend=self.backend)
+
+    def close(self) -> None:
+        self._closed = True
+        for task in (self._refill_task, self._recycle_task):
+            if task is not None:
+                task.cancel()
+        for proc, _ in self._ready:
+            _discard(proc)
+        self._ready.clear()
+        self._publish()
+
+
+def _discard(proc: AgentProcess) -> None:
+    if proc.returncode is None:
+        kill_tree(proc)
+
+
+_pools: dict[tuple, WarmPool] = {}
+
+
+async def acquire(
+    config: PoolConfig,
+    args: list[str],
+    *,
+    backend: str,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[str] = None,
+    stdout: Any = PIPE,
+    stderr: Any = PIPE,
+    limits: Optional[ResourceLimits] = None,
+) -> Optional[AgentProcess]:
+    """从匹配的池里取一个预热进程（stdin 未写入）；未命中返回 None，并让池在后台预热以备下次。"""
+    key = _pool_key(backend, args, env, cwd, stdout, stderr, limits)
+    pool = _pools.get(key)
+    if pool is not None and pool.config != config:
+        pool.close()
+        pool = None
+    if pool is None:
+        if len(_pools) >= MAX_POOLS:
+            oldest = min(_pools, key=lambda k: _pools[k].last_used)
+            _pools.pop(oldest).close()
+        pool = WarmPool(
+            config, args, backend=backend, env=env, cwd=cwd, stdout=stdout, stderr=stderr, limits=limits
+        )
+        _pools[key] = pool
+    proc = pool.take()
+    metrics.inc("agent_pool_hits_total" if proc is not None else "agent_pool_misses_total", backend=backend)
+    return proc
+
+
+def close_all() -> None:
+    """关闭全部池并结束其中的进程。"""
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
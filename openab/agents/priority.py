@@ -0,0 +1,226 @@
+"""运行优先级：interactive / normal / bulk 三档，映射到 CLI 进程的 nice、ionice 与（可选）cgroup CPU / IO 权重。
+
+聊天回复与批量 API 调用在同一台机器上争用 CPU 与磁盘；启用 agent.priority 后，批量任务让出资源，不拖慢聊天回复：
+- 档位来源：前端（telegram / discord 默认 interactive，api 默认 normal）→ API key（api_keys 中列出的 key，
+  同时也是可用的 API key）→ 请求头 X-OpenAB-Priority（只能调低，不能高于 key / 前端给出的档位）；
+- 进程启动后（含取用预热进程、经 fork server 启动）对整个进程组 setpriority(nice) 与 ioprio_set(ionice)；
+  普通用户只能调低优先级，调高失败时记 debug 日志并保持原值；
+- 档位配置了 cpu_weight / io_weight 时，进程放入 systemd-run --scope 并设置 CPUWeight / IOWeight（见 limits）。
+Claude 常驻进程只服务聊天会话，保持启动时的优先级。运行数按档位计入 agent_runs_by_priority_total。
+
+配置：
+    agent.priority:
+      frontends: {telegram: interactive, discord: interactive, api: normal}
+      api_keys: {"sk-batch-...": bulk}
+      classes:                 # 以下为默认值；ionice 为 idle 或 0~7（best-effort 级别）
+        interactive: {nice: 0, ionice: 4}
+        normal: {nice: 5, ionice: 6}
+        bulk: {nice: 15, ionice: idle, cpu_weight: 20, io_weight: 20}   # cpu_weight / io_weight 默认不设
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import sys
+from collections import ChainMap
+from dataclasses import dataclass, replace
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+
+from .limits import ResourceLimits
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "normal", "bulk")
+HEADER = "X-OpenAB-Priority"
+# 前端 id：cursor_session_state 中的平台缩写 → 配置中的前端名
+FRONTENDS = {"tg": "telegram", "dc": "discord"}
+
+
+@dataclass(frozen=True)
+class PriorityClass:
+    nice: int = 0
+    # ionice：None 不设置，"idle" 为 idle 类，0~7 为 best-effort 级别
+    ionice: Any = None
+    cpu_weight: Optional[int] = None
+    io_weight: Optional[int] = None
+
+
+_DEFAULT_CLASSES = {
+    "interactive": PriorityClass(nice=0, ionice=4),
+    "normal": PriorityClass(nice=5, ionice=6),
+    "bulk": PriorityClass(nice=15, ionice="idle"),
+}
+_DEFAULT_FRONTENDS = {"telegram": "interactive", "discord": "interactive", "api": "normal"}
+
+
+@dataclass(frozen=True)
+class PriorityConfig:
+    frontends: Mapping[str, str]
+    api_keys: Mapping[str, str]
+    classes: Mapping[str, PriorityClass]
+
+
+def normalize(name: Any) -> Optional[str]:
+    """档位名（大小写不敏感）；不是已知档位时返回 None。"""
+    value = str(name or "").strip().lower()
+    return value if value in PRIORITIES else None
+
+
+def _parse_class(name: str, raw: Any) -> PriorityClass:
+    base = _DEFAULT_CLASSES[name]
+    if not isinstance(raw, dict):
+        return base
+
+    def _int(key: str, default: Optional[int]) -> Optional[int]:
+        try:
+            return int(raw[key]) if raw.get(key) not in (None, "") else default
+        except (TypeError, ValueError):
+            return default
+
+    ionice = raw.get("ionice", base.ionice)
+    if ionice is not None and str(ionice).strip().lower() != "idle":
+        try:
+            ionice = min(max(int(ionice), 0), 7)
+        except (TypeError, ValueError):
+            ionice = base.ionice
+    elif ionice is not None:
+        ionice = "idle"
+    return PriorityClass(
+        nice=min(max(_int("nice", base.nice) or 0, -20), 19),
+        ionice=ionice,
+        cpu_weight=_int("cpu_weight", base.cpu_weight),
+        io_weight=_int("io_weight", base.io_weight),
+    )
+
+
+def get_priority_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[PriorityConfig]:
+    """读取 agent.priority；未配置或为 false 时返回 None（所有运行同等优先级）。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("priority")
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        return None
+    frontends = dict(_DEFAULT_FRONTENDS)
+    for name, value in (raw.get("frontends") or {}).items():
+        if normalize(value):
+            frontends[str(name).strip().lower()] = normalize(value)  # type: ignore[assignment]
+    api_keys = {
+        str(key).strip(): normalize(value)
+        for key, value in (raw.get("api_keys") or {}).items()
+        if str(key).strip() and normalize(value)
+    }
+    classes_raw = raw.get("classes") or {}
+    classes = {name: _parse_class(name, classes_raw.get(name)) for name in PRIORITIES}
+    return PriorityConfig(frontends=frontends, api_keys=api_keys, classes=classes)  # type: ignore[arg-type]
+
+
+def api_keys(agent_config: Optional[Mapping[str, Any]]) -> frozenset[str]:
+    """agent.priority.api_keys 中列出的 key（除 api.key 外也可用于鉴权）。"""
+    config = get_priority_config(agent_config)
+    return frozenset(config.api_keys) if config is not None else frozenset()
+
+
+def request_config(
+    agent_config: Optional[Mapping[str, Any]],
+    *,
+    frontend: str,
+    api_key: Optional[str] = None,
+    requested: Optional[str] = None,
+) -> Mapping[str, Any]:
+    """按前端、API key 与请求头确定本次请求的档位，叠加到 agent_config（_priority）。"""
+    cfg = agent_config or {}
+    config = get_priority_config(cfg)
+    if config is None:
+        return cfg
+    name = config.frontends.get(frontend, "normal")
+    if api_key and api_key in config.api_keys:
+        name = config.api_keys[api_key]
+    wanted = normalize(requested)
+    if wanted is not None and PRIORITIES.index(wanted) > PRIORITIES.index(name):
+        name = wanted
+    return ChainMap({"_priority": name}, cfg)
+
+
+def run_priority(agent_config: Optional[Mapping[str, Any]]) -> Optional[str]:
+    """本次运行的档位：_priority（API 请求）或前端默认值（_frontend，聊天）；未启用时为 None。"""
+    cfg = agent_config or {}
+    config = get_priority_config(cfg)
+    if config is None:
+        return None
+    name = normalize(cfg.get("_priority"))
+    if name is None:
+        frontend = str(cfg.get("_frontend") or "api")
+        name = config.frontends.get(FRONTENDS.get(frontend, frontend), "normal")
+    return name
+
+
+def _class_for(agent_config: Optional[Mapping[str, Any]]) -> Optional[tuple[str, PriorityClass]]:
+    name = run_priority(agent_config)
+    if name is None:
+        return None
+    return name, get_priority_config(agent_config).classes[name]  # type: ignore[union-attr]
+
+
+def with_weights(limits: Optional[ResourceLimits], agent_config: Optional[Mapping[str, Any]]) -> Optional[ResourceLimits]:
+    """档位配置了 cpu_weight / io_weight 时并入 limits 的 cgroup 属性（经 systemd-run 生效）。"""
+    found = _class_for(agent_config)
+    if found is None:
+        return limits
+    cls = found[1]
+    props = [(p, str(v)) for p, v in (("CPUWeight", cls.cpu_weight), ("IOWeight", cls.io_weight)) if v is not None]
+    if not props:
+        return limits
+    base = limits or ResourceLimits()
+    kept = tuple((p, v) for p, v in base.cgroup if p not in {k for k, _ in props})
+    return replace(base, cgroup=kept + tuple(props))
+
+
+# ---------- nice / ionice ----------
+
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_WHO_PGRP = 2
+# ioprio_set 系统调用号
+_IOPRIO_SET_NR = {"x86_64": 251, "amd64": 251, "aarch64": 30, "arm64": 30, "i386": 289, "i686": 289,
+                  "armv7l": 314, "ppc64le": 273, "s390x": 282, "riscv64": 30}
+_libc: Any = None
+
+
+def _ioprio_set(who: int, ident: int, value: int) -> bool:
+    global _libc
+    nr = _IOPRIO_SET_NR.get(platform.machine().lower())
+    if not sys.platform.startswith("linux") or nr is None:
+        return False
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    return _libc.syscall(nr, who, ident, value) == 0
+
+
+def apply(pid: int, agent_config: Optional[Mapping[str, Any]], *, group: bool = True) -> None:
+    """把本次运行的档位应用到已启动的进程（group 为 True 时作用于其整个进程组）。"""
+    found = _class_for(agent_config)
+    if found is None:
+        return
+    name, cls = found
+    metrics.inc("agent_runs_by_priority_total", priority=name)
+    if hasattr(os, "setpriority"):
+        which = os.PRIO_PGRP if group else os.PRIO_PROCESS
+        try:
+            if os.getpriority(which, pid) != cls.nice:
+                os.setpriority(which, pid, cls.nice)
+        except OSError as e:
+            logger.debug("setpriority(%s, nice=%s) for %s run failed: %s", pid, cls.nice, name, e)
+    if cls.ionice is not None:
+        if cls.ionice == "idle":
+            value = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+        else:
+            value = (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | int(cls.ionice)
+        if not _ioprio_set(_IOPRIO_WHO_PGRP if group else _IOPRIO_WHO_PROCESS, pid, value):
+            logger.debug("ioprio_set(%s, %s) for %s run failed", pid, cls.ionice, name)
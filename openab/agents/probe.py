@@ -0,0 +1,332 @@
+"""后端健康探测：启动时及定期探测已配置的后端，结果缓存到磁盘。
+
+每个后端记录：可执行文件是否存在、版本（--version）、--help 中列出的参数、登录状态（后端声明
+AUTH_STATUS_ARGS 时执行，如 `agent status`；AUTH_LOGIN_ARGS 用于提示登录命令）、冷启动 / 热启动耗时（连续两次 --version）。
+配置了 warmup_prompt 时，启动后再以该 prompt 跑一次真实请求（在临时目录、新会话中），让 CLI 提前
+完成登录刷新与 JIT 预热，首条用户消息不再承担这部分耗时。
+
+结果按 (backend, 可执行文件路径) 缓存在 ~/.cache/openab/probe.json（OPENAB_PROBE_CACHE 可覆盖），
+可执行文件的 mtime / 大小不变且未超过 interval 时直接复用，不再重新探测。
+get_health() 供路由与错误提示使用：找不到 CLI 或未登录时，运行失败会返回对应的提示而非笼统错误。
+
+配置：agent.probe: false 关闭；或 {interval: 3600, timeout: 20, warmup_prompt: "...", backends: [...]}
+（backends 缺省为 agent.backend 与 agent.routes 中的后端）。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+from openab.core.i18n import t
+
+from . import registry
+from .process import PIPE, STDOUT, create_process, terminate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 3600.0
+DEFAULT_TIMEOUT = 20.0
+# 每条探测命令保留的输出上限
+MAX_OUTPUT_BYTES = 256 * 1024
+# 缓存格式变化时递增，旧缓存整体作废
+CACHE_VERSION = 1
+# --help 输出中的长参数
+_FLAG_RE = re.compile(r"(?<![\w-])--[a-zA-Z][\w-]*")
+_NOT_LOGGED_IN_RE = re.compile(r"not (logged|signed|authenticated)|log ?in required|unauthenticated", re.I)
+
+
+@dataclass
+class BackendHealth:
+    backend: str
+    executable: str
+    found: bool = False
+    mtime: float = 0.0
+    size: int = 0
+    version: Optional[str] = None
+    flags: list[str] = field(default_factory=list)
+    # "ok" / "required"（未登录）/ "unknown"（后端无登录状态命令）
+    auth: str = "unknown"
+    cold_seconds: Optional[float] = None
+    warm_seconds: Optional[float] = None
+    warmup_seconds: Optional[float] = None
+    warmup_ok: Optional[bool] = None
+    error: Optional[str] = None
+    probed_at: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.found and self.auth != "required" and self.warmup_ok is not False
+
+    def supports(self, flag: str) -> bool:
+        """--help 中是否列出了该参数（未能取到参数列表时视为支持）。"""
+        return not self.flags or flag in self.flags
+
+
+@dataclass(frozen=True)
+class ProbeConfig:
+    interval: float = DEFAULT_INTERVAL
+    timeout: float = DEFAULT_TIMEOUT
+    warmup_prompt: Optional[str] = None
+    backends: tuple[str, ...] = ()
+
+
+def get_probe_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[ProbeConfig]:
+    """读取 agent.probe；false 时返回 None（不探测）。缺省启用，探测 agent.backend 与 agent.routes 中的后端。"""
+    from .router import routed_backends
+
+    raw = ((agent_config or {}).get("agent") or {}).get("probe", True)
+    if raw is False:
+        return None
+    raw = raw if isinstance(raw, dict) else {}
+    backends = raw.get("backends") or routed_backends(agent_config)
+    if isinstance(backends, str):
+        backends = [backends]
+    try:
+        interval = float(raw.get("interval") or DEFAULT_INTERVAL)
+        timeout = float(raw.get("timeout") or DEFAULT_TIMEOUT)
+    except (TypeError, ValueError):
+        interval, timeout = DEFAULT_INTERVAL, DEFAULT_TIMEOUT
+    prompt = str(raw.get("warmup_prompt") or "").strip() or None
+    return ProbeConfig(
+        interval=max(60.0, interval),
+        timeout=max(1.0, timeout),
+        warmup_prompt=prompt,
+        backends=tuple(str(b).strip().lower() for b in backends if str(b).strip()),
+    )
+
+
+# ---------- 磁盘缓存 ----------
+
+
+def _cache_path() -> Path:
+    p = os.environ.get("OPENAB_PROBE_CACHE", "").strip()
+    if p:
+        return Path(p).expanduser()
+    return Path.home() / ".cache" / "openab" / "probe.json"
+
+
+def _cache_key(backend: str, executable: str) -> str:
+    return f"{backend}|{executable}"
+
+
+def _load_cache() -> dict[str, dict[str, Any]]:
+    try:
+        data = json.loads(_cache_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+        return {}
+    entries = data.get("entries")
+    return entries if isinstance(entries, dict) else {}
+
+
+def _save_cache(entries: dict[str, dict[str, Any]]) -> None:
+    path = _cache_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".probe-", dir=str(path.parent))
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "entries": entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug("writing probe cache %s failed: %s", path, e)
+
+
+def _from_cache(entry: Any) -> Optional[BackendHealth]:
+    if not isinstance(entry, dict):
+        return None
+    try:
+        return BackendHealth(**entry)
+    except TypeError:
+        return None
+
+
+# ---------- 探测 ----------
+
+# backend -> 最近一次探测结果
+_health: dict[str, BackendHealth] = {}
+_task: Optional[asyncio.Task] = None
+
+
+def get_health(backend: str) -> Optional[BackendHealth]:
+    """最近一次探测结果（尚未探测时为 None）。"""
+    return _health.get(backend)
+
+
+def _resolve(backend: str, agent_config: Optional[Mapping[str, Any]]) -> tuple[str, Optional[Mapping[str, str]]]:
+    """后端当前配置下的可执行文件（尽量解析为绝对路径）与子进程环境。"""
+    plan = registry.load(backend).invocation_plan(agent_config)
+    exe = plan.executable
+    if not os.path.isabs(exe):
+        path = (plan.env or {}).get("PATH") if plan.env else None
+        exe = shutil.which(exe, path=path) or exe
+    return exe, plan.env
+
+
+async def _run(
+    args: list[str], *, backend: str, env: Optional[Mapping[str, str]], timeout: float
+) -> tuple[Optional[int], str, float]:
+    """运行一条探测命令，返回 (退出码, 输出, 耗时)；超时时退出码为 None。"""
+    started = time.monotonic()
+    proc = await create_process(args, env=env, stdin=None, stdout=PIPE, stderr=STDOUT, backend=backend)
+    assert proc.stdout is not None
+
+    async def _collect() -> tuple[int, bytes]:
+        out = bytearray()
+        while True:
+            data = await proc.stdout.read(64 * 1024)  # type: ignore[union-attr]
+            if not data:
+                break
+            if len(out) < MAX_OUTPUT_BYTES:
+                out += data
+        return await proc.wait(), bytes(out)
+
+    try:
+        code, out = await asyncio.wait_for(_collect(), timeout=timeout)
+    except asyncio.TimeoutError:
+        await terminate(proc)
+        return None, "", time.monotonic() - started
+    return code, out.decode("utf-8", errors="replace"), time.monotonic() - started
+
+
+async def probe_backend(
+    backend: str,
+    agent_config: Optional[Mapping[str, Any]] = None,
+    *,
+    config: Optional[ProbeConfig] = None,
+    use_cache: bool = True,
+) -> BackendHealth:
+    """探测单个后端；use_cache 时可执行文件未变且缓存未过期则直接复用。"""
+    config = config or get_probe_config(agent_config) or ProbeConfig()
+    exe, env = _resolve(backend, agent_config)
+    health = BackendHealth(backend=backend, executable=exe, probed_at=time.time())
+    try:
+        st = os.stat(exe)
+    except OSError:
+        health.error = "executable not found"
+        _health[backend] = health
+        metrics.set_gauge("agent_backend_healthy", 0, backend=backend)
+        logger.warning("agent backend %s: %s not found", backend, exe)
+        return health
+    health.found, health.mtime, health.size = True, st.st_mtime, st.st_size
+
+    entries = _load_cache()
+    key = _cache_key(backend, exe)
+    cached = _from_cache(entries.get(key)) if use_cache else None
+    if (
+        cached is not None
+        and cached.mtime == health.mtime
+        and cached.size == health.size
+        and time.time() - cached.probed_at < config.interval
+    ):
+        metrics.inc("agent_probe_cache_hits_total", backend=backend)
+        _health[backend] = cached
+        metrics.set_gauge("agent_backend_healthy", 1 if cached.ok else 0, backend=backend)
+        return cached
+
+    mod = registry.load(backend)
+    try:
+        code, out, health.cold_seconds = await _run([exe, "--version"], backend=backend, env=env, timeout=config.timeout)
+        if code is None:
+            health.error = "--version timed out"
+        else:
+            health.version = next((line.strip() for line in out.splitlines() if line.strip()), None)
+            _, _, health.warm_seconds = await _run([exe, "--version"], backend=backend, env=env, timeout=config.timeout)
+            _, out, _ = await _run([exe, "--help"], backend=backend, env=env, timeout=config.timeout)
+            health.flags = sorted(set(_FLAG_RE.findall(out)))
+        auth_args = getattr(mod, "AUTH_STATUS_ARGS", None)
+        if auth_args:
+            code, out, _ = await _run([exe, *auth_args], backend=backend, env=env, timeout=config.timeout)
+            if code is not None:
+                health.auth = "required" if code != 0 or _NOT_LOGGED_IN_RE.search(out) else "ok"
+    except OSError as e:
+        health.error = str(e)
+    for name, value in (("cold", health.cold_seconds), ("warm", health.warm_seconds)):
+        if value is not None:
+            metrics.observe("agent_probe_seconds", value, backend=backend, kind=name)
+    logger.info(
+        "agent backend %s: %s version=%s auth=%s cold=%.2fs warm=%.2fs",
+        backend, exe, health.version, health.auth, health.cold_seconds or 0.0, health.warm_seconds or 0.0,
+    )
+    entries[key] = asdict(health)
+    _save_cache(entries)
+    _health[backend] = health
+    metrics.set_gauge("agent_backend_healthy", 1 if health.ok else 0, backend=backend)
+    return health
+
+
+async def warmup(backend: str, agent_config: Optional[Mapping[str, Any]], prompt: str, timeout: float) -> None:
+    """以 prompt 跑一次真实请求（临时目录、新会话，不影响用户会话的 --continue），记录耗时与成败。"""
+    health = _health.get(backend)
+    if health is None or not health.found:
+        return
+    cfg = dict(agent_config or {})
+    cfg["_session_new"] = True
+    started = time.monotonic()
+    try:
+        with tempfile.TemporaryDirectory(prefix="openab-warmup-") as tmp:
+            reply = await registry.load(backend).run_async(
+                prompt, workspace=Path(tmp), timeout=int(timeout), agent_config=cfg
+            )
+        usage = getattr(reply, "usage", None)
+        health.warmup_ok = not getattr(reply, "truncated", False) and (usage is None or usage.exit_code == 0)
+    except Exception as e:
+        logger.warning("agent backend %s warmup failed: %s", backend, e)
+        health.warmup_ok = False
+    health.warmup_seconds = time.monotonic() - started
+    metrics.observe("agent_probe_seconds", health.warmup_seconds, backend=backend, kind="warmup")
+    metrics.set_gauge("agent_backend_healthy", 1 if health.ok else 0, backend=backend)
+    logger.info("agent backend %s warmed up in %.2fs (ok=%s)", backend, health.warmup_seconds, health.warmup_ok)
+
+
+async def _probe_loop(agent_config: Optional[Mapping[str, Any]], config: ProbeConfig) -> None:
+    first = True
+    while True:
+        for backend in config.backends:
+            if not registry.is_registered(backend):
+                continue
+            try:
+                await probe_backend(backend, agent_config, config=config, use_cache=first)
+                if first and config.warmup_prompt:
+                    await warmup(backend, agent_config, config.warmup_prompt, config.timeout * 3)
+            except Exception:
+                logger.exception("probing agent backend %s failed", backend)
+        first = False
+        await asyncio.sleep(config.interval)
+
+
+def ensure_started(agent_config: Optional[Mapping[str, Any]]) -> None:
+    """在当前事件循环中启动探测任务（已启动或配置关闭时不做任何事）。"""
+    global _task
+    if _task is not None and not _task.done():
+        return
+    config = get_probe_config(agent_config)
+    if config is None or not config.backends:
+        return
+    _task = asyncio.get_running_loop().create_task(_probe_loop(agent_config, config))
+
+
+def problem_message(backend: str, lang: str) -> Optional[str]:
+    """
+    运行失败时按探测结果给出具体原因：找不到 CLI（再次确认文件仍不存在）或未登录；否则 None。
+    """
+    health = _health.get(backend)
+    if health is None:
+        return None
+    if not health.found and not os.path.exists(health.executable):
+        return t(lang, "backend_not_found", backend=backend, cmd=health.executable)
+    if health.auth == "required":
+        login = getattr(registry.load(backend), "AUTH_LOGIN_ARGS", ())
+        cmd = " ".join([os.path.basename(health.executable), *login])
+        return t(lang, "backend_auth_required", backend=backend, cmd=cmd)
+    return None
@@ -0,0 +1,547 @@
+"""Agent 子进程的统一启动入口：各后端都经由 spawn() 创建 CLI 进程（可命中预热进程池）。
+
+每个 CLI 进程都在独立的会话 / 进程组中启动（start_new_session），超时或取消时整棵进程树
+先收 SIGTERM、宽限期后 SIGKILL；进程退出后，后台 reaper 定期清理仍留在该会话里的子孙进程
+（语言服务器、agent 启动的 shell 等），计入 agent_orphans_reaped_total。会话一旦为空、或其 id（首进程 pid）
+被新启动的进程复用，即不再跟踪，避免向复用该 pid 的进程发信号。
+
+进程由 wait4 回收：每次运行的 user/sys CPU、最大 RSS 与墙钟时间记入 AgentProcess.usage，
+同时写日志并计入 agent_cpu_seconds / agent_max_rss_bytes。资源限制见 limits.py。
+
+agent.spawn_timeout（默认 30 秒，0 不限）限制进程创建本身的耗时，超出时抛 SpawnTimeoutError。
+
+环境变量：OPENAB_KILL_GRACE（SIGTERM 后等待秒数，默认 5）、OPENAB_REAP_ORPHANS=0 关闭 reaper。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+
+from . import forkserver, priority
+from .homes import apply_home_env
+from .limits import ResourceLimits, apply_rlimits, get_limits, preexec_for, wrap_cgroup
+from .result import RunUsage
+
+logger = logging.getLogger(__name__)
+
+PIPE = subprocess.PIPE
+STDOUT = subprocess.STDOUT
+DEVNULL = subprocess.DEVNULL
+# 与 asyncio.subprocess 默认一致
+_STREAM_LIMIT = 2 ** 16
+# 每次写入 stdin 的字符数（约一个管道缓冲区）；更长的 prompt 在后台分块写入
+STDIN_CHUNK_CHARS = 2 ** 16
+DEFAULT_SPAWN_TIMEOUT = 30.0
+
+
+class SpawnTimeoutError(RuntimeError):
+    """CLI 进程未能在 agent.spawn_timeout 内启动（预热池、fork server 或 exec 卡住）。"""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+TERM_GRACE_SECONDS = _env_float("OPENAB_KILL_GRACE", 5.0)
+REAP_INTERVAL_SECONDS = 15.0
+# 已结束运行的会话跟踪多久（秒）；期间一直没有残留进程则停止跟踪
+_REAP_TRACK_SECONDS = 600.0
+_HAS_PGROUPS = hasattr(os, "killpg") and sys.platform != "win32"
+# ru_maxrss 在 Linux 上单位为 KB，macOS 上为字节
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _reap_enabled() -> bool:
+    return os.environ.get("OPENAB_REAP_ORPHANS", "").strip().lower() not in ("0", "false", "no")
+
+
+class AgentProcess:
+    """
+    与 asyncio.subprocess.Process 接口一致的子进程句柄（pid / returncode / stdin / stdout / stderr /
+    wait / communicate / send_signal）。进程退出由 wait4 回收，因此能拿到本次运行的 rusage（usage）。
+    """
+
+    def __init__(
+        self,
+        pid: int,
+        *,
+        backend: str,
+        stdin: Optional[asyncio.StreamWriter] = None,
+        stdout: Optional[asyncio.StreamReader] = None,
+        stderr: Optional[asyncio.StreamReader] = None,
+        started: Optional[float] = None,
+    ) -> None:
+        self.pid = pid
+        self.backend = backend or "unknown"
+        # pid 被复用说明此前以它为 id 的会话已不存在，不再回收它（否则会向新进程发信号）
+        _finished.pop(pid, None)
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode: Optional[int] = None
+        self.usage: Optional[RunUsage] = None
+        self._started = time.monotonic() if started is None else started
+        self._loop = asyncio.get_running_loop()
+        self._exited: asyncio.Future = self._loop.create_future()
+        # 保持 Popen 引用，避免其 __del__ 把未结束的进程交给 subprocess 自己回收
+        self._popen: Optional[subprocess.Popen] = None
+        # 经 fork server 启动时等待其回报退出的任务
+        self._waiter: Optional[asyncio.Task] = None
+        # 后台写入大 prompt 的任务
+        self._stdin_writer: Optional[asyncio.Task] = None
+
+    def _set_exited(self, code: int, ru: Any, ended: float) -> None:
+        """由等待方（wait4 线程等）在事件循环中调用。"""
+        if self._exited.done():
+            return
+        self.returncode = code
+        if self._popen is not None:
+            self._popen.returncode = code
+        if ru is not None:
+            self.usage = RunUsage(
+                user_cpu=ru.ru_utime,
+                sys_cpu=ru.ru_stime,
+                max_rss_bytes=int(ru.ru_maxrss) * _MAXRSS_UNIT,
+                wall_seconds=ended - self._started,
+                exit_code=code,
+            )
+            _record_usage(self.backend, self.pid, self.usage)
+        if self.stdin is not None:
+            self.stdin.close()
+        self._exited.set_result(code)
+        if _HAS_PGROUPS:
+            _finished[self.pid] = (self.backend, time.monotonic(), set())
+            _ensure_reaper()
+
+    def _wait4_thread(self) -> None:
+        try:
+            _, status, ru = os.wait4(self.pid, 0)
+            code = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+            # 已被别处回收，无法得知退出码与用量
+            code, ru = 255, None
+        ended = time.monotonic()
+        try:
+            self._loop.call_soon_threadsafe(self._set_exited, code, ru, ended)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+
+    async def communicate(self, input: Optional[bytes] = None) -> tuple[Optional[bytes], Optional[bytes]]:
+        async def _write() -> None:
+            if self.stdin is None:
+                return
+            try:
+                if input:
+                    self.stdin.write(input)
+                    await self.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.stdin.close()
+
+        async def _read(stream: Optional[asyncio.StreamReader]) -> Optional[bytes]:
+            return await stream.read() if stream is not None else None
+
+        if input is not None:
+            await _write()
+        out, err = await asyncio.gather(_read(self.stdout), _read(self.stderr))
+        await self.wait()
+        return out, err
+
+
+def _record_usage(backend: str, pid: int, usage: RunUsage) -> None:
+    metrics.observe("agent_cpu_seconds", usage.user_cpu + usage.sys_cpu, backend=backend)
+    metrics.observe("agent_max_rss_bytes", usage.max_rss_bytes, backend=backend)
+    metrics.inc("agent_cpu_seconds_total", usage.user_cpu + usage.sys_cpu, backend=backend)
+    logger.info(
+        "agent %s pid %d exited %s: wall=%.2fs user=%.2fs sys=%.2fs maxrss=%.1fMB",
+        backend,
+        pid,
+        usage.exit_code,
+        usage.wall_seconds,
+        usage.user_cpu,
+        usage.sys_cpu,
+        usage.max_rss_bytes / (1024 * 1024),
+    )
+
+
+async def _read_stream(loop: asyncio.AbstractEventLoop, pipe: Any) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader(limit=_STREAM_LIMIT, loop=loop)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+    return reader
+
+
+async def _write_stream(loop: asyncio.AbstractEventLoop, pipe: Any) -> asyncio.StreamWriter:
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.streams.FlowControlMixin(loop=loop), pipe
+    )
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+async def create_process(
+    args: list[str],
+    *,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[str] = None,
+    stdin: Any = None,
+    stdout: Any = PIPE,
+    stderr: Any = PIPE,
+    backend: str = "",
+    limits: Optional[ResourceLimits] = None,
+) -> AgentProcess:
+    """
+    直接创建子进程（不经过进程池），放在独立会话中并应用资源限制，退出后交给 reaper 跟踪。
+    fork server 已启动时由它代为 fork（见 forkserver.py），不可用时退回本地启动。
+    """
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    if forkserver.socket_path() is not None and preexec_for(limits) is None:
+        try:
+            proc = await _create_remote(
+                wrap_cgroup(args, limits),
+                env=env,
+                cwd=cwd,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                backend=backend,
+                limits=limits,
+                started=started,
+            )
+            metrics.observe("agent_spawn_seconds", time.monotonic() - started, via="forkserver")
+            return proc
+        except forkserver.ForkServerUnavailable as e:
+            logger.warning("fork server unavailable (%s); spawning %s directly", e, backend or "agent")
+    popen = subprocess.Popen(
+        wrap_cgroup(args, limits),
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        env=env,
+        cwd=cwd,
+        start_new_session=_HAS_PGROUPS,
+        preexec_fn=preexec_for(limits),
+    )
+    if limits is not None and limits.has_rlimits:
+        apply_rlimits(popen.pid, limits)
+    metrics.observe("agent_spawn_seconds", time.monotonic() - started, via="local")
+    proc = AgentProcess(popen.pid, backend=backend, started=started)
+    proc._popen = popen
+    threading.Thread(target=proc._wait4_thread, name=f"openab-wait-{popen.pid}", daemon=True).start()
+    try:
+        if popen.stdin is not None:
+            proc.stdin = await _write_stream(loop, popen.stdin)
+        if popen.stdout is not None:
+            proc.stdout = await _read_stream(loop, popen.stdout)
+        if popen.stderr is not None:
+            proc.stderr = await _read_stream(loop, popen.stderr)
+    except BaseException:
+        kill_tree(proc)
+        raise
+    return proc
+
+
+async def _create_remote(
+    args: list[str],
+    *,
+    env: Optional[Mapping[str, str]],
+    cwd: Optional[str],
+    stdin: Any,
+    stdout: Any,
+    stderr: Any,
+    backend: str,
+    limits: Optional[ResourceLimits],
+    started: float,
+) -> AgentProcess:
+    loop = asyncio.get_running_loop()
+    child = await forkserver.spawn(args, env=env, cwd=cwd, stdin=stdin, stdout=stdout, stderr=stderr)
+    if limits is not None and limits.has_rlimits:
+        apply_rlimits(child.pid, limits)
+    proc = AgentProcess(child.pid, backend=backend, started=started)
+
+    async def _wait() -> None:
+        code, ru = await child.wait_exit()
+        proc._set_exited(code, ru, time.monotonic())
+
+    proc._waiter = loop.create_task(_wait())
+    stdin_fd, stdout_fd, stderr_fd = child.pipes
+    try:
+        if stdin_fd is not None:
+            proc.stdin = await _write_stream(loop, open(stdin_fd, "wb", buffering=0))
+        if stdout_fd is not None:
+            proc.stdout = await _read_stream(loop, open(stdout_fd, "rb", buffering=0))
+        if stderr_fd is not None:
+            proc.stderr = await _read_stream(loop, open(stderr_fd, "rb", buffering=0))
+    except BaseException:
+        kill_tree(proc)
+        raise
+    return proc
+
+
+def signal_tree(proc: AgentProcess, sig: int) -> bool:
+    """向进程所在进程组（= 会话首进程 pid）发信号；组已不存在返回 False。"""
+    if _HAS_PGROUPS:
+        try:
+            os.killpg(proc.pid, sig)
+            return True
+        except (ProcessLookupError, PermissionError):
+            return False
+    if proc.returncode is None:
+        try:
+            proc.send_signal(sig)
+            return True
+        except ProcessLookupError:
+            pass
+    return False
+
+
+def kill_tree(proc: AgentProcess) -> None:
+    """立即 SIGKILL 整个进程组（同步，用于回收池中/常驻进程）。"""
+    signal_tree(proc, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+
+def _group_alive(pgid: int) -> bool:
+    try:
+        os.killpg(pgid, 0)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+async def terminate(proc: AgentProcess, grace: Optional[float] = None) -> None:
+    """结束整棵进程树：SIGTERM → 等待宽限期 → 仍存活则 SIGKILL；返回时首进程已被回收。"""
+    grace = TERM_GRACE_SECONDS if grace is None else grace
+    deadline = time.monotonic() + grace
+    if not signal_tree(proc, signal.SIGTERM) and proc.returncode is not None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(proc.wait()), timeout=grace)
+        # 首进程已退出，给组内其余进程剩余的宽限期
+        while _HAS_PGROUPS and _group_alive(proc.pid) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+    except asyncio.TimeoutError:
+        pass
+    kill_tree(proc)
+    await proc.wait()
+
+
+async def communicate(
+    proc: AgentProcess, timeout: float
+) -> tuple[Optional[bytes], Optional[bytes]]:
+    """proc.communicate() 加超时；超时或被取消时结束整棵进程树后原样抛出。"""
+    try:
+        return await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        await asyncio.shield(terminate(proc))
+        raise
+
+
+async def write_stdin(proc: AgentProcess, data: str) -> None:
+    """把 prompt 分块编码写入子进程 stdin 并关闭（EOF 即提示结束）；大 prompt 不会整段再复制一份。"""
+    assert proc.stdin is not None
+    try:
+        for i in range(0, len(data), STDIN_CHUNK_CHARS):
+            if proc.stdin.is_closing():
+                break
+            proc.stdin.write(data[i:i + STDIN_CHUNK_CHARS].encode("utf-8"))
+            await proc.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        proc.stdin.close()
+
+
+def _spawn_timeout(agent_config: Optional[Mapping[str, Any]]) -> float:
+    raw = ((agent_config or {}).get("agent") or {}).get("spawn_timeout")
+    if raw in (None, ""):
+        return DEFAULT_SPAWN_TIMEOUT
+    try:
+        return max(0.0, float(raw))
+    except (TypeError, ValueError):
+        return DEFAULT_SPAWN_TIMEOUT
+
+
+async def spawn(
+    args: list[str],
+    *,
+    backend: str,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[str] = None,
+    stdout: Any = PIPE,
+    stderr: Any = PIPE,
+    stdin_data: Optional[str] = None,
+    pool: Any = None,
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AgentProcess:
+    """
+    启动一次 agent 运行。stdin_data 非空时 prompt 经 stdin 传入（argv 与 prompt 无关），
+    此时若给出 pool（PoolConfig）则优先取用预热好的同参数进程。
+    agent_config 中的 <backend>.limits / agent.limits 作为资源限制应用到进程上，运行优先级（见 priority）
+    决定进程的 nice / ionice 与 cgroup 权重；
+    选定了凭据目录时（见 homes）在 env 上叠加对应的环境变量。
+    """
+    limits = priority.with_weights(get_limits(agent_config, backend), agent_config)
+    env = apply_home_env(env, agent_config)
+
+    async def _start() -> AgentProcess:
+        if stdin_data is not None and pool is not None:
+            from . import pool as warm_pool
+
+            proc = await warm_pool.acquire(
+                pool, args, backend=backend, env=env, cwd=cwd, stdout=stdout, stderr=stderr, limits=limits
+            )
+            if proc is not None:
+                # 用量里的墙钟时间从取用时算起，不含在池中等待的时间
+                proc._started = time.monotonic()
+                return proc
+        return await create_process(
+            args,
+            env=env,
+            cwd=cwd,
+            stdin=PIPE if stdin_data is not None else None,
+            stdout=stdout,
+            stderr=stderr,
+            backend=backend,
+            limits=limits,
+        )
+
+    limit = _spawn_timeout(agent_config)
+    try:
+        proc = await asyncio.wait_for(_start(), timeout=limit or None)
+    except asyncio.TimeoutError:
+        metrics.inc("agent_stalls_total", backend=backend, phase="spawn")
+        logger.warning("agent %s did not start within %gs", backend, limit)
+        raise SpawnTimeoutError(f"{backend} CLI did not start within {limit:g}s") from None
+    priority.apply(proc.pid, agent_config, group=_HAS_PGROUPS)
+    if stdin_data is not None:
+        if len(stdin_data) <= STDIN_CHUNK_CHARS:
+            await write_stdin(proc, stdin_data)
+        else:
+            # 超过管道容量的 prompt 在后台写入，调用方同时读 stdout，避免 CLI 边读边写时互相阻塞
+            proc._stdin_writer = asyncio.get_running_loop().create_task(write_stdin(proc, stdin_data))
+    return proc
+
+
+# ---------- 残留进程回收 ----------
+
+# 会话 id（= 首进程 pid）-> (backend, 结束时刻, 已发过信号的 pid)；每个残留进程只计数一次
+_finished: dict[int, tuple[str, float, set[int]]] = {}
+_reaper_task: Optional[asyncio.Task] = None
+
+
+def _ensure_reaper() -> None:
+    global _reaper_task
+    if not _reap_enabled():
+        return
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.get_running_loop().create_task(_reaper_loop())
+
+
+def _session_members(sids: set[int]) -> dict[int, list[int]]:
+    """扫描 /proc，返回 {会话 id: [仍在该会话中的 pid]}（仅 Linux）。"""
+    out: dict[int, list[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return out
+    me = os.getpid()
+    for name in entries:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                raw = f.read().decode("ascii", "replace")
+        except OSError:
+            continue
+        # comm 可能含空格 / 括号，从最后一个 ')' 之后取字段：state ppid pgrp session ...
+        fields = raw[raw.rfind(")") + 2:].split()
+        if len(fields) < 4:
+            continue
+        pid = int(name)
+        sid = int(fields[3])
+        if sid in sids and pid != me and fields[0] != "Z":
+            out.setdefault(sid, []).append(pid)
+    return out
+
+
+def reap_orphans() -> int:
+    """结束已完成运行的会话中残留的进程；返回本次发送信号的进程数。"""
+    if not _finished:
+        return 0
+    now = time.monotonic()
+    killed = 0
+    if os.path.isdir("/proc"):
+        members = _session_members(set(_finished))
+        for sid, (backend, ended, seen) in list(_finished.items()):
+            pids = members.get(sid) or []
+            if not pids:
+                # 会话已空：不会再有进程加入，其 id 之后可能被复用
+                _finished.pop(sid, None)
+                continue
+            # 第一次发现先 SIGTERM，之后仍在则 SIGKILL
+            sig = signal.SIGTERM if now - ended < REAP_INTERVAL_SECONDS * 2 else signal.SIGKILL
+            reaped = 0
+            for pid in pids:
+                try:
+                    os.kill(pid, sig)
+                except (ProcessLookupError, PermissionError):
+                    continue
+                killed += 1
+                if pid not in seen:
+                    seen.add(pid)
+                    reaped += 1
+            if reaped:
+                metrics.inc("agent_orphans_reaped_total", reaped, backend=backend)
+                logger.info("reaped %d leftover %s process(es) from session %d", reaped, backend, sid)
+            if now - ended > _REAP_TRACK_SECONDS:
+                _finished.pop(sid, None)
+    else:
+        # 无 /proc（如 macOS）：按进程组回收，每个进程组计数一次
+        for sid, (backend, ended, seen) in list(_finished.items()):
+            if _group_alive(sid):
+                sig = signal.SIGTERM if now - ended < REAP_INTERVAL_SECONDS * 2 else signal.SIGKILL
+                try:
+                    os.killpg(sid, sig)
+                except (ProcessLookupError, PermissionError):
+                    continue
+                killed += 1
+                if sid not in seen:
+                    seen.add(sid)
+                    metrics.inc("agent_orphans_reaped_total", backend=backend)
+            else:
+                _finished.pop(sid, None)
+    return killed
+
+
+async def _reaper_loop() -> None:
+    while _finished:
+        await asyncio.sleep(REAP_INTERVAL_SECONDS)
+        try:
+            reap_orphans()
+        except Exception:
+            logger.exception("orphan reaper failed")
@@ -0,0 +1,169 @@
+"""后端注册表：backend id -> 后端模块，首次使用时才导入。
+
+后端模块需提供 run_async / run_stream_async（见 AgentBackend），可选提供：
+- CAPABILITIES：Capabilities，声明是否支持流式、会话列表、按 id 恢复、延续上一会话；
+- CLI_NAME：默认 CLI 命令名（供 detect_cli 检测），缺省为 backend id；
+- HOME_ENV：指定登录 / 配置目录的环境变量（供凭据目录池 homes 使用），缺省为 HOME；
+- DEFAULT_HOME / SHARED_FILES：默认登录目录、每用户独立目录需从登录目录链接的凭据文件（见 homes）；
+- list_sessions(max_sessions, home=None) -> [(session_id, display_name), ...]：供 /resume 列出历史会话，
+  home 为用户独立目录时只扫描该目录。
+
+内置后端写在 _BUILTIN 中（未以包形式安装、没有 entry points 时也可用）；第三方后端在自己包的
+pyproject.toml 中声明 entry point 即可，无需改动 openab：
+
+    [project.entry-points."openab.backends"]
+    mybackend = "mypkg.openab_backend"
+
+entry point 名即 backend id，值为模块（或模块中的对象）；同名时覆盖内置后端。
+"""
+from __future__ import annotations
+
+import importlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional, Protocol
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "openab.backends"
+DEFAULT_BACKEND = "cursor"
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    """后端能力。sessions：能列出历史会话；resume：能按 id 恢复会话；continue_session：能延续上一会话。"""
+
+    streaming: bool = True
+    sessions: bool = False
+    resume: bool = False
+    continue_session: bool = False
+
+
+class AgentBackend(Protocol):
+    async def run_async(
+        self, prompt: str, *, workspace: Any = None, timeout: int = 300, lang: str = "en", agent_config: Any = None
+    ) -> str: ...
+
+    def run_stream_async(
+        self, prompt: str, *, workspace: Any = None, timeout: int = 300, lang: str = "en", agent_config: Any = None
+    ) -> AsyncIterator[str]: ...
+
+
+@dataclass(frozen=True)
+class BackendSpec:
+    """target 为 "模块" 或 "模块:属性"；cli 为默认命令名（None 时导入后读 CLI_NAME）。"""
+
+    name: str
+    target: str
+    cli: Optional[str] = None
+
+
+# 与 pyproject.toml 中 [project.entry-points."openab.backends"] 保持一致
+_BUILTIN: tuple[BackendSpec, ...] = (
+    BackendSpec("cursor", "openab.agents.cursor", "agent"),
+    BackendSpec("openclaw", "openab.agents.openclaw", "openclaw"),
+    BackendSpec("claude", "openab.agents.claude", "claude"),
+    BackendSpec("gemini", "openab.agents.gemini", "gemini"),
+    BackendSpec("codex", "openab.agents.codex", "codex"),
+)
+
+_specs: Optional[dict[str, BackendSpec]] = None
+_loaded: dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _entry_points() -> list[Any]:
+    try:
+        from importlib.metadata import entry_points
+
+        return list(entry_points(group=ENTRY_POINT_GROUP))
+    except Exception as e:  # 元数据损坏等不应影响内置后端
+        logger.warning("reading %s entry points failed: %s", ENTRY_POINT_GROUP, e)
+        return []
+
+
+def _discover() -> dict[str, BackendSpec]:
+    global _specs
+    if _specs is None:
+        specs = {s.name: s for s in _BUILTIN}
+        for ep in _entry_points():
+            name = ep.name.strip().lower()
+            builtin = specs.get(name)
+            cli = builtin.cli if builtin is not None and builtin.target == ep.value else None
+            specs[name] = BackendSpec(name, ep.value, cli)
+        _specs = specs
+    return _specs
+
+
+def register(name: str, target: str, *, cli: Optional[str] = None) -> None:
+    """以代码方式注册（或覆盖）后端，如测试或嵌入使用时。"""
+    name = name.strip().lower()
+    with _lock:
+        _discover()[name] = BackendSpec(name, target, cli)
+        _loaded.pop(name, None)
+
+
+def names() -> list[str]:
+    """已注册的 backend id（内置在前，按声明顺序）。"""
+    return list(_discover())
+
+
+def is_registered(name: str) -> bool:
+    return name in _discover()
+
+
+def load(name: str) -> AgentBackend:
+    """导入并返回后端模块（结果缓存）；未注册的 id 回退到 cursor。"""
+    mod = _loaded.get(name)
+    if mod is not None:
+        return mod
+    specs = _discover()
+    spec = specs.get(name)
+    if spec is None:
+        logger.warning("unknown agent backend %r, falling back to %s", name, DEFAULT_BACKEND)
+        return load(DEFAULT_BACKEND)
+    with _lock:
+        mod = _loaded.get(name)
+        if mod is None:
+            started = time.monotonic()
+            module_name, _, attr = spec.target.partition(":")
+            mod = importlib.import_module(module_name)
+            for part in filter(None, attr.split(".")):
+                mod = getattr(mod, part)
+            elapsed = time.monotonic() - started
+            metrics.observe("agent_backend_import_seconds", elapsed, backend=name)
+            logger.debug("loaded agent backend %s from %s in %.3fs", name, spec.target, elapsed)
+            _loaded[name] = mod
+    return mod
+
+
+def capabilities(name: str) -> Capabilities:
+    return getattr(load(name), "CAPABILITIES", None) or Capabilities()
+
+
+def cli_name(name: str) -> str:
+    """默认 CLI 命令名；内置后端不需导入模块。"""
+    spec = _discover().get(name)
+    if spec is not None and spec.cli:
+        return spec.cli
+    return str(getattr(load(name), "CLI_NAME", None) or name)
+
+
+def cli_names() -> list[tuple[str, str]]:
+    """已注册后端的 (backend_id, 默认命令名)，内置在前；供 openab.core.detect_cli 检测（含第三方后端）。"""
+    return [(name, cli_name(name)) for name in names()]
+
+
+def list_sessions(name: str, max_sessions: int = 12, home: Any = None) -> list[tuple[str, str]]:
+    """后端的历史会话 [(session_id, display_name), ...]；不支持时为空。home 非空时只列该登录目录下的会话。"""
+    backend = load(name)
+    fn = getattr(backend, "list_sessions", None)
+    if fn is None or not capabilities(name).sessions:
+        return []
+    if home is not None:
+        return list(fn(max_sessions=max_sessions, home=home))
+    return list(fn(max_sessions=max_sessions))
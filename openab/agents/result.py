@@ -0,0 +1,102 @@
+"""Agent 运行结果：run_async 返回的仍是 str（兼容旧调用方），附带本次运行的资源用量等信息。"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+from openab.core.i18n import t
+
+# 没有正常回复时的结构化结果（AgentReply.outcome）：全程无输出直到软期限、看门狗判定卡住、CLI 结束但没有输出
+OUTCOMES = ("timed_out", "stalled", "no_output")
+
+
+@dataclass(frozen=True)
+class RunUsage:
+    """子进程退出时由 wait4 取得的资源用量。"""
+
+    user_cpu: float
+    sys_cpu: float
+    max_rss_bytes: int
+    wall_seconds: float
+    exit_code: Optional[int] = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "user_cpu": round(self.user_cpu, 3),
+            "sys_cpu": round(self.sys_cpu, 3),
+            "max_rss_bytes": self.max_rss_bytes,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "exit_code": self.exit_code,
+        }
+
+
+@dataclass(frozen=True)
+class TokenUsage:
+    """CLI 事件流中报告的 token 用量（如 Codex turn.completed）。"""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_input_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+class AgentReply(str):
+    """
+    回复文本；usage 为本次 CLI 运行的资源用量（无子进程或未知时为 None），
+    tokens 为 CLI 报告的 token 用量（后端不提供时为 None），
+    output 为捕获的完整输出（capture.CapturedOutput；输出过大溢出到文件时文本只是其开头部分），
+    truncated 为 True 表示运行超过软期限、文本只是已产出的部分（可续写）。
+    session_id 为本次运行所在的后端会话 ID（后端输出中取得；未知时为 None）。
+    outcome 为没有正常回复时的结果（OUTCOMES 之一，文本为相应的提示文案）；有回复（含被截断）时为 None。
+    error 为 CLI 明确报告的错误信息（结果事件 is_error、turn.failed 等；没有时为 None）。
+    断路器、自适应超时等据此判断运行结果，不解析提示文案，也不把正常回复的正文当作错误信息。
+    流式运行结束时产出一个空文本的 AgentReply，只用来带回 usage / error。
+    """
+
+    usage: Optional[RunUsage]
+    tokens: Optional[TokenUsage]
+    output: Any
+    truncated: bool
+    session_id: Optional[str]
+    outcome: Optional[str]
+    error: Optional[str]
+
+    def __new__(
+        cls,
+        text: str,
+        *,
+        usage: Optional[RunUsage] = None,
+        tokens: Optional[TokenUsage] = None,
+        output: Any = None,
+        truncated: bool = False,
+        session_id: Optional[str] = None,
+        outcome: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> "AgentReply":
+        obj = super().__new__(cls, text)
+        obj.usage = usage
+        obj.tokens = tokens
+        obj.output = output
+        obj.truncated = truncated
+        obj.session_id = session_id
+        obj.outcome = outcome
+        obj.error = error
+        return obj
+
+
+def no_output_reply(lang: str, **kwargs: Any) -> AgentReply:
+    """CLI 结束但没有任何输出时的回复（agent_no_output 文案，outcome 为 no_output）。"""
+    return AgentReply(t(lang, "agent_no_output"), outcome="no_output", **kwargs)
+
+
+def report_session(agent_config: Optional[Mapping[str, Any]], session_id: Optional[str]) -> None:
+    """
+    把本次运行实际所在的后端会话 ID 交给调用方（agent_config 中的 _pin_session 回调，
+    由 cursor_session_state 注入），后续调用以 --resume <id> 显式恢复，而非「最近一次会话」。
+    """
+    callback = (agent_config or {}).get("_pin_session")
+    if callback is not None and session_id:
+        callback(session_id)
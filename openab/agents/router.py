@@ -0,0 +1,159 @@
+"""按请求的 model 字段选择后端：路由表把模型名映射到一个后端或一组后端，组内按实时负载或近期延迟选取。
+
+配置 agent.routes（未配置时只有 openab → agent.backend）：
+    routes:
+      fast: codex                        # 单个后端
+      smart: [claude, codex]             # 一组后端，默认 least_loaded
+      any: {backends: [cursor, codex, claude], strategy: latency}
+- least_loaded：运行中 + 排队中的运行数最少者（见 serialize.queue_depth）；相同时取近期延迟低者；
+- latency：近期延迟（agent_run_seconds 中位数，流式请求用 agent_ttft_seconds）最低者；没有样本的后端优先，
+  以便取得测量值；相同时取负载低者。
+断路器打开（见 breaker）或探测到问题（找不到 CLI / 未登录，见 probe）的后端不参与选择，组内全部不可用时仍从全部中选。
+路由表中没有 openab 时补上 openab → agent.backend；未知的模型名按 openab 处理。
+"""
+from __future__ import annotations
+
+import contextlib
+import logging
+from collections import ChainMap
+from dataclasses import dataclass
+from typing import Any, Iterator, Mapping, Optional
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "openab"
+STRATEGIES = ("least_loaded", "latency")
+# 近期延迟取滑动窗口中位数所需的最少样本数
+MIN_LATENCY_SAMPLES = 3
+
+
+@dataclass(frozen=True)
+class Route:
+    backends: tuple[str, ...]
+    strategy: str = "least_loaded"
+
+
+def _default_backend(agent_config: Optional[Mapping[str, Any]]) -> str:
+    from . import get_backend
+
+    return get_backend(agent_config)  # type: ignore[arg-type]
+
+
+def _parse_route(raw: Any) -> Optional[Route]:
+    strategy = "least_loaded"
+    if isinstance(raw, dict):
+        strategy = str(raw.get("strategy") or strategy).strip().lower()
+        raw = raw.get("backends") or raw.get("backend")
+    if isinstance(raw, str):
+        raw = [raw]
+    if not isinstance(raw, (list, tuple)):
+        return None
+    backends = tuple(dict.fromkeys(str(b).strip().lower() for b in raw if str(b).strip()))
+    if not backends:
+        return None
+    if strategy not in STRATEGIES:
+        logger.warning("unknown routing strategy %r, using least_loaded", strategy)
+        strategy = "least_loaded"
+    # backend: agent 与 cursor 等价（同 get_backend）
+    return Route(tuple("cursor" if b == "agent" else b for b in backends), strategy)
+
+
+def get_routes(agent_config: Optional[Mapping[str, Any]]) -> dict[str, Route]:
+    """模型名 → Route；始终包含 openab。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("routes")
+    routes: dict[str, Route] = {}
+    if isinstance(raw, dict):
+        for name, value in raw.items():
+            route = _parse_route(value)
+            if route is None:
+                logger.warning("ignoring route %r: no backends", name)
+                continue
+            routes[str(name).strip()] = route
+    routes.setdefault(DEFAULT_MODEL, Route((_default_backend(agent_config),)))
+    return routes
+
+
+def model_names(agent_config: Optional[Mapping[str, Any]]) -> list[str]:
+    """可路由的模型名（/v1/models）。"""
+    return list(get_routes(agent_config))
+
+
+def routed_backends(agent_config: Optional[Mapping[str, Any]]) -> list[str]:
+    """路由表涉及的全部后端（agent.backend 在前），供健康探测使用。"""
+    names = [_default_backend(agent_config)]
+    for route in get_routes(agent_config).values():
+        names.extend(route.backends)
+    return list(dict.fromkeys(names))
+
+
+# ---------- 实时测量 ----------
+
+# backend -> 运行中的运行数
+_running: dict[str, int] = {}
+
+
+@contextlib.contextmanager
+def running(backend: str) -> Iterator[None]:
+    """标记该后端正在运行一次（计入 least_loaded 的负载与 agent_runs_active）。"""
+    _running[backend] = _running.get(backend, 0) + 1
+    metrics.set_gauge("agent_runs_active", _running[backend], backend=backend)
+    try:
+        yield
+    finally:
+        _running[backend] -= 1
+        metrics.set_gauge("agent_runs_active", _running[backend], backend=backend)
+
+
+def load(backend: str) -> int:
+    """运行中 + 等待会话锁的运行数。"""
+    from .serialize import queue_depth
+
+    return _running.get(backend, 0) + queue_depth(backend)
+
+
+def latency(backend: str, *, stream: bool = False) -> Optional[float]:
+    """近期延迟（秒）；样本不足时为 None。"""
+    if stream:
+        return metrics.percentile("agent_ttft_seconds", 0.5, min_samples=MIN_LATENCY_SAMPLES, backend=backend)
+    return metrics.percentile("agent_run_seconds", 0.5, min_samples=MIN_LATENCY_SAMPLES, backend=backend, mode="full")
+
+
+def _available(backend: str) -> bool:
+    from . import breaker, probe
+
+    return not breaker.is_open(backend) and probe.problem_message(backend, "en") is None
+
+
+def pick(route: Route, *, stream: bool = False) -> str:
+    """按 route.strategy 从组内选一个后端。"""
+    if len(route.backends) == 1:
+        return route.backends[0]
+    candidates = [b for b in route.backends if _available(b)] or list(route.backends)
+
+    def lat(b: str) -> float:
+        value = latency(b, stream=stream)
+        return -1.0 if value is None else value
+
+    if route.strategy == "latency":
+        return min(candidates, key=lambda b: (lat(b), load(b)))
+    return min(candidates, key=lambda b: (load(b), lat(b)))
+
+
+def with_backend(agent_config: Optional[Mapping[str, Any]], backend: str) -> Mapping[str, Any]:
+    """在 agent_config 上叠加 agent.backend（其余配置不变）。"""
+    cfg = agent_config or {}
+    return ChainMap({"agent": {**(cfg.get("agent") or {}), "backend": backend}}, cfg)
+
+
+def route_config(
+    agent_config: Optional[Mapping[str, Any]], model: Optional[str], *, stream: bool = False
+) -> Mapping[str, Any]:
+    """按请求的 model 选定后端，返回本次请求使用的 agent_config。"""
+    routes = get_routes(agent_config)
+    name = str(model or "").strip()
+    route = routes.get(name) or routes[DEFAULT_MODEL]
+    backend = pick(route, stream=stream)
+    metrics.inc("agent_routed_total", model=name if name in routes else DEFAULT_MODEL, backend=backend)
+    return with_backend(agent_config, backend)
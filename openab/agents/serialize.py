@@ -0,0 +1,142 @@
+"""按会话串行：同一后端会话的运行依次执行，不同会话并行。
+
+两条消息同时在同一个 CLI 会话上运行时，CLI 会把会话记录写乱或交错。run_agent_async / run_agent_stream_async
+先按 session_key() 取得会话锁再运行。key 尽量取具体的会话 ID，同一会话无论来自哪个入口都排在一起：
+- 已知会话 ID（_resume_id：/resume、API 指定、聊天用户已固定的会话）：同一 ID 的调用依次执行；
+- 尚未固定会话的聊天用户（_session_key）：该用户的消息按到达顺序执行；排到时前一条运行若已固定了会话 ID
+  （见 _refresh），再取得该 ID 的锁；
+- 延续「最近一次会话」（后端 continues_latest() 为真且未指定会话）：同一后端的这类调用依次执行；
+- 新会话等其余情况不加锁。
+工作区视图按 owner_key() 复用：聊天用户固定用用户 key，会话 ID 变化时不换工作区。
+排队深度计入 agent_session_queue_depth，等待时间计入 agent_session_wait_seconds。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import ChainMap
+from typing import Any, AsyncIterator, Mapping, Optional
+
+from openab.core import metrics
+
+from . import registry
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # 持有 + 等待该锁的运行数，为 0 时删除
+        self.users = 0
+
+
+_entries: dict[str, _Entry] = {}
+# backend -> 正在排队（尚未取得锁）的运行数
+_waiting: dict[str, int] = {}
+
+
+def session_key(backend: str, agent_config: Optional[Mapping[str, Any]]) -> Optional[str]:
+    """本次运行所在会话的串行 key；不会与其他运行共享会话时为 None。"""
+    cfg = agent_config or {}
+    rid = cfg.get("_resume_id")
+    if rid is not None and str(rid).strip():
+        return f"{backend}:resume:{str(rid).strip()}"
+    user = cfg.get("_session_key")
+    if user:
+        return f"{backend}:{user}"
+    if cfg.get("_session_new") is True:
+        return None
+    continues_latest = getattr(registry.load(backend), "continues_latest", None)
+    if continues_latest is not None and continues_latest(cfg):
+        return f"{backend}:latest"
+    return None
+
+
+def owner_key(backend: str, agent_config: Optional[Mapping[str, Any]]) -> Optional[str]:
+    """按会话归属复用的资源（工作区视图）的 key：聊天用户为用户 key，其余同 session_key。"""
+    user = (agent_config or {}).get("_session_key")
+    if user:
+        return f"{backend}:{user}"
+    return session_key(backend, agent_config)
+
+
+def queue_depth(backend: Optional[str] = None) -> int:
+    """正在等待会话锁的运行数（某个后端或全部）。"""
+    if backend is not None:
+        return _waiting.get(backend, 0)
+    return sum(_waiting.values())
+
+
+def _set_waiting(backend: str, delta: int) -> None:
+    _waiting[backend] = _waiting.get(backend, 0) + delta
+    metrics.set_gauge("agent_session_queue_depth", _waiting[backend], backend=backend)
+
+
+@contextlib.asynccontextmanager
+async def session_turn(
+    backend: str, agent_config: Optional[Mapping[str, Any]]
+) -> AsyncIterator[Optional[Mapping[str, Any]]]:
+    """
+    取得本次运行的会话锁（无需加锁时直接进入），产出本次实际使用的 agent_config：
+    配置构造之后、取得锁之前，前一条运行可能已固定了会话 ID（_pin_session），此时改为显式恢复该会话。
+    """
+    key = session_key(backend, agent_config)
+    if key is None:
+        yield agent_config
+        return
+    async with _locked(backend, key):
+        cfg = _refresh(agent_config)
+        pinned = session_key(backend, cfg)
+        if pinned is None or pinned == key:
+            yield cfg
+            return
+        # 排队期间前一条运行固定了会话 ID：同一会话的其他调用（如指定该 ID 的 API 调用）按 ID 加锁
+        async with _locked(backend, pinned):
+            yield cfg
+
+
+@contextlib.asynccontextmanager
+async def _locked(backend: str, key: str) -> AsyncIterator[None]:
+    entry = _entries.get(key)
+    if entry is None:
+        entry = _entries[key] = _Entry()
+    entry.users += 1
+    started = time.monotonic()
+    queued = entry.lock.locked()
+    if queued:
+        _set_waiting(backend, 1)
+    try:
+        try:
+            await entry.lock.acquire()
+        finally:
+            if queued:
+                _set_waiting(backend, -1)
+        waited = time.monotonic() - started
+        metrics.observe("agent_session_wait_seconds", waited, backend=backend)
+        if queued:
+            logger.info("agent %s run for %s waited %.2fs for the session", backend, key, waited)
+        try:
+            yield
+        finally:
+            entry.lock.release()
+    finally:
+        entry.users -= 1
+        if entry.users == 0 and _entries.get(key) is entry:
+            del _entries[key]
+
+
+def _refresh(agent_config: Optional[Mapping[str, Any]]) -> Optional[Mapping[str, Any]]:
+    """排队前构造的配置尚无会话 ID 时，读取（前一条运行刚固定的）当前会话 ID。"""
+    cfg = agent_config or {}
+    current = cfg.get("_current_session")
+    if current is None or cfg.get("_session_new") is True or cfg.get("_resume_id"):
+        return agent_config
+    rid = current()
+    if not rid:
+        return agent_config
+    return ChainMap({"_resume_id": rid, "_cursor_resume_id": rid}, cfg)
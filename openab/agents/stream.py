@@ -0,0 +1,277 @@
+"""流式输出：子进程 stdout 的增量 UTF-8 解码、ANSI 转义剥离，以及 stream-json 事件解析。
+
+各后端的 run_stream_async 都经由 stream_subprocess 启动 CLI，边读边产出文本增量，
+首个增量到达的耗时记为 agent_ttft_seconds（time-to-first-token）。
+"""
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import logging
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Mapping, Optional
+
+from openab.core import metrics
+from openab.core.i18n import t
+
+from .deadline import RunClock, get_deadlines, truncated_reply
+from .process import DEVNULL, PIPE, STDOUT, AgentProcess, spawn, terminate
+from .result import AgentReply, no_output_reply
+
+logger = logging.getLogger(__name__)
+
+# CSI（ESC [ ... final）、OSC（ESC ] ... BEL/ST）以及其余两字节 ESC 序列
+_ANSI_RE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+# 块尾未闭合的 ESC 序列最多暂存这么长，超过则视为普通文本
+_MAX_PENDING_ESCAPE = 64
+READ_CHUNK_SIZE = 4096
+
+
+def strip_ansi(text: str) -> str:
+    """去掉终端颜色、光标控制等 ANSI 转义序列。"""
+    return _ANSI_RE.sub("", text)
+
+
+class TextDecoder:
+    """增量解码器：跨块截断的多字节字符与 ANSI 序列留到下一块再处理。"""
+
+    def __init__(self) -> None:
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+
+    def feed(self, data: bytes) -> str:
+        text = self._pending + self._decoder.decode(data)
+        self._pending = ""
+        idx = text.rfind("\x1b")
+        if idx != -1:
+            tail = text[idx:]
+            if len(tail) < _MAX_PENDING_ESCAPE and _ANSI_RE.match(tail) is None:
+                self._pending = tail
+                text = text[:idx]
+        return strip_ansi(text)
+
+    def flush(self) -> str:
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        return strip_ansi(text)
+
+
+class LineSplitter:
+    """把增量文本按换行切成完整行（不含换行符）；不受 StreamReader.readline 64KB 上限约束。"""
+
+    def __init__(self) -> None:
+        self._buf = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buf += text
+        if "\n" not in self._buf:
+            return []
+        *lines, self._buf = self._buf.split("\n")
+        return lines
+
+    def flush(self) -> list[str]:
+        rest, self._buf = self._buf, ""
+        return [rest] if rest else []
+
+
+def _content_text(content: Any) -> str:
+    """message.content 可能是字符串或 [{type: text, text: ...}, ...]。"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            str(c.get("text") or "")
+            for c in content
+            if isinstance(c, dict) and c.get("type") == "text"
+        )
+    return ""
+
+
+class StreamJsonParser:
+    """
+    解析 Cursor / Claude 的 --output-format stream-json 事件行，返回本行带来的文本增量。
+    - Claude --include-partial-messages：stream_event/content_block_delta 为增量，随后的 assistant 整段忽略；
+    - Cursor --stream-partial-output：assistant 事件即增量；若某条 assistant 重复了已输出的全文则只取新增部分；
+    - 全程无增量时，以 result 事件中的最终文本兜底。
+    session_id 记录事件中出现的会话 ID；result 为最后的 result 事件，error 为其 is_error 时的错误信息。
+    """
+
+    def __init__(self) -> None:
+        self.session_id: Optional[str] = None
+        self.result: Optional[dict[str, Any]] = None
+        self._emitted = ""
+        self._saw_partial = False
+
+    @property
+    def error(self) -> Optional[str]:
+        """result 事件标记 is_error 时的错误信息。"""
+        if not self.result or not self.result.get("is_error"):
+            return None
+        return str(self.result.get("result") or self.result.get("subtype") or "error")
+
+    def _emit(self, text: str) -> Optional[str]:
+        if not text:
+            return None
+        if self._emitted and text.startswith(self._emitted):
+            text = text[len(self._emitted):]
+            if not text:
+                return None
+        self._emitted += text
+        return text
+
+    def __call__(self, line: str) -> Optional[str]:
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(event, dict):
+            return None
+        sid = event.get("session_id")
+        if isinstance(sid, str) and sid:
+            self.session_id = sid
+        typ = event.get("type")
+        if typ == "stream_event":
+            inner = event.get("event") or {}
+            delta = inner.get("delta") or {}
+            if inner.get("type") == "content_block_delta" and delta.get("type") == "text_delta":
+                self._saw_partial = True
+                text = str(delta.get("text") or "")
+                self._emitted += text
+                return text or None
+            return None
+        if typ == "assistant":
+            if self._saw_partial:
+                return None
+            message = event.get("message") or {}
+            return self._emit(_content_text(message.get("content")))
+        if typ == "result":
+            self.result = event
+            if self._emitted:
+                return None
+            return self._emit(str(event.get("result") or ""))
+        return None
+
+
+async def consume_lines(
+    proc: AgentProcess,
+    parse_line: Callable[[str], Any],
+    timeout: float,
+    *,
+    agent_config: Optional[Mapping[str, Any]] = None,
+) -> RunClock:
+    """
+    把 proc.stdout 逐行交给 parse_line（边读边丢，不保留整段输出），直到 EOF 并等待进程退出。
+    timeout 为软期限，输出按事件流启用看门狗（见 deadline）；返回的 RunClock.truncated 表示是否被截断。
+    被取消时先结束整棵进程树。
+    """
+    assert proc.stdout is not None
+    clock = RunClock(proc, get_deadlines(agent_config, timeout, events=True))
+    decoder = TextDecoder()
+    splitter = LineSplitter()
+    try:
+        while True:
+            data = await clock.read(proc.stdout, READ_CHUNK_SIZE)
+            if not data:
+                break
+            for line in splitter.feed(decoder.feed(data)):
+                parse_line(line)
+        for line in splitter.feed(decoder.flush()) + splitter.flush():
+            parse_line(line)
+        await clock.wait()
+    except asyncio.CancelledError:
+        await asyncio.shield(terminate(proc))
+        raise
+    return clock
+
+
+async def stream_subprocess(
+    args: list[str],
+    *,
+    backend: str,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[str] = None,
+    timeout: int = 300,
+    lang: str = "en",
+    parse_line: Optional[Callable[[str], Optional[str]]] = None,
+    events: bool = False,
+    merge_stderr: bool = False,
+    stdin_data: Optional[str] = None,
+    pool: Any = None,
+    agent_config: Optional[dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    启动 CLI 并逐块产出解码后的文本。parse_line 非空时按行解析（JSON 事件流），否则原样产出文本块。
+    stdin_data / pool / agent_config 含义同 process.spawn。
+    timeout 为软期限：到达后中断进程、继续产出到退出或硬期限，最后产出带 truncated 标记的「已截断」提示
+    （全程无文本时为 agent_timeout / agent_stalled）；全程无文本时产出 agent_no_output，
+    否则最后产出一个只带 usage（退出码）的空 AgentReply。
+    events 为 True（输出为 stream-json / --json 事件流，CLI 启动后立即输出事件）时另启用首次输出 / 静默看门狗；
+    按行过滤的纯文本输出（如 openclaw）往往到结束时才输出，不应启用。
+    """
+    started = time.monotonic()
+    proc = await spawn(
+        args,
+        backend=backend,
+        env=env,
+        cwd=cwd,
+        stdout=PIPE,
+        stderr=STDOUT if merge_stderr else DEVNULL,
+        stdin_data=stdin_data,
+        pool=pool,
+        agent_config=agent_config,
+    )
+    assert proc.stdout is not None
+    clock = RunClock(proc, get_deadlines(agent_config, timeout, events=events), started=started)
+    decoder = TextDecoder()
+    splitter = LineSplitter() if parse_line is not None else None
+    first_at: Optional[float] = None
+
+    def _deltas(text: str, final: bool = False) -> list[str]:
+        if splitter is None:
+            return [text] if text else []
+        lines = splitter.feed(text)
+        if final:
+            lines += splitter.flush()
+        out = []
+        for line in lines:
+            delta = parse_line(line)  # type: ignore[misc]
+            if delta:
+                out.append(delta)
+        return out
+
+    try:
+        while True:
+            data = await clock.read(proc.stdout, READ_CHUNK_SIZE)
+            final = not data
+            text = decoder.flush() if final else decoder.feed(data)
+            for delta in _deltas(text, final=final):
+                if first_at is None:
+                    first_at = time.monotonic()
+                    metrics.observe("agent_ttft_seconds", first_at - started, backend=backend)
+                    logger.info("agent %s first output after %.2fs", backend, first_at - started)
+                yield delta
+            if final:
+                break
+        await clock.wait()
+    finally:
+        if proc.returncode is None:
+            # 取消或调用方提前停止迭代：结束整棵进程树
+            await asyncio.shield(terminate(proc))
+        metrics.observe("agent_run_seconds", time.monotonic() - started, backend=backend, mode="stream")
+    if clock.truncated:
+        # 已产出的部分保留，末尾附「已截断」提示（带 truncated 标记，供调用方提供续写）
+        if first_at is None:
+            yield truncated_reply("", lang, clock=clock)
+        else:
+            yield AgentReply("\n\n" + t(lang, "agent_truncated"), truncated=True)
+        return
+    if first_at is None:
+        yield no_output_reply(lang, usage=proc.usage)
+    else:
+        # 空文本，只带回退出码与用量（断路器据此判断运行是否失败）
+        yield AgentReply("", usage=proc.usage)
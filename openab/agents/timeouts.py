@@ -0,0 +1,116 @@
+"""自适应超时：按 (后端, prompt 长度档位) 记录运行耗时，软期限取其分位数的若干倍并限制在上下限之间。
+
+固定的 agent.timeout 对所有后端与 prompt 一样：设长了，卡住的运行要占着并发名额到期限；设短了，正常的长任务被截断。
+启用 agent.adaptive_timeout 后：
+- 记录正常完成的运行与被软期限截断（已有部分输出）的运行，耗时从启动 CLI 算起（不含会话排队），计入
+  agent_run_duration_seconds；截断的运行按到期时的耗时记，超过 1 - percentile 比例的运行被截断时期限随之放宽。
+  失败（未登录、异常退出、全程无输出直到超时等）的运行不记；
+- prompt 长度（字符）分档：<1k、<4k、<16k、<64k、>=64k；
+- 样本达到 min_samples 后，软期限 = multiplier × percentile 分位数，限制在 [min, max] 之间（max 缺省为 agent.timeout），
+  样本不足时仍用 agent.timeout；硬期限与看门狗照旧（见 deadline）；
+- 实际使用的值写入 agent_timeout_seconds 仪表（/metrics 可见），变化超过 10% 时记日志。
+
+配置：agent.adaptive_timeout: true，或 {percentile: 0.99, multiplier: 3, min: 30, max: 600, min_samples: 20}
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 0.99
+DEFAULT_MULTIPLIER = 3.0
+DEFAULT_MIN = 30.0
+DEFAULT_MIN_SAMPLES = 20
+# prompt 长度（字符）分档上界
+_BUCKETS = ((1000, "<1k"), (4000, "<4k"), (16000, "<16k"), (64000, "<64k"))
+_LAST_BUCKET = ">=64k"
+
+
+@dataclass(frozen=True)
+class AdaptiveTimeoutConfig:
+    percentile: float = DEFAULT_PERCENTILE
+    multiplier: float = DEFAULT_MULTIPLIER
+    min: float = DEFAULT_MIN
+    # None 表示以调用方传入的 timeout（agent.timeout）为上限
+    max: Optional[float] = None
+    min_samples: int = DEFAULT_MIN_SAMPLES
+
+
+def get_adaptive_timeout_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[AdaptiveTimeoutConfig]:
+    """读取 agent.adaptive_timeout；未配置或为 false 时返回 None（使用固定的 agent.timeout）。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("adaptive_timeout")
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        return None
+    try:
+        percentile = float(raw.get("percentile") or DEFAULT_PERCENTILE)
+        multiplier = float(raw.get("multiplier") or DEFAULT_MULTIPLIER)
+        lower = float(raw.get("min") or DEFAULT_MIN)
+        upper = float(raw["max"]) if raw.get("max") else None
+        min_samples = int(raw.get("min_samples") or DEFAULT_MIN_SAMPLES)
+    except (TypeError, ValueError):
+        return AdaptiveTimeoutConfig()
+    lower = max(1.0, lower)
+    return AdaptiveTimeoutConfig(
+        percentile=min(max(percentile, 0.5), 0.999),
+        multiplier=max(1.0, multiplier),
+        min=lower,
+        max=max(lower, upper) if upper is not None else None,
+        min_samples=max(1, min_samples),
+    )
+
+
+def prompt_bucket(prompt: str) -> str:
+    n = len(prompt or "")
+    for bound, label in _BUCKETS:
+        if n < bound:
+            return label
+    return _LAST_BUCKET
+
+
+# (backend, bucket) -> 上次记日志时的值
+_logged: dict[tuple[str, str], float] = {}
+
+
+def effective_timeout(
+    backend: str, prompt: str, timeout: float, agent_config: Optional[Mapping[str, Any]]
+) -> float:
+    """本次运行的软期限（秒）：未启用或样本不足时为 timeout。"""
+    config = get_adaptive_timeout_config(agent_config)
+    if config is None:
+        return timeout
+    bucket = prompt_bucket(prompt)
+    observed = metrics.percentile(
+        "agent_run_duration_seconds", config.percentile, min_samples=config.min_samples, backend=backend, bucket=bucket
+    )
+    if observed is None:
+        value = float(timeout)
+    else:
+        upper = config.max if config.max is not None else max(float(timeout), config.min)
+        value = min(max(observed * config.multiplier, config.min), upper)
+    metrics.set_gauge("agent_timeout_seconds", value, backend=backend, bucket=bucket)
+    last = _logged.get((backend, bucket))
+    if last is None or abs(value - last) > 0.1 * last:
+        _logged[(backend, bucket)] = value
+        logger.info(
+            "agent %s timeout for %s prompts: %.0fs (%s)", backend, bucket, value,
+            "default" if observed is None else f"p{config.percentile * 100:g}={observed:.1f}s",
+        )
+    return value
+
+
+def record(
+    backend: str, prompt: str, seconds: float, outcome: Any, agent_config: Optional[Mapping[str, Any]]
+) -> None:
+    """记录一次运行的耗时（正常完成或被截断的运行；outcome 为 breaker.RunOutcome）。"""
+    if get_adaptive_timeout_config(agent_config) is None:
+        return
+    if not outcome.truncated and not outcome.succeeded:
+        return
+    metrics.observe("agent_run_duration_seconds", seconds, backend=backend, bucket=prompt_bucket(prompt))
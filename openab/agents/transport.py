@@ -0,0 +1,89 @@
+"""大 prompt 的传递方式：超过阈值时不再放进 argv。
+
+Linux 单个参数上限为 128KB（MAX_ARG_STRLEN），argv + 环境变量合计受 ARG_MAX 约束，超出即 E2BIG；
+argv 还会出现在 ps / /proc/<pid>/cmdline 中。超过 agent.prompt_argv_max_bytes（默认 64KB）时：
+- 能从 stdin 读提示的后端（claude / codex / gemini）改为经 stdin 分块写入；
+- 其余后端（cursor / openclaw）把 prompt 写入工作区下的临时文件，argv 中只放一句引用该文件的短提示，
+  运行结束后删除文件。
+"""
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Iterator, Mapping, Optional
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARGV_MAX_BYTES = 64 * 1024
+# 工作区内存放临时 prompt 文件的目录
+SCRATCH_DIR = os.path.join(".openab", "prompts")
+
+_FILE_REFERENCE = (
+    "The user's message is too long to pass inline and was saved to the file {path}. "
+    "Read that file in full and respond to its contents as the user's message."
+)
+
+
+def argv_max_bytes(agent_config: Optional[Mapping[str, Any]]) -> int:
+    """argv 中 prompt 的最大字节数：agent.prompt_argv_max_bytes，缺省读 OPENAB_PROMPT_ARGV_MAX_BYTES。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("prompt_argv_max_bytes")
+    if raw is None:
+        raw = os.environ.get("OPENAB_PROMPT_ARGV_MAX_BYTES", "").strip() or None
+    if raw is None:
+        return DEFAULT_ARGV_MAX_BYTES
+    try:
+        return max(0, int(raw))
+    except (TypeError, ValueError):
+        return DEFAULT_ARGV_MAX_BYTES
+
+
+def _too_large(prompt: str, agent_config: Optional[Mapping[str, Any]]) -> bool:
+    limit = argv_max_bytes(agent_config)
+    # 先按字符数粗判，避免每次都完整编码一遍
+    if len(prompt) * 4 <= limit:
+        return False
+    return len(prompt) > limit or len(prompt.encode("utf-8")) > limit
+
+
+def use_stdin(
+    prompt: str, agent_config: Optional[Mapping[str, Any]], backend: str, *, pooled: bool = False
+) -> bool:
+    """能读 stdin 的后端：启用预热池或 prompt 超过 argv 上限时经 stdin 传入。"""
+    via_stdin = pooled or _too_large(prompt, agent_config)
+    metrics.inc("agent_prompt_transport_total", backend=backend, via="stdin" if via_stdin else "argv")
+    return via_stdin
+
+
+@contextlib.contextmanager
+def prompt_argument(
+    prompt: str, workspace: Optional[Path], agent_config: Optional[Mapping[str, Any]], backend: str
+) -> Iterator[str]:
+    """
+    不读 stdin 的后端：返回应放进 argv 的 prompt。超过上限时写入 <workspace>/.openab/prompts/
+    （无工作区时为系统临时目录）并返回引用该文件的短提示，退出上下文时删除文件。
+    """
+    if not _too_large(prompt, agent_config):
+        metrics.inc("agent_prompt_transport_total", backend=backend, via="argv")
+        yield prompt
+        return
+    base = Path(workspace) / SCRATCH_DIR if workspace is not None else Path(tempfile.gettempdir()) / "openab-prompts"
+    base.mkdir(parents=True, exist_ok=True)
+    path = base / f"prompt-{uuid.uuid4().hex}.md"
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with open(fd, "w", encoding="utf-8") as f:
+        f.write(prompt)
+    metrics.inc("agent_prompt_transport_total", backend=backend, via="file")
+    logger.info("%s prompt of %d chars passed via %s", backend, len(prompt), path)
+    try:
+        yield _FILE_REFERENCE.format(path=path)
+    finally:
+        try:
+            path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,363 @@
+"""工作区池：为每个会话提供基础工作区（agent.workspace）的独立副本，多个会话可并行修改同一仓库。
+
+默认所有运行共用同一个工作区；开启 --force 后并行的 agent 会互相改写文件。启用 agent.workspace_pool 后：
+- 每个会话（聊天用户 / resume id）首次运行时取得一个视图，之后复用（路径固定，CLI 按工作区路径
+  关联的会话记录也能找回）；没有会话 key 的运行（如 API 新会话）用一次性视图，运行结束即删除；
+- 视图的创建方式（mode）：worktree（基础工作区是 git 仓库时 `git worktree add --detach`，只含已提交内容）、
+  reflink（`cp --reflink=always`，需 btrfs / xfs 等支持）、copy（`cp --reflink=auto`，能 reflink 时
+  reflink，否则完整复制）；auto 依次尝试 worktree → reflink → copy。overlayfs 需要 root 或 FUSE，不使用；
+- 预先保留 warm 个未分配的视图，会话取用后在后台补足；
+- 空闲超过 idle_ttl 的视图被回收；视图总数超过 max_views 时回收最久未用的空闲视图（全部在用时记日志并超出上限）；
+- 视图的复制 / 删除不持有池锁，一个会话创建视图时不阻塞其他会话取用已有视图。
+
+配置：agent.workspace_pool: {mode: auto, max_views: 16, warm: 1, idle_ttl: 3600, root: ~/.cache/openab/workspaces}
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Mapping, Optional
+
+from openab.core import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ("auto", "worktree", "reflink", "copy")
+
+
+@dataclass(frozen=True)
+class WorkspacePoolConfig:
+    mode: str = "auto"
+    max_views: int = 16
+    warm: int = 1
+    idle_ttl: float = 3600.0
+    root: Optional[Path] = None
+
+
+def get_workspace_pool_config(agent_config: Optional[Mapping[str, Any]]) -> Optional[WorkspacePoolConfig]:
+    """读取 agent.workspace_pool；未配置或为 false 时返回 None（所有运行共用基础工作区）。"""
+    raw = ((agent_config or {}).get("agent") or {}).get("workspace_pool")
+    if raw is True:
+        raw = {}
+    if not isinstance(raw, dict):
+        return None
+    mode = str(raw.get("mode") or "auto").strip().lower()
+    if mode not in MODES:
+        logger.warning("unknown workspace_pool.mode %r, using auto", mode)
+        mode = "auto"
+    try:
+        max_views = int(raw.get("max_views") or 16)
+        warm = int(raw.get("warm") if raw.get("warm") is not None else 1)
+        idle_ttl = float(raw.get("idle_ttl") or 3600)
+    except (TypeError, ValueError):
+        max_views, warm, idle_ttl = 16, 1, 3600.0
+    root = raw.get("root")
+    return WorkspacePoolConfig(
+        mode=mode,
+        max_views=max(1, max_views),
+        warm=max(0, min(warm, max_views)),
+        idle_ttl=max(60.0, idle_ttl),
+        root=Path(str(root)).expanduser() if root else None,
+    )
+
+
+async def _exec(*args: str, cwd: Optional[str] = None) -> tuple[int, str]:
+    proc = await asyncio.create_subprocess_exec(
+        *args, cwd=cwd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    out, _ = await proc.communicate()
+    return proc.returncode or 0, out.decode("utf-8", errors="replace").strip()
+
+
+@dataclass
+class _View:
+    path: Path
+    mode: str = ""
+    key: Optional[str] = None
+    in_use: int = 0
+    last_used: float = 0.0
+    # 创建中（锁外移入预热视图或新建）时为 Future，完成后为 None；结果为 False 表示创建失败
+    ready: Optional[asyncio.Future] = None
+
+
+class WorkspacePool:
+    """
+    一个基础工作区的视图池。_lock 只保护登记表（_views / _warm）：创建、移动、删除视图树都在锁外进行，
+    一个会话复制工作区时，其他会话仍可取用已有视图。
+    """
+
+    def __init__(self, base: Path, config: WorkspacePoolConfig) -> None:
+        self.base = base
+        self.config = config
+        digest = hashlib.sha1(str(base).encode("utf-8")).hexdigest()[:12]
+        self.root = (config.root or Path.home() / ".cache" / "openab" / "workspaces") / f"{base.name or 'root'}-{digest}"
+        self._views: dict[str, _View] = {}
+        self._warm: list[_View] = []
+        # 正在创建的预热视图数（计入 max_views）
+        self._creating = 0
+        # 正在后台删除的视图：路径 -> 任务；同一会话重建视图前先等它删完
+        self._removing: dict[Path, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+        self._mode: Optional[str] = None
+        self._janitor: Optional[asyncio.Task] = None
+        self._filling: Optional[asyncio.Task] = None
+
+    # ---------- 创建 / 删除 ----------
+
+    async def _is_git(self) -> bool:
+        code, out = await _exec("git", "-C", str(self.base), "rev-parse", "--show-toplevel")
+        return code == 0 and Path(out).resolve() == self.base.resolve()
+
+    async def _create(self, path: Path) -> str:
+        """在 path 创建一个视图，返回实际使用的方式。"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        modes = [self._mode] if self._mode else (
+            ["worktree", "reflink", "copy"] if self.config.mode == "auto" else [self.config.mode]
+        )
+        last_error = ""
+        for mode in modes:
+            if mode == "worktree":
+                if not await self._is_git():
+                    last_error = f"{self.base} is not the top of a git repository"
+                    continue
+                code, out = await _exec("git", "-C", str(self.base), "worktree", "add", "--detach", str(path), "HEAD")
+            else:
+                reflink = "always" if mode == "reflink" else "auto"
+                code, out = await _exec("cp", "-a", f"--reflink={reflink}", str(self.base), str(path))
+            if code == 0:
+                if self._mode is None:
+                    self._mode = mode
+                    logger.info("workspace pool for %s uses %s views under %s", self.base, mode, self.root)
+                metrics.inc("agent_workspace_views_created_total", mode=mode)
+                return mode
+            last_error = out
+            shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError(f"cannot create workspace view of {self.base}: {last_error}")
+
+    async def _remove(self, view: _View) -> None:
+        if view.mode == "worktree":
+            await _exec("git", "-C", str(self.base), "worktree", "remove", "--force", str(view.path))
+        await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, str(view.path), True)
+        metrics.inc("agent_workspace_views_removed_total", mode=view.mode)
+
+    def _remove_later(self, view: _View) -> None:
+        """在后台删除已从登记表移除的视图。"""
+        path = view.path
+
+        async def _run() -> None:
+            try:
+                await self._remove(view)
+            except Exception:
+                logger.exception("removing workspace view %s failed", path)
+            finally:
+                if self._removing.get(path) is task:
+                    del self._removing[path]
+
+        task = asyncio.get_running_loop().create_task(_run())
+        self._removing[path] = task
+
+    async def _removed(self, path: Path) -> None:
+        """等待 path 上的后台删除完成（如有）。"""
+        task = self._removing.get(path)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def _move(self, view: _View, path: Path) -> None:
+        if view.mode == "worktree":
+            code, out = await _exec("git", "-C", str(self.base), "worktree", "move", str(view.path), str(path))
+            if code != 0:
+                raise RuntimeError(out)
+        else:
+            os.rename(view.path, path)
+        view.path = path
+
+    def _session_path(self, key: str) -> Path:
+        return self.root / ("s-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+    def _count(self) -> int:
+        return len(self._views) + len(self._warm) + self._creating
+
+    # ---------- 取用 / 归还 ----------
+
+    async def _claim(self, key: Optional[str]) -> _View:
+        """取得 key 的视图并计入使用中；需要新建时先在登记表中占位，创建在锁外进行。"""
+        while True:
+            async with self._lock:
+                view = self._views.get(key) if key is not None else None
+                if view is not None and view.ready is None and not view.path.is_dir():
+                    del self._views[key]  # type: ignore[arg-type]
+                    view = None
+                if view is None:
+                    path = self._session_path(key) if key is not None else self.root / f"t-{uuid.uuid4().hex[:12]}"
+                    view = _View(path, key=key, in_use=1, ready=asyncio.get_running_loop().create_future())
+                    # 取用预热视图不改变视图总数；否则先按容量回收
+                    warm = self._warm.pop() if self._warm else None
+                    victims = [] if warm is not None else self._evict_for_capacity()
+                    if key is not None:
+                        self._views[key] = view
+                    self._publish()
+                    break
+                view.in_use += 1
+                ready = view.ready
+            if ready is not None:
+                try:
+                    ok = await asyncio.shield(ready)
+                except BaseException:
+                    view.in_use -= 1
+                    raise
+                if not ok:
+                    # 同一会话并发创建的视图失败了：重新取
+                    view.in_use -= 1
+                    continue
+            metrics.inc("agent_workspace_view_reuses_total")
+            return view
+        for victim in victims:
+            self._remove_later(victim)
+        ok = False
+        try:
+            await self._prepare(view, warm)
+            ok = True
+        finally:
+            if not ok:
+                view.in_use -= 1
+                async with self._lock:
+                    if key is not None and self._views.get(key) is view:
+                        del self._views[key]
+                    self._publish()
+            view.ready.set_result(ok)  # type: ignore[union-attr]
+            view.ready = None
+        self._schedule_fill()
+        return view
+
+    async def _prepare(self, view: _View, warm: Optional[_View]) -> None:
+        """（锁外）把预热视图移到 view.path，没有可用的预热视图时新建。"""
+        await self._removed(view.path)
+        while warm is not None:
+            try:
+                await self._move(warm, view.path)
+                view.mode = warm.mode
+                metrics.inc("agent_workspace_warm_hits_total")
+                return
+            except (OSError, RuntimeError) as e:
+                logger.warning("reusing warm workspace view %s failed: %s", warm.path, e)
+                self._remove_later(warm)
+            async with self._lock:
+                warm = self._warm.pop() if self._warm else None
+                self._publish()
+        if view.path.exists():
+            # 上次进程留下的同名视图：沿用（会话的改动仍在）
+            view.mode = "worktree" if (view.path / ".git").is_file() else "copy"
+        else:
+            view.mode = await self._create(view.path)
+
+    def _evict_for_capacity(self) -> list[_View]:
+        """（持锁）为一个新视图腾出位置：从登记表移除预热视图或最久未用的空闲视图，返回待删除的视图。"""
+        victims: list[_View] = []
+        while self._count() >= self.config.max_views:
+            if self._warm:
+                victims.append(self._warm.pop())
+                continue
+            idle = [v for v in self._views.values() if v.in_use == 0 and v.ready is None]
+            if not idle:
+                logger.warning(
+                    "workspace pool for %s exceeds max_views (%d): all views are in use",
+                    self.base, self.config.max_views,
+                )
+                break
+            oldest = min(idle, key=lambda v: v.last_used)
+            del self._views[oldest.key]  # type: ignore[arg-type]
+            logger.info("evicting workspace view %s (capacity)", oldest.path)
+            victims.append(oldest)
+        return victims
+
+    @contextlib.asynccontextmanager
+    async def view(self, key: Optional[str]) -> AsyncIterator[Path]:
+        """取得 key 的视图（无 key 时为一次性视图），退出时更新使用时间；一次性视图在退出时删除。"""
+        v = await self._claim(key)
+        try:
+            yield v.path
+        finally:
+            v.in_use -= 1
+            v.last_used = time.monotonic()
+            if key is None:
+                await self._remove(v)
+            self._ensure_janitor()
+
+    # ---------- 预热与回收 ----------
+
+    def _schedule_fill(self) -> None:
+        if self.config.warm > 0 and (self._filling is None or self._filling.done()):
+            self._filling = asyncio.get_running_loop().create_task(self._fill())
+
+    async def _fill(self) -> None:
+        while True:
+            async with self._lock:
+                if len(self._warm) >= self.config.warm or self._count() >= self.config.max_views:
+                    return
+                self._creating += 1
+            path = self.root / f"w-{uuid.uuid4().hex[:12]}"
+            try:
+                mode = await self._create(path)
+            except RuntimeError as e:
+                self._creating -= 1
+                logger.warning("%s", e)
+                return
+            async with self._lock:
+                self._creating -= 1
+                self._warm.append(_View(path, mode))
+                self._publish()
+
+    def _ensure_janitor(self) -> None:
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.get_running_loop().create_task(self._janitor_loop())
+
+    async def _janitor_loop(self) -> None:
+        while self._views:
+            await asyncio.sleep(min(60.0, self.config.idle_ttl / 4))
+            now = time.monotonic()
+            async with self._lock:
+                for key, v in list(self._views.items()):
+                    if v.in_use == 0 and v.ready is None and now - v.last_used > self.config.idle_ttl:
+                        del self._views[key]
+                        logger.info("removing idle workspace view %s", v.path)
+                        self._remove_later(v)
+                self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("agent_workspace_views", len(self._views), state="session")
+        metrics.set_gauge("agent_workspace_views", len(self._warm), state="warm")
+
+
+_pools: dict[tuple[str, WorkspacePoolConfig], WorkspacePool] = {}
+
+
+@contextlib.asynccontextmanager
+async def workspace_for(
+    workspace: Optional[Path], agent_config: Optional[Mapping[str, Any]], key: Optional[str]
+) -> AsyncIterator[Optional[Path]]:
+    """
+    本次运行应使用的工作区：未启用工作区池时为 workspace 本身，否则为该会话（key）的视图。
+    基础工作区为家目录时只允许 worktree 方式（不复制整个家目录）。
+    """
+    config = get_workspace_pool_config(agent_config)
+    if config is None or workspace is None:
+        yield workspace
+        return
+    base = Path(workspace).expanduser().resolve()
+    if base == Path.home().resolve() and config.mode != "worktree":
+        logger.warning("workspace_pool: refusing to copy the home directory; set agent.workspace or mode: worktree")
+        yield workspace
+        return
+    pool = _pools.get((str(base), config))
+    if pool is None:
+        pool = _pools[(str(base), config)] = WorkspacePool(base, config)
+    async with pool.view(key) as path:
+        yield path
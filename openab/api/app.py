@@ -6,13 +6,18 @@ import logging
 import time
 import uuid
 from pathlib import Path
-from typing import Any, Generator, Optional
+from typing import Any, AsyncIterator, Iterator, Optional
 
 from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 
-from openab.agents import run_agent_async
+from openab.agents import run_agent_async, run_agent_stream_async
+from openab.agents.deadline import continuation_prompt, strip_truncation_note
+from openab.agents.priority import HEADER as PRIORITY_HEADER, api_keys as priority_api_keys, request_config
+from openab.agents.probe import ensure_started as start_health_probe
+from openab.agents.router import model_names, route_config
+from openab.core import metrics
 from openab.core.config import load_config, resolve_workspace
 
 logger = logging.getLogger(__name__)
@@ -32,6 +37,42 @@ def _response_body_single_chunk(body: dict) -> Response:
     )
 
 
+# 回复被截断时 Responses API 的状态（客户端按输出长度受限处理，可带 "continue": true 续写）
+_INCOMPLETE = {"status": "incomplete", "incomplete_details": {"reason": "max_output_tokens"}}
+# 回复已溢出到临时文件时 JSON 中的占位内容，发送时替换为按块读出的完整输出
+_OUTPUT_PLACEHOLDER = "\x00openab-output\x00"
+
+
+def _spilled_output(reply: Any) -> Any:
+    output = getattr(reply, "output", None)
+    return output if output is not None and output.spilled else None
+
+
+def _response_body_with_output(body: dict, output: Any) -> Response:
+    """JSON 中的占位内容按块替换为 output 的完整文本（不把整段输出读入内存），发送完删除临时文件。"""
+    marker = json.dumps(_OUTPUT_PLACEHOLDER)
+    parts = json.dumps(body, ensure_ascii=False).split(marker)
+
+    def _chunks() -> Iterator[bytes]:
+        try:
+            for i, part in enumerate(parts):
+                if i:
+                    yield b'"'
+                    for text in output.iter_text():
+                        yield json.dumps(text, ensure_ascii=False)[1:-1].encode("utf-8")
+                    yield b'"'
+                yield part.encode("utf-8")
+            yield b"\n"
+        finally:
+            output.discard()
+
+    return StreamingResponse(
+        _chunks(),
+        media_type="application/json",
+        headers={"Cache-Control": "no-store", "X-Content-Type-Options": "nosniff"},
+    )
+
+
 def _prompt_from_messages(messages: list[dict[str, Any]]) -> str:
     """从 OpenAI 格式 messages 中取出最后一条 user 的 content，或拼接所有 user 内容。"""
     parts = []
@@ -95,18 +136,53 @@ def _prompt_from_responses_input(input_val: Any) -> str:
     return str(input_val).strip()
 
 
-def _check_api_key(api_key: Optional[str], authorization: Optional[str]) -> None:
-    """标准 OpenAI 鉴权：要求请求头 Authorization: Bearer <api.key>。"""
+def _chat_usage(reply: Any) -> dict[str, int]:
+    """后端报告了 token 用量（AgentReply.tokens）时填入 usage，否则为 0。"""
+    tokens = getattr(reply, "tokens", None)
+    if tokens is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    return {
+        "prompt_tokens": tokens.input_tokens,
+        "completion_tokens": tokens.output_tokens,
+        "total_tokens": tokens.total_tokens,
+    }
+
+
+def _last_assistant_text(items: Any) -> str:
+    """messages / Responses input 中最后一条 assistant 消息的文本（续写时作为被截断的部分回复）。"""
+    if not isinstance(items, list):
+        return ""
+    for item in reversed(items):
+        if isinstance(item, dict) and (item.get("role") or "").strip().lower() == "assistant":
+            return _text_from_content(item.get("content"))
+    return ""
+
+
+def _with_continuation(body: dict, prompt: str, items: Any) -> str:
+    """请求体 "continue": true 时，把 prompt 改为接着上一条（被截断的）assistant 回复继续。"""
+    if body.get("continue") is not True:
+        return prompt
+    partial = _last_assistant_text(items)
+    return continuation_prompt(prompt, partial) if partial else prompt
+
+
+def _check_api_key(
+    api_key: Optional[str], authorization: Optional[str], extra_keys: frozenset[str] = frozenset()
+) -> Optional[str]:
+    """
+    标准 OpenAI 鉴权：要求请求头 Authorization: Bearer <api.key>（或 agent.priority.api_keys 中的 key）。
+    返回请求携带的 key（未携带时为 None；未设置 api.key 时不校验，key 仍用于确定运行优先级）。
+    """
+    raw = authorization.strip() if isinstance(authorization, str) else ""
+    bearer = raw.lower().startswith("bearer ")
+    token = raw[7:].strip() if bearer else ""
     if not api_key:
-        return
-    if not authorization or not isinstance(authorization, str):
+        return token or None
+    if not bearer:
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    raw = authorization.strip()
-    if not raw.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    token = raw[7:].strip()
-    if not token or token != api_key:
+    if not token or (token != api_key and token not in extra_keys):
         raise HTTPException(status_code=401, detail="Invalid API key")
+    return token
 
 
 def create_app(
@@ -126,6 +202,7 @@ def create_app(
         if isinstance(api_key, bool):
             api_key = None
         api_key = (api_key or "").strip() or None
+    extra_keys = priority_api_keys(config)
 
     app = FastAPI(title="OpenAB API", description="OpenAI Chat Completions & Responses API compatible")
     app.add_middleware(
@@ -136,20 +213,104 @@ def create_app(
         allow_headers=["*"],
     )
 
-    def _chat_stream_chunks(reply: str, completion_id: str, model: str) -> Generator[str, None, None]:
-        """SSE 流：先发 role delta，再发整段 content，最后 finish。"""
-        yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'role': 'assistant'}, 'finish_reason': None}]})}\n\n"
-        if reply:
-            yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': reply}, 'finish_reason': None}]})}\n\n"
-        yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    @app.on_event("startup")
+    async def _probe_backends() -> None:
+        start_health_probe(config)
+
+    def _sse(data: dict) -> str:
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def _chat_stream_chunks(
+        prompt: str, completion_id: str, model: str, agent_config: Any
+    ) -> AsyncIterator[str]:
+        """SSE 流：先发 role delta，随后每个 agent 文本增量一块 content，最后 finish。"""
+        created = int(time.time())
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+            return _sse({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        yield chunk({"role": "assistant"})
+        finish_reason = "stop"
+        try:
+            async for delta in run_agent_stream_async(
+                prompt,
+                workspace=workspace,
+                timeout=timeout,
+                lang="en",
+                agent_config=agent_config,
+            ):
+                if getattr(delta, "truncated", False):
+                    finish_reason = "length"
+                elif delta:
+                    yield chunk({"content": delta})
+        except Exception:
+            logger.exception("Agent stream error")
+        yield chunk({}, finish_reason)
         yield "data: [DONE]\n\n"
 
+    async def _responses_stream_events(
+        prompt: str, response_id: str, model: str, agent_config: Any
+    ) -> AsyncIterator[str]:
+        """Responses API SSE：response.created → output_text.delta* → output_text.done → response.completed。"""
+        msg_id = "msg_" + uuid.uuid4().hex
+        created = int(time.time())
+        base = {"id": response_id, "object": "response", "created": created, "model": model}
+        yield _sse({"type": "response.created", "response": {**base, "status": "in_progress", "output": []}})
+        parts: list[str] = []
+        truncated = False
+        try:
+            async for delta in run_agent_stream_async(
+                prompt,
+                workspace=workspace,
+                timeout=timeout,
+                lang="en",
+                agent_config=agent_config,
+            ):
+                if getattr(delta, "truncated", False):
+                    truncated = True
+                elif delta:
+                    parts.append(delta)
+                    yield _sse({
+                        "type": "response.output_text.delta",
+                        "item_id": msg_id,
+                        "output_index": 0,
+                        "content_index": 0,
+                        "delta": delta,
+                    })
+        except Exception:
+            logger.exception("Agent stream error")
+        text = "".join(parts)
+        yield _sse({
+            "type": "response.output_text.done",
+            "item_id": msg_id,
+            "output_index": 0,
+            "content_index": 0,
+            "text": text,
+        })
+        output_item = {
+            "id": msg_id,
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+        }
+        final = {**base, "status": "completed", "output": [output_item], "output_text": text}
+        if truncated:
+            final.update(_INCOMPLETE)
+        yield _sse({"type": "response.incomplete" if truncated else "response.completed", "response": final})
+
     @app.post("/v1/chat/completions")
     async def chat_completions(
         request: Request,
         authorization: Optional[str] = Header(None, alias="Authorization"),
+        priority: Optional[str] = Header(None, alias=PRIORITY_HEADER),
     ):
-        _check_api_key(api_key, authorization)
+        token = _check_api_key(api_key, authorization, extra_keys)
         try:
             body = await request.json()
         except Exception as e:
@@ -160,32 +321,42 @@ def create_app(
         prompt = _prompt_from_messages(messages)
         if not prompt:
             raise HTTPException(status_code=400, detail="No user message content in 'messages'")
+        prompt = _with_continuation(body, prompt, messages)
 
         model = (body.get("model") or "openab") if isinstance(body, dict) else "openab"
         stream = body.get("stream") is True if isinstance(body, dict) else False
 
+        agent_config = request_config(
+            route_config(config, model, stream=stream), frontend="api", api_key=token, requested=priority
+        )
+        if stream:
+            completion_id = f"openab-{int(time.time())}"
+            return StreamingResponse(
+                _chat_stream_chunks(prompt, completion_id, model, agent_config),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+            )
+
         try:
             reply = await run_agent_async(
                 prompt,
                 workspace=workspace,
                 timeout=timeout,
                 lang="en",
-                agent_config=config,
+                agent_config=agent_config,
             )
         except Exception as e:
             logger.exception("Agent run error")
             raise HTTPException(status_code=500, detail=str(e))
 
-        reply = reply or ""
+        usage = _chat_usage(reply)
+        output = _spilled_output(reply)
+        # 超过软期限被截断：按 OpenAI 语义以 finish_reason "length" 表示，客户端可带 "continue": true 续写
+        finish_reason = "length" if getattr(reply, "truncated", False) else "stop"
+        reply = _OUTPUT_PLACEHOLDER if output is not None else strip_truncation_note(reply or "")
         created = int(time.time())
         completion_id = f"openab-{created}"
 
-        if stream:
-            return StreamingResponse(
-                _chat_stream_chunks(reply, completion_id, model),
-                media_type="text/event-stream",
-                headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
-            )
         body = {
             "id": completion_id,
             "object": "chat.completion",
@@ -195,20 +366,23 @@ def create_app(
                 {
                     "index": 0,
                     "message": {"role": "assistant", "content": reply},
-                    "finish_reason": "stop",
+                    "finish_reason": finish_reason,
                 }
             ],
-            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "usage": usage,
         }
+        if output is not None:
+            return _response_body_with_output(body, output)
         return _response_body_single_chunk(body)
 
     @app.post("/v1/responses")
     async def responses(
         request: Request,
         authorization: Optional[str] = Header(None, alias="Authorization"),
+        priority: Optional[str] = Header(None, alias=PRIORITY_HEADER),
     ):
         """OpenAI Responses API 兼容：input/instructions → agent → output items。"""
-        _check_api_key(api_key, authorization)
+        token = _check_api_key(api_key, authorization, extra_keys)
         try:
             body = await request.json()
         except Exception as e:
@@ -228,22 +402,35 @@ def create_app(
         elif instructions:
             prompt = instructions
 
+        prompt = _with_continuation(body, prompt, input_val)
         model = body.get("model") or "openab"
         stream = body.get("stream") is True
 
+        agent_config = request_config(
+            route_config(config, model, stream=stream), frontend="api", api_key=token, requested=priority
+        )
+        if stream:
+            return StreamingResponse(
+                _responses_stream_events(prompt, "resp_" + uuid.uuid4().hex, model, agent_config),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+            )
+
         try:
             reply = await run_agent_async(
                 prompt,
                 workspace=workspace,
                 timeout=timeout,
                 lang="en",
-                agent_config=config,
+                agent_config=agent_config,
             )
         except Exception as e:
             logger.exception("Agent run error")
             raise HTTPException(status_code=500, detail=str(e))
 
-        reply = reply or ""
+        output = _spilled_output(reply)
+        truncated = getattr(reply, "truncated", False)
+        reply = _OUTPUT_PLACEHOLDER if output is not None else strip_truncation_note(reply or "")
         response_id = "resp_" + uuid.uuid4().hex
         msg_id = "msg_" + uuid.uuid4().hex
         created = int(time.time())
@@ -261,24 +448,35 @@ def create_app(
             "output": [output_item],
             "output_text": reply,
         }
+        if truncated:
+            body.update(_INCOMPLETE)
+        if output is not None:
+            return _response_body_with_output(body, output)
         return _response_body_single_chunk(body)
 
     @app.get("/v1/models")
     async def models(
         authorization: Optional[str] = Header(None, alias="Authorization"),
     ) -> JSONResponse:
-        _check_api_key(api_key, authorization)
+        """可路由的模型名（agent.routes，见 openab.agents.router）。"""
+        _check_api_key(api_key, authorization, extra_keys)
+        created = int(time.time())
         return JSONResponse(
             content={
                 "object": "list",
                 "data": [
-                    {
-                        "id": "openab",
-                        "object": "model",
-                        "created": int(time.time()),
-                    }
+                    {"id": name, "object": "model", "created": created, "owned_by": "openab"}
+                    for name in model_names(config)
                 ],
             }
         )
 
+    @app.get("/metrics")
+    async def metrics_endpoint(
+        authorization: Optional[str] = Header(None, alias="Authorization"),
+    ) -> PlainTextResponse:
+        """进程内指标（Prometheus 文本格式）：agent_ttft_seconds、agent_run_seconds 等。"""
+        _check_api_key(api_key, authorization, extra_keys)
+        return PlainTextResponse(metrics.render_text(), media_type="text/plain; version=0.0.4")
+
     return app
@@ -4,26 +4,36 @@ from __future__ import annotations
 import asyncio
 import logging
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 
 import discord
 from discord import Intents
 from discord.ext import commands
 
-from openab.agents import get_backend, run_agent_async
+from openab.agents import list_backend_sessions, run_agent_async, run_agent_stream_async
+from openab.agents.capture import attachment_for, format_size
+from openab.agents.deadline import continuation_prompt
+from openab.agents.probe import ensure_started as start_health_probe
 from openab.core.config import load_config, parse_allowed_user_ids, try_add_allowlist_by_api_token
-from openab.core.codex_sessions import list_codex_sessions
-from openab.core.cursor_chats import list_cursor_sessions
 from openab.core.cursor_session_state import (
     set_new_session_next,
     set_resume_id,
+    set_continuation,
+    pop_continuation,
     build_agent_config_with_session,
+    user_ref,
 )
 from openab.core.i18n import lang_from_env, t
 
 logger = logging.getLogger(__name__)
 
 MAX_MESSAGE_LENGTH = 2000
+# 流式回复时两次编辑消息的最小间隔（秒），避免触发 Discord 限流
+STREAM_EDIT_INTERVAL = 1.0
+# 回复超过这么多条消息（或输出已溢出到临时文件）时，只发开头一条，完整输出作为文件发送
+ATTACH_AFTER_MESSAGES = 4
+# 流式回复被截断时为 /continue 保留的末尾字符数
+PARTIAL_TAIL_CHARS = 8000
 PREFIX = "!"
 
 
@@ -104,6 +114,80 @@ def _split_message(text: str, max_len: int = MAX_MESSAGE_LENGTH) -> list[str]:
     return chunks
 
 
+def _stream_enabled(agent_config: Optional[dict[str, Any]]) -> bool:
+    """agent.stream: true 时边生成边回复（编辑同一条消息），否则等全部输出后一次回复。"""
+    return ((agent_config or {}).get("agent") or {}).get("stream") is True
+
+
+async def _reply_streaming(message: discord.Message, deltas: AsyncIterator[str]) -> Optional[str]:
+    """
+    首段文本到达即回复，之后按间隔编辑该消息；超过单条上限时定稿并另起一条。
+    运行超过软期限被截断时返回已产出文本的末尾（供 /continue），否则返回 None。
+    """
+    loop = asyncio.get_running_loop()
+    sent: Optional[discord.Message] = None
+    shown = ""
+    current = ""
+    last_edit = 0.0
+
+    async def flush(force: bool) -> None:
+        nonlocal sent, shown, last_edit
+        text = current.strip()
+        if not text or text == shown:
+            return
+        if not force and loop.time() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        try:
+            if sent is None:
+                sent = await message.reply(text)
+            else:
+                await sent.edit(content=text)
+        except discord.DiscordException as e:
+            logger.debug("stream reply update: %s", e)
+            if not force:
+                return
+            sent = await message.reply(text)
+        shown = text
+        last_edit = loop.time()
+
+    produced = ""
+    truncated = False
+    async for delta in deltas:
+        current += delta
+        produced = (produced + delta)[-PARTIAL_TAIL_CHARS:]
+        truncated = truncated or getattr(delta, "truncated", False)
+        if len(current) > MAX_MESSAGE_LENGTH:
+            chunks = _split_message(current)
+            for chunk in chunks[:-1]:
+                current = chunk
+                await flush(True)
+                sent, shown = None, ""
+            current = chunks[-1]
+        await flush(False)
+    await flush(True)
+    return produced if truncated else None
+
+
+async def _reply_full(message: discord.Message, reply: Optional[str], lang: str) -> None:
+    """发送完整回复：较短时分条发送，过长时发送开头一条并附上完整输出文件。"""
+    output = attachment_for(reply, MAX_MESSAGE_LENGTH * ATTACH_AFTER_MESSAGES)
+    if output is None:
+        for chunk in _split_message(reply or ""):
+            await message.reply(chunk)
+        return
+    try:
+        chunks = _split_message(reply or "")
+        if chunks:
+            await message.reply(chunks[0])
+        with output.open() as f:
+            await message.reply(
+                t(lang, "output_attached", size=format_size(output.size)),
+                file=discord.File(f, filename="output.txt"),
+            )
+    finally:
+        output.discard()
+
+
 def _user_lang(_message: discord.Message) -> str:
     return lang_from_env()
 
@@ -138,7 +222,8 @@ class OpenABDiscordBot(commands.Bot):
         self._openab_agent_config = agent_config or {}
 
     async def setup_hook(self) -> None:
-        """注册斜杠命令，使用户输入 / 时显示命令列表。"""
+        """注册斜杠命令，使用户输入 / 时显示命令列表；并开始探测已配置的后端。"""
+        start_health_probe(self._openab_agent_config)
         tree = self.tree
 
         @tree.command(name="start", description="Welcome and auth status")
@@ -162,6 +247,10 @@ class OpenABDiscordBot(commands.Bot):
         async def slash_sessions(interaction: discord.Interaction) -> None:
             await self._slash_sessions(interaction)
 
+        @tree.command(name="continue", description="Continue the last reply that was cut off by the timeout")
+        async def slash_continue(interaction: discord.Interaction) -> None:
+            await self._slash_continue(interaction)
+
         try:
             synced = await tree.sync()
             logger.info("Discord slash commands synced: %s", len(synced))
@@ -234,8 +323,9 @@ class OpenABDiscordBot(commands.Bot):
             set_resume_id("dc", message.channel.id, message.author.id, session_id)
             await message.reply(t(lang, "session_resume_switched", id=session_id))
         else:
-            backend = get_backend(self._openab_agent_config)
-            sessions = list_codex_sessions(max_sessions=12) if backend == "codex" else list_cursor_sessions(max_sessions=12)
+            sessions = list_backend_sessions(
+                self._openab_agent_config, max_sessions=12, user=user_ref("dc", message.author.id)
+            )
             view = _ResumeChoiceView(self, lang, sessions=sessions)
             await message.reply(t(lang, "session_resume_choose"), view=view)
 
@@ -291,8 +381,9 @@ class OpenABDiscordBot(commands.Bot):
             set_resume_id("dc", ch_id, interaction.user.id, sid)
             await interaction.response.send_message(t(lang, "session_resume_switched", id=sid))
         else:
-            backend = get_backend(self._openab_agent_config)
-            sessions = list_codex_sessions(max_sessions=12) if backend == "codex" else list_cursor_sessions(max_sessions=12)
+            sessions = list_backend_sessions(
+                self._openab_agent_config, max_sessions=12, user=user_ref("dc", interaction.user.id)
+            )
             view = _ResumeChoiceView(self, lang, sessions=sessions)
             await interaction.response.send_message(t(lang, "session_resume_choose"), view=view)
 
@@ -307,6 +398,18 @@ class OpenABDiscordBot(commands.Bot):
             t(lang, "sessions_list_unavailable") + "\n\n" + t(lang, "session_resume_usage_discord")
         )
 
+    async def _slash_continue(self, interaction: discord.Interaction) -> None:
+        if not interaction.user:
+            return
+        lang = lang_from_env()
+        if not self._is_user_allowed(interaction.user.id):
+            await interaction.response.send_message(t(lang, "unauthorized"))
+            return
+        # 斜杠命令没有用户消息：先回复一条，续写的输出作为对它的回复
+        await interaction.response.send_message(t(lang, "continue_started"))
+        message = await interaction.original_response()
+        await self.handle_command_continue(message, user_id=interaction.user.id)
+
     async def handle_agent_message(self, message: discord.Message) -> None:
         user_id = message.author.id
         lang = _user_lang(message)
@@ -326,7 +429,39 @@ class OpenABDiscordBot(commands.Bot):
         if not prompt:
             await message.reply(t(lang, "prompt_empty"))
             return
+        await self._run_and_reply(message, prompt, lang)
+
+    async def handle_command_continue(self, message: discord.Message, *, user_id: Optional[int] = None) -> None:
+        """
+        !continue / /continue：续写上一次因超时被截断的回复。
+        user_id 为发起续写的用户（斜杠命令时 message 是机器人自己的回复），缺省为消息作者。
+        """
+        lang = _user_lang(message)
+        uid = user_id if user_id is not None else message.author.id
+        if not self._is_user_allowed(uid):
+            await message.reply(t(lang, "unauthorized"))
+            return
+        pending = pop_continuation("dc", message.channel.id, uid)
+        if pending is None:
+            await message.reply(t(lang, "continue_nothing"))
+            return
+        original, partial = pending
+        await self._run_and_reply(message, continuation_prompt(original, partial), lang, original=original, user_id=uid)
 
+    async def _run_and_reply(
+        self,
+        message: discord.Message,
+        prompt: str,
+        lang: str,
+        *,
+        original: Optional[str] = None,
+        user_id: Optional[int] = None,
+    ) -> None:
+        """
+        调用 agent 并回复；回复被截断时记下原请求（original，缺省为 prompt）与部分输出，供 !continue。
+        user_id 为会话所属用户，缺省为消息作者。
+        """
+        uid = user_id if user_id is not None else message.author.id
         done = asyncio.Event()
         typing_task = asyncio.create_task(_typing_until_done(message.channel, done))
 
@@ -334,16 +469,32 @@ class OpenABDiscordBot(commands.Bot):
             self._openab_agent_config,
             "dc",
             message.channel.id,
-            message.author.id,
+            uid,
         )
+        reply: Optional[str] = None
+        partial: Optional[str] = None
         try:
-            reply = await run_agent_async(
-                prompt,
-                workspace=self._openab_workspace,
-                timeout=self._openab_timeout,
-                lang=lang,
-                agent_config=agent_config,
-            )
+            if _stream_enabled(agent_config):
+                partial = await _reply_streaming(
+                    message,
+                    run_agent_stream_async(
+                        prompt,
+                        workspace=self._openab_workspace,
+                        timeout=self._openab_timeout,
+                        lang=lang,
+                        agent_config=agent_config,
+                    ),
+                )
+            else:
+                reply = await run_agent_async(
+                    prompt,
+                    workspace=self._openab_workspace,
+                    timeout=self._openab_timeout,
+                    lang=lang,
+                    agent_config=agent_config,
+                )
+                if getattr(reply, "truncated", False):
+                    partial = reply
         except Exception as e:
             logger.exception("agent run error")
             reply = t(lang, "agent_error", error=str(e))
@@ -355,8 +506,8 @@ class OpenABDiscordBot(commands.Bot):
             except asyncio.CancelledError:
                 pass
 
-        for chunk in _split_message(reply):
-            await message.reply(chunk)
+        set_continuation("dc", message.channel.id, uid, original or prompt, partial)
+        await _reply_full(message, reply, lang)
 
     async def on_ready(self) -> None:
         logger.info("Discord bot logged in as %s", self.user)
@@ -380,6 +531,9 @@ class OpenABDiscordBot(commands.Bot):
         if content == f"{PREFIX}sessions":
             await self.handle_command_sessions(message)
             return
+        if content in (f"{PREFIX}continue", "/continue"):
+            await self.handle_command_continue(message)
+            return
         await self.handle_agent_message(message)
 
 
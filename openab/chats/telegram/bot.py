@@ -5,26 +5,36 @@ import asyncio
 import logging
 import sys
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from telegram.error import Conflict
 
-from openab.agents import get_backend, run_agent_async
+from openab.agents import list_backend_sessions, run_agent_async, run_agent_stream_async
+from openab.agents.capture import attachment_for, format_size
+from openab.agents.deadline import continuation_prompt
+from openab.agents.probe import ensure_started as start_health_probe
 from openab.core.config import load_config, parse_allowed_user_ids, try_add_allowlist_by_api_token
-from openab.core.codex_sessions import list_codex_sessions
-from openab.core.cursor_chats import list_cursor_sessions
 from openab.core.cursor_session_state import (
     set_new_session_next,
     set_resume_id,
+    set_continuation,
+    pop_continuation,
     build_agent_config_with_session,
+    user_ref,
 )
 from openab.core.i18n import lang_from_telegram, t
 
 logger = logging.getLogger(__name__)
 
 MAX_MESSAGE_LENGTH = 4096
+# 流式回复时两次编辑消息的最小间隔（秒），避免触发 Telegram 限流
+STREAM_EDIT_INTERVAL = 1.0
+# 回复超过这么多条消息（或输出已溢出到临时文件）时，只发开头一条，完整输出作为文件发送
+ATTACH_AFTER_MESSAGES = 4
+# 流式回复被截断时为 /continue 保留的末尾字符数
+PARTIAL_TAIL_CHARS = 8000
 
 
 def _split_message(text: str, max_len: int = MAX_MESSAGE_LENGTH) -> list[str]:
@@ -43,6 +53,81 @@ def _split_message(text: str, max_len: int = MAX_MESSAGE_LENGTH) -> list[str]:
     return chunks
 
 
+def _stream_enabled(agent_config: Optional[dict[str, Any]]) -> bool:
+    """agent.stream: true 时边生成边回复（编辑同一条消息），否则等全部输出后一次回复。"""
+    return ((agent_config or {}).get("agent") or {}).get("stream") is True
+
+
+async def _reply_streaming(message: Any, deltas: AsyncIterator[str]) -> Optional[str]:
+    """
+    首段文本到达即回复，之后按间隔编辑该消息；超过单条上限时定稿并另起一条。
+    运行超过软期限被截断时返回已产出文本的末尾（供 /continue），否则返回 None。
+    """
+    loop = asyncio.get_running_loop()
+    sent: Any = None
+    shown = ""
+    current = ""
+    last_edit = 0.0
+
+    async def flush(force: bool) -> None:
+        nonlocal sent, shown, last_edit
+        text = current.strip()
+        if not text or text == shown:
+            return
+        if not force and loop.time() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        try:
+            if sent is None:
+                sent = await message.reply_text(text)
+            else:
+                await sent.edit_text(text)
+        except Exception as e:
+            logger.debug("stream reply update: %s", e)
+            if not force:
+                return
+            sent = await message.reply_text(text)
+        shown = text
+        last_edit = loop.time()
+
+    produced = ""
+    truncated = False
+    async for delta in deltas:
+        current += delta
+        produced = (produced + delta)[-PARTIAL_TAIL_CHARS:]
+        truncated = truncated or getattr(delta, "truncated", False)
+        if len(current) > MAX_MESSAGE_LENGTH:
+            chunks = _split_message(current)
+            for chunk in chunks[:-1]:
+                current = chunk
+                await flush(True)
+                sent, shown = None, ""
+            current = chunks[-1]
+        await flush(False)
+    await flush(True)
+    return produced if truncated else None
+
+
+async def _reply_full(message: Any, reply: Optional[str], lang: str) -> None:
+    """发送完整回复：较短时分条发送，过长时发送开头一条并附上完整输出文件。"""
+    output = attachment_for(reply, MAX_MESSAGE_LENGTH * ATTACH_AFTER_MESSAGES)
+    if output is None:
+        for chunk in _split_message(reply or ""):
+            await message.reply_text(chunk)
+        return
+    try:
+        chunks = _split_message(reply or "")
+        if chunks:
+            await message.reply_text(chunks[0])
+        with output.open() as f:
+            await message.reply_document(
+                document=f,
+                filename="output.txt",
+                caption=t(lang, "output_attached", size=format_size(output.size)),
+            )
+    finally:
+        output.discard()
+
+
 async def _send_typing_until_done(chat_id: int, context: ContextTypes.DEFAULT_TYPE, done: asyncio.Event) -> None:
     while not done.is_set():
         try:
@@ -163,8 +248,9 @@ async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 InlineKeyboardButton(t(lang, "btn_new_session"), callback_data="new_session"),
             ],
         ]
-        backend = get_backend(context.bot_data.get("openab_agent_config"))
-        sessions = list_codex_sessions(max_sessions=12) if backend == "codex" else list_cursor_sessions(max_sessions=12)
+        sessions = list_backend_sessions(
+            context.bot_data.get("openab_agent_config"), max_sessions=12, user=user_ref("tg", user_id)
+        )
         for session_id, display_name in sessions:
             keyboard.append([InlineKeyboardButton(display_name, callback_data=f"resume:{session_id}")])
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -229,7 +315,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not prompt:
         await update.message.reply_text(t(lang, "prompt_empty"))
         return
+    await _run_and_reply(update, context, prompt, lang=lang, user_id=user_id)
+
 
+async def _run_and_reply(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    prompt: str,
+    *,
+    lang: str,
+    user_id: int,
+    original: Optional[str] = None,
+) -> None:
+    """调用 agent 并回复；回复被截断时记下原请求（original，缺省为 prompt）与部分输出，供 /continue。"""
+    assert update.message is not None
     chat_id = update.effective_chat.id if update.effective_chat else 0
     done = asyncio.Event()
     typing_task = asyncio.create_task(_send_typing_until_done(chat_id, context, done))
@@ -239,14 +338,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     base_agent_config = context.bot_data.get("openab_agent_config") or {}
     agent_config = build_agent_config_with_session(base_agent_config, "tg", chat_id, user_id)
 
+    reply: Optional[str] = None
+    partial: Optional[str] = None
     try:
-        reply = await run_agent_async(
-            prompt,
-            workspace=workspace,
-            timeout=timeout,
-            lang=lang,
-            agent_config=agent_config,
-        )
+        if _stream_enabled(agent_config):
+            partial = await _reply_streaming(
+                update.message,
+                run_agent_stream_async(
+                    prompt,
+                    workspace=workspace,
+                    timeout=timeout,
+                    lang=lang,
+                    agent_config=agent_config,
+                ),
+            )
+        else:
+            reply = await run_agent_async(
+                prompt,
+                workspace=workspace,
+                timeout=timeout,
+                lang=lang,
+                agent_config=agent_config,
+            )
+            if getattr(reply, "truncated", False):
+                partial = reply
     except Exception as e:
         logger.exception("agent run error")
         reply = t(lang, "agent_error", error=str(e))
@@ -258,8 +373,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         except asyncio.CancelledError:
             pass
 
-    for chunk in _split_message(reply):
-        await update.message.reply_text(chunk)
+    set_continuation("tg", chat_id, user_id, original or prompt, partial)
+    await _reply_full(update.message, reply, lang)
+
+
+async def cmd_continue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """续写上一次因超时被截断的回复。"""
+    if not update.message or not update.effective_user or not update.effective_chat:
+        return
+    user_id = update.effective_user.id
+    lang = _user_lang(update)
+    if not _is_user_allowed(user_id, context):
+        await update.message.reply_text(t(lang, "unauthorized"))
+        return
+    pending = pop_continuation("tg", update.effective_chat.id, user_id)
+    if pending is None:
+        await update.message.reply_text(t(lang, "continue_nothing"))
+        return
+    original, partial = pending
+    await _run_and_reply(
+        update, context, continuation_prompt(original, partial), lang=lang, user_id=user_id, original=original
+    )
 
 
 def _error_handler(update: Optional[Update], context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -281,6 +415,7 @@ TELEGRAM_COMMANDS_EN = [
     BotCommand("new", "Create new session (next message in new conversation)"),
     BotCommand("resume", "Resume previous or switch to session: /resume [ID]"),
     BotCommand("sessions", "How to view and switch sessions"),
+    BotCommand("continue", "Continue a reply that was cut off by the time limit"),
 ]
 TELEGRAM_COMMANDS_ZH = [
     BotCommand("start", "欢迎与鉴权状态"),
@@ -288,11 +423,13 @@ TELEGRAM_COMMANDS_ZH = [
     BotCommand("new", "创建新会话（下一条消息在新会话中）"),
     BotCommand("resume", "恢复上一会话或切换：/resume [会话ID]"),
     BotCommand("sessions", "如何查看与切换会话"),
+    BotCommand("continue", "继续因超时被截断的回复"),
 ]
 
 
 async def _post_init_set_commands(application: Application) -> None:
-    """Bot 启动后向 Telegram 注册命令菜单，使输入 / 时显示命令列表。"""
+    """Bot 启动后向 Telegram 注册命令菜单，使输入 / 时显示命令列表；并开始探测已配置的后端。"""
+    start_health_probe(application.bot_data.get("openab_agent_config"))
     bot = application.bot
     await bot.set_my_commands(TELEGRAM_COMMANDS_EN)
     try:
@@ -328,6 +465,7 @@ def build_application(
     app.add_handler(CommandHandler("new", cmd_new))
     app.add_handler(CommandHandler("resume", cmd_resume))
     app.add_handler(CommandHandler("sessions", cmd_sessions))
+    app.add_handler(CommandHandler("continue", cmd_continue))
     app.add_handler(CallbackQueryHandler(handle_resume_callback, pattern="^resume_latest$|^new_session$|^resume:"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_error_handler(_error_handler)
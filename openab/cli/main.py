@@ -12,6 +12,7 @@ from typing import Optional
 import typer
 from dotenv import load_dotenv
 
+from openab.agents import registry
 from openab.chats.discord import run_bot as run_discord_bot
 from openab.chats.telegram import run_bot as run_telegram_bot
 from openab.core.config import (
@@ -25,7 +26,7 @@ from openab.core.config import (
     _get_nested,
     _set_nested,
 )
-from openab.core.detect_cli import BACKEND_CLI_NAMES, detect_available_backends
+from openab.core.detect_cli import backend_cli_names, detect_available_backends
 from openab.core.i18n import cli_t
 
 load_dotenv()
@@ -78,10 +79,11 @@ def _ensure_agent_backend(config: dict) -> dict:
     current = (config.get("agent") or {}).get("backend")
     if current is not None and str(current).strip():
         return config
-    available = detect_available_backends()
+    names = registry.cli_names()
+    available = detect_available_backends(names)
     if not available:
         return config
-    cmd_by_backend = dict(BACKEND_CLI_NAMES)
+    cmd_by_backend = dict(backend_cli_names(names))
     typer.echo("")
     typer.echo(cli_t("run_backends_detected"))
     for i, (bid, _) in enumerate(available, 1):
@@ -162,6 +164,14 @@ def _ensure_discord_run_config(
     return (t, allowed, config)
 
 
+def _start_forkserver(config: dict) -> None:
+    """agent.forkserver 开启时启动 fork server；之后 agent CLI 由这个小进程 fork，而不是由加载了各 SDK 的主进程。"""
+    from openab.agents import forkserver
+
+    if forkserver.enabled(config):
+        forkserver.start()
+
+
 def _ensure_api_key(config: dict) -> dict:
     """若配置中无 api.key 则生成随机 token 并写入配置文件，返回可能已修改的 config。"""
     api_cfg = config.get("api")
@@ -194,6 +204,7 @@ def _do_serve(
     config_path = get_config_file_path()
     _echo_config_file_path()
     config = load_config()
+    _start_forkserver(config)
     if not (token or "").strip():
         config = _ensure_api_key(config)
     api_cfg = config.get("api") or {}
@@ -238,6 +249,7 @@ def _default(
         _echo_config_file_path()
         logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
         cfg = _ensure_agent_backend(cfg)
+        _start_forkserver(cfg)
         t, allowed, cfg = _ensure_telegram_run_config(cfg, None)
         ws = _get_workspace(cfg, None)
         timeout = int((cfg.get("agent") or {}).get("timeout") or 300)
@@ -253,6 +265,7 @@ def _default(
         _echo_config_file_path()
         logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
         cfg = _ensure_agent_backend(cfg)
+        _start_forkserver(cfg)
         t, allowed, cfg = _ensure_discord_run_config(cfg, None)
         ws = _get_workspace(cfg, None)
         timeout = int((cfg.get("agent") or {}).get("timeout") or 300)
@@ -338,6 +351,7 @@ def _run_default(
             format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
         )
         cfg = _ensure_agent_backend(cfg)
+        _start_forkserver(cfg)
         t, allowed, cfg = _ensure_telegram_run_config(cfg, None)
         ws = _get_workspace(cfg, None)
         timeout = (cfg.get("agent") or {}).get("timeout")
@@ -365,6 +379,7 @@ def _run_default(
             format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
         )
         cfg = _ensure_agent_backend(cfg)
+        _start_forkserver(cfg)
         t, allowed, cfg = _ensure_discord_run_config(cfg, None)
         ws = _get_workspace(cfg, None)
         timeout = (cfg.get("agent") or {}).get("timeout")
@@ -419,6 +434,7 @@ def run_telegram(
     config = load_config()
     _echo_config_file_path()
     config = _ensure_agent_backend(config)
+    _start_forkserver(config)
     t, allowed, config = _ensure_telegram_run_config(config, token)
     ws = _get_workspace(config, workspace)
     timeout = (config.get("agent") or {}).get("timeout")
@@ -457,6 +473,7 @@ def run_discord(
     config = load_config()
     _echo_config_file_path()
     config = _ensure_agent_backend(config)
+    _start_forkserver(config)
     t, allowed, config = _ensure_discord_run_config(config, token)
     ws = _get_workspace(config, workspace)
     timeout = (config.get("agent") or {}).get("timeout")
@@ -1,19 +1,32 @@
-"""Per-user Cursor 会话状态：创建新会话（下次调用不 --continue）、或切换到指定 --resume id。供 Telegram/Discord 共用。"""
+"""Per-user Cursor 会话状态：创建新会话（下次调用不 --continue）、或切换到指定 --resume id，以及待续写的截断回复。供 Telegram/Discord 共用。
+
+后端在运行后报告实际所在的会话 ID（_pin_session 回调），固定为该用户的 resume id：同一 bridge 上的多个用户
+各自以 --resume <id> 继续自己的会话，不再争用全局「最近一次会话」。"""
 from __future__ import annotations
 
+import functools
 import threading
-from typing import Optional
+from collections import ChainMap
+from typing import Any, Mapping, Optional
 
 # key: "tg:{chat_id}:{user_id}" 或 "dc:{channel_id}:{user_id}"
 # value: {"new_next": bool, "resume_id": Optional[str]}
 _state: dict[str, dict] = {}
 _lock = threading.Lock()
+# 被截断（超过软期限）的最近一次回复，供 /continue：key -> (原 prompt, 部分回复末尾)
+_continuations: dict[str, tuple[str, str]] = {}
+_MAX_PARTIAL_CHARS = 8000
 
 
 def _key(platform: str, chat_or_channel_id: int, user_id: int) -> str:
     return f"{platform}:{chat_or_channel_id}:{user_id}"
 
 
+def user_ref(platform: str, user_id: int) -> str:
+    """跨聊天 / 频道的用户标识，如 "tg:123"；每用户独立目录（agents.homes）按它区分。"""
+    return f"{platform}:{user_id}"
+
+
 def set_new_session_next(platform: str, chat_or_channel_id: int, user_id: int) -> None:
     """标记该用户下一次调用 agent 时使用新会话（不传 --continue）。"""
     with _lock:
@@ -32,6 +45,25 @@ def set_resume_id(platform: str, chat_or_channel_id: int, user_id: int, chat_id:
         _state[k]["resume_id"] = (chat_id or "").strip() or None
 
 
+def pin_session(platform: str, chat_or_channel_id: int, user_id: int, session_id: str) -> None:
+    """记录后端报告的本次会话 ID，之后该用户的调用以 --resume <session_id> 继续（直到 /new 或 /resume 其他）。"""
+    session_id = (session_id or "").strip()
+    if not session_id:
+        return
+    with _lock:
+        entry = _state.setdefault(_key(platform, chat_or_channel_id, user_id), {})
+        # /new 之后、新会话尚未开始前到达的旧运行结果，不应覆盖即将创建的新会话
+        if not entry.get("new_next"):
+            entry["resume_id"] = session_id
+
+
+def current_resume_id(platform: str, chat_or_channel_id: int, user_id: int) -> Optional[str]:
+    """该用户当前固定 / 指定的 resume id（不消费「新会话」标记）。"""
+    with _lock:
+        entry = _state.get(_key(platform, chat_or_channel_id, user_id)) or {}
+        return None if entry.get("new_next") else entry.get("resume_id")
+
+
 def get_session_override(
     platform: str, chat_or_channel_id: int, user_id: int
 ) -> tuple[bool, Optional[str]]:
@@ -49,23 +81,51 @@ def get_session_override(
         return (bool(new_next), resume_id if (resume_id and str(resume_id).strip()) else None)
 
 
+def set_continuation(
+    platform: str, chat_or_channel_id: int, user_id: int, prompt: str, partial: Optional[str]
+) -> None:
+    """记录该用户最近一次被截断的回复（只保留末尾）；partial 为 None 时清除。"""
+    with _lock:
+        k = _key(platform, chat_or_channel_id, user_id)
+        if partial is None:
+            _continuations.pop(k, None)
+        else:
+            _continuations[k] = (prompt, partial[-_MAX_PARTIAL_CHARS:])
+
+
+def pop_continuation(platform: str, chat_or_channel_id: int, user_id: int) -> Optional[tuple[str, str]]:
+    """取出并清除 (原 prompt, 部分回复)；没有被截断的回复时返回 None。"""
+    with _lock:
+        return _continuations.pop(_key(platform, chat_or_channel_id, user_id), None)
+
+
 def build_agent_config_with_session(
-    base_agent_config: dict,
+    base_agent_config: Mapping[str, Any],
     platform: str,
     chat_or_channel_id: int,
     user_id: int,
-) -> dict:
+) -> ChainMap:
     """
     根据当前用户会话状态，在 base 配置上叠加会话覆盖（新会话 / 指定 resume id）。
-    同时写入通用 _session_new / _resume_id（供 Codex 等）与 _cursor_*（兼容 Cursor）。
-    并清除“新会话”一次性标记。返回新 dict，不修改 base。
+    同时写入通用 _session_new / _resume_id（供 Codex 等）与 _cursor_*（兼容 Cursor），以及 _session_key、_user_id、
+    _frontend（平台缩写，决定运行优先级，见 agents.priority）
+    和 _pin_session（后端报告会话 ID 的回调，见 pin_session）、_current_session（排队等待会话锁后
+    重新读取已固定的会话 ID，见 agents.serialize）。
+    并清除“新会话”一次性标记。返回 ChainMap(覆盖层, base)：不复制、也不修改 base。
     """
     use_new, resume_id = get_session_override(platform, chat_or_channel_id, user_id)
-    out = dict(base_agent_config) if base_agent_config else {}
+    # 会话 key，供常驻进程（如 Claude resident）按用户复用
+    overlay: dict[str, Any] = {
+        "_session_key": _key(platform, chat_or_channel_id, user_id),
+        "_user_id": user_ref(platform, user_id),
+        "_frontend": platform,
+        "_pin_session": functools.partial(pin_session, platform, chat_or_channel_id, user_id),
+        "_current_session": functools.partial(current_resume_id, platform, chat_or_channel_id, user_id),
+    }
     if use_new:
-        out["_session_new"] = True
-        out["_cursor_session_new"] = True
+        overlay["_session_new"] = True
+        overlay["_cursor_session_new"] = True
     if resume_id:
-        out["_resume_id"] = resume_id
-        out["_cursor_resume_id"] = resume_id
-    return out
+        overlay["_resume_id"] = resume_id
+        overlay["_cursor_resume_id"] = resume_id
+    return ChainMap(overlay, base_agent_config or {})
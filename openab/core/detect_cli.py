@@ -2,9 +2,10 @@
 from __future__ import annotations
 
 import shutil
-from typing import Sequence
+from typing import Optional, Sequence
 
-# 与 openab.agents 一致的 backend id -> 默认命令名（用于 which 检测）
+# 内置后端的 backend id -> 默认命令名（用于 which 检测）；含第三方后端的列表由 agents 层传入
+# （见 openab.agents.registry.cli_names），core 不依赖 agents
 BACKEND_CLI_NAMES: Sequence[tuple[str, str]] = (
     ("cursor", "agent"),
     ("openclaw", "openclaw"),
@@ -14,13 +15,18 @@ BACKEND_CLI_NAMES: Sequence[tuple[str, str]] = (
 )
 
 
-def detect_available_backends() -> list[tuple[str, str]]:
+def backend_cli_names(names: Optional[Sequence[tuple[str, str]]] = None) -> list[tuple[str, str]]:
+    """(backend_id, 默认命令名) 列表：names 为调用方给出的已注册后端，缺省为 BACKEND_CLI_NAMES。"""
+    return list(BACKEND_CLI_NAMES if names is None else names)
+
+
+def detect_available_backends(names: Optional[Sequence[tuple[str, str]]] = None) -> list[tuple[str, str]]:
     """
-    检测当前 PATH 下存在的 agent 后端命令。
-    返回 [(backend_id, 可执行路径或命令名), ...]，按 BACKEND_CLI_NAMES 顺序，仅包含存在的。
+    检测当前 PATH 下存在的 agent 后端命令（names 同 backend_cli_names）。
+    返回 [(backend_id, 可执行路径或命令名), ...]，按 names 顺序，仅包含存在的。
     """
     out: list[tuple[str, str]] = []
-    for backend_id, cmd_name in BACKEND_CLI_NAMES:
+    for backend_id, cmd_name in backend_cli_names(names):
         exe = shutil.which(cmd_name)
         if exe:
             out.append((backend_id, exe))
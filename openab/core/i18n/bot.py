@@ -25,7 +25,21 @@ MESSAGES = {
         "prompt_empty": "请发送一段文字作为给智能体的提示。",
         "agent_error": "执行出错：{error}",
         "agent_timeout": "⏱ 执行超时，请缩短问题或稍后重试。",
+        "agent_truncated": "⏱ 已超时，以上为目前已生成的部分。发送 /continue（Discord 亦可 !continue）可接着继续。",
+        "continue_nothing": "没有可继续的被截断回复。",
+        "continue_started": "接着上次被截断的回复继续……",
+        "agent_stalled": "⏱ 智能体 {seconds} 秒内没有任何输出，已停止（可能在等待登录或被锁住），请稍后重试。",
         "agent_no_output": "（无文本输出）",
+        "backend_not_found": "找不到 {backend} 的命令行工具（{cmd}），请先安装或在配置中设置其路径。",
+        "backend_auth_required": "{backend} 尚未登录，请在服务器上运行 `{cmd}` 完成登录后重试。",
+        "agent_failed": "{backend} 运行失败：{reason}。",
+        "backend_down": "{backend} 暂时不可用（{reason}），已暂停调用，约 {seconds} 秒后自动重试。",
+        "error_class_auth": "未登录或登录已失效",
+        "error_class_rate_limit": "触发服务商限流",
+        "error_class_crash": "进程异常退出",
+        "error_class_hang": "长时间无响应",
+        "error_class_not_found": "找不到命令行工具",
+        "output_attached": "输出较长（{size}），完整内容见附件。",
         "auth_not_configured": (
             "管理员尚未配置鉴权白名单，机器人暂不可用。\n\n"
             "发送 /whoami 可查看你的 User ID，提供给管理员。"
@@ -65,7 +79,21 @@ MESSAGES = {
         "prompt_empty": "Please send some text as the prompt for the agent.",
         "agent_error": "Error: {error}",
         "agent_timeout": "⏱ Request timed out. Try a shorter prompt or try again later.",
+        "agent_truncated": "⏱ Timed out; the above is what was produced so far. Send /continue (or !continue on Discord) to pick up from here.",
+        "continue_nothing": "There is no truncated reply to continue.",
+        "continue_started": "Continuing the truncated reply…",
+        "agent_stalled": "⏱ The agent produced no output within {seconds}s and was stopped (it may be waiting on a login or a lock). Please try again.",
         "agent_no_output": "(no text output)",
+        "backend_not_found": "The {backend} CLI ({cmd}) was not found. Install it or set its path in the config.",
+        "backend_auth_required": "{backend} is not logged in. Run `{cmd}` on the server to log in, then try again.",
+        "agent_failed": "{backend} failed: {reason}.",
+        "backend_down": "{backend} is temporarily unavailable ({reason}); calls are paused and will be retried in about {seconds}s.",
+        "error_class_auth": "not logged in or the login expired",
+        "error_class_rate_limit": "rate limited by the provider",
+        "error_class_crash": "the CLI exited abnormally",
+        "error_class_hang": "the CLI stopped responding",
+        "error_class_not_found": "the CLI was not found",
+        "output_attached": "Output is long ({size}); the full text is attached as a file.",
         "auth_not_configured": (
             "Auth allowlist is not configured yet. The bot is not available.\n\n"
             "Send /whoami to see your User ID and ask the admin."
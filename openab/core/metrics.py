@@ -0,0 +1,136 @@
+"""进程内轻量指标：计数器、仪表值与延迟样本（滑动窗口分位数），供日志、/metrics 与调度决策使用。"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import deque
+from typing import Any, Optional
+
+# 每个 (name, labels) 保留的最近样本数，用于计算分位数
+MAX_SAMPLES = 512
+
+_LabelKey = tuple[tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, _LabelKey], float] = {}
+_gauges: dict[tuple[str, _LabelKey], float] = {}
+# (name, labels) -> (count, sum, 最近样本)
+_summaries: dict[tuple[str, _LabelKey], list[Any]] = {}
+
+
+def _labels_key(labels: dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    """计数器累加。"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """设置仪表值（如当前排队数、池内进程数）。"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _gauges[key] = float(value)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """记录一个样本（秒、字节等），累计 count/sum 并放入滑动窗口。"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        entry = _summaries.get(key)
+        if entry is None:
+            entry = [0, 0.0, deque(maxlen=MAX_SAMPLES)]
+            _summaries[key] = entry
+        entry[0] += 1
+        entry[1] += value
+        entry[2].append(value)
+
+
+def _quantile(sorted_values: list[float], q: float) -> float:
+    idx = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+def percentile(name: str, q: float, *, min_samples: int = 1, **labels: Any) -> Optional[float]:
+    """滑动窗口内的分位数（q 取 0~1）；样本不足 min_samples 时返回 None。"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        entry = _summaries.get(key)
+        values = sorted(entry[2]) if entry else []
+    if len(values) < max(1, min_samples):
+        return None
+    return _quantile(values, q)
+
+
+def get_counter(name: str, **labels: Any) -> float:
+    with _lock:
+        return _counters.get((name, _labels_key(labels)), 0.0)
+
+
+def get_gauge(name: str, **labels: Any) -> Optional[float]:
+    with _lock:
+        return _gauges.get((name, _labels_key(labels)))
+
+
+def snapshot() -> dict[str, list[dict[str, Any]]]:
+    """当前全部指标的快照（JSON 友好）。"""
+    with _lock:
+        counters = [
+            {"name": n, "labels": dict(lk), "value": v} for (n, lk), v in _counters.items()
+        ]
+        gauges = [
+            {"name": n, "labels": dict(lk), "value": v} for (n, lk), v in _gauges.items()
+        ]
+        raw = [(n, lk, e[0], e[1], sorted(e[2])) for (n, lk), e in _summaries.items()]
+    summaries = []
+    for n, lk, count, total, values in raw:
+        item: dict[str, Any] = {"name": n, "labels": dict(lk), "count": count, "sum": total}
+        if values:
+            item.update({
+                "p50": _quantile(values, 0.5),
+                "p90": _quantile(values, 0.9),
+                "p99": _quantile(values, 0.99),
+            })
+        summaries.append(item)
+    return {"counters": counters, "gauges": gauges, "summaries": summaries}
+
+
+def _fmt_labels(labels: dict[str, Any], extra: Optional[dict[str, str]] = None) -> str:
+    merged = dict(labels)
+    if extra:
+        merged.update(extra)
+    if not merged:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in sorted(merged.items())
+    )
+    return "{" + body + "}"
+
+
+def render_text() -> str:
+    """Prometheus 文本格式输出（summary 只给 0.5/0.9/0.99 分位数）。"""
+    snap = snapshot()
+    lines: list[str] = []
+    for c in sorted(snap["counters"], key=lambda x: x["name"]):
+        lines.append(f"{c['name']}{_fmt_labels(c['labels'])} {c['value']}")
+    for g in sorted(snap["gauges"], key=lambda x: x["name"]):
+        lines.append(f"{g['name']}{_fmt_labels(g['labels'])} {g['value']}")
+    for s in sorted(snap["summaries"], key=lambda x: x["name"]):
+        for q in ("0.5", "0.9", "0.99"):
+            key = {"0.5": "p50", "0.9": "p90", "0.99": "p99"}[q]
+            if key in s:
+                lines.append(f"{s['name']}{_fmt_labels(s['labels'], {'quantile': q})} {s[key]}")
+        lines.append(f"{s['name']}_count{_fmt_labels(s['labels'])} {s['count']}")
+        lines.append(f"{s['name']}_sum{_fmt_labels(s['labels'])} {s['sum']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """清空全部指标（测试用）。"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _summaries.clear()
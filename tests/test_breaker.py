@@ -0,0 +1,105 @@
+"""断路器的运行归类：按 AgentReply.outcome 判断，不解析提示文案。"""
+from __future__ import annotations
+
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+from openab.agents import breaker
+from openab.agents.breaker import RunOutcome
+from openab.agents.deadline import truncated_reply
+from openab.agents.result import AgentReply, RunUsage, no_output_reply
+from openab.agents.stream import stream_subprocess
+from openab.core.i18n import t
+
+
+def _classify(*parts) -> RunOutcome:
+    outcome = RunOutcome()
+    for part in parts:
+        outcome.feed(part)
+    return outcome
+
+
+def test_timeout_without_output_is_hang() -> None:
+    outcome = _classify(truncated_reply("", "en"))
+    assert outcome.error_class() == "hang" and not outcome.succeeded
+
+
+def test_no_output_is_crash_even_with_exit_code_zero() -> None:
+    usage = RunUsage(user_cpu=0.0, sys_cpu=0.0, max_rss_bytes=0, wall_seconds=1.0, exit_code=0)
+    outcome = _classify(no_output_reply("en", usage=usage))
+    assert outcome.error_class() == "crash" and not outcome.succeeded
+
+
+def test_reply_text_matching_a_message_is_not_classified_by_text() -> None:
+    # 回复正文恰好与提示文案相同（如 agent 复述了它）：没有 outcome，按正常回复处理
+    outcome = _classify(t("en", "agent_timeout"), t("en", "agent_no_output"))
+    assert outcome.error_class() is None and outcome.succeeded
+
+
+def test_truncated_reply_is_not_a_failure() -> None:
+    outcome = _classify("partial", AgentReply("\n\n" + t("en", "agent_truncated"), truncated=True))
+    assert outcome.error_class() is None and outcome.truncated
+
+
+def _streamed(tmp_path: Path, body: str) -> RunOutcome:
+    path = tmp_path / "cli"
+    path.write_text("#!/bin/sh\n" + body)
+    os.chmod(path, 0o755)
+
+    async def run() -> RunOutcome:
+        outcome = RunOutcome()
+        async for delta in stream_subprocess([str(path)], backend="test", timeout=10):
+            outcome.feed(delta)
+        return outcome
+
+    return asyncio.run(run())
+
+
+def test_successful_streamed_reply_mentioning_429_and_401_keeps_circuit_closed(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setattr(breaker, "_circuits", {})
+    outcome = _streamed(tmp_path, "echo 'HTTP 429 means Too Many Requests; a 401 Unauthorized response means log in.'\n")
+    assert outcome.exit_code == 0 and outcome.error_class() is None and outcome.succeeded
+    breaker.record("test", None, outcome, breaker.BreakerConfig())
+    assert breaker.admit("test") is None
+
+
+def test_failed_streamed_run_is_classified_from_its_output(tmp_path: Path) -> None:
+    outcome = _streamed(tmp_path, "echo 'Error: 429 Too Many Requests'\nexit 1\n")
+    assert outcome.exit_code == 1 and outcome.error_class() == "rate_limit"
+
+
+def test_reported_error_is_classified_without_exit_code() -> None:
+    # 常驻进程 / 事件流中 is_error 的 result 事件：没有退出码，但 CLI 明确报告了错误
+    outcome = _classify("Invalid API key", AgentReply("", error="Invalid API key · Please run /login"))
+    assert outcome.error_class() == "auth"
+
+
+def _run_stream(monkeypatch, reply: AgentReply) -> list[str]:
+    import openab.agents as agents
+
+    async def run_stream_async(prompt, **kwargs):
+        yield reply
+
+    monkeypatch.setattr(breaker, "_circuits", {})
+    monkeypatch.setattr(agents, "_start_probe", lambda cfg: None)
+    monkeypatch.setattr(agents, "_backend_module", lambda backend: SimpleNamespace(run_stream_async=run_stream_async))
+    config = {"agent": {"backend": "cursor"}, "cursor": {"continue_session": False}}
+
+    async def collect() -> list[str]:
+        return [str(d) async for d in agents.run_agent_stream_async("hi", lang="en", agent_config=config)]
+
+    return asyncio.run(collect())
+
+
+def test_failed_stream_without_output_gets_the_failure_reason(monkeypatch) -> None:
+    usage = RunUsage(user_cpu=0.0, sys_cpu=0.0, max_rss_bytes=0, wall_seconds=1.0, exit_code=1)
+    deltas = _run_stream(monkeypatch, no_output_reply("en", usage=usage))
+    assert deltas == [breaker.failure_message("cursor", "crash", "en")]
+
+
+def test_stream_without_output_but_clean_exit_keeps_the_no_output_message(monkeypatch) -> None:
+    usage = RunUsage(user_cpu=0.0, sys_cpu=0.0, max_rss_bytes=0, wall_seconds=1.0, exit_code=0)
+    deltas = _run_stream(monkeypatch, no_output_reply("en", usage=usage))
+    assert deltas == [t("en", "agent_no_output")]
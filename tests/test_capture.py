@@ -0,0 +1,57 @@
+"""capture：超过内存上限的输出转写到临时文件，完整内容经 iter_text 按块读回。"""
+from __future__ import annotations
+
+import asyncio
+import os
+from pathlib import Path
+
+from openab.agents.capture import PREVIEW_CHARS, CapturedOutput, capture, reply_from_output
+from openab.agents.process import spawn
+
+
+def test_small_output_stays_in_memory() -> None:
+    out = CapturedOutput(4096)
+    out.write("你好\n".encode("utf-8"))
+    out.finish()
+    assert not out.spilled
+    assert "".join(out.iter_text()) == "你好\n"
+
+
+def test_spilled_output_round_trips_through_iter_text() -> None:
+    text = "".join(f"第 {i} 行 line\n" for i in range(2000))
+    data = text.encode("utf-8")
+    out = CapturedOutput(4096)
+    # 按奇数长度写入，使多字节字符落在块边界上
+    for i in range(0, len(data), 333):
+        out.write(data[i : i + 333])
+    out.finish()
+    assert out.spilled and out.size == len(data)
+    assert Path(out.path).read_bytes() == data
+    assert text.startswith(out.head())
+    assert "".join(out.iter_text(chunk_bytes=101)) == text
+    path = out.path
+    out.discard()
+    assert not os.path.exists(path)
+
+
+def test_capture_spills_large_cli_output(tmp_path: Path) -> None:
+    cli = tmp_path / "cli"
+    cli.write_text("#!/bin/sh\ni=0\nwhile [ $i -lt 5000 ]; do echo \"line $i ✓\"; i=$((i+1)); done\n")
+    os.chmod(cli, 0o755)
+    config = {"agent": {"capture_memory_bytes": 8192}}
+
+    async def run():
+        proc = await spawn([str(cli)], backend="test", agent_config=config)
+        return await capture(proc, 10, agent_config=config), proc
+
+    out, proc = asyncio.run(run())
+    try:
+        expected = "".join(f"line {i} ✓\n" for i in range(5000))
+        assert out.spilled
+        assert "".join(out.iter_text()) == expected
+        reply = reply_from_output(out, "en", usage=proc.usage)
+        assert reply.output is out
+        assert len(reply) <= PREVIEW_CHARS
+        assert expected.startswith(str(reply))
+    finally:
+        out.discard()
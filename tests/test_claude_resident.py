@@ -0,0 +1,98 @@
+"""Claude：常驻会话的软期限截断与运行优先级，以及 print 模式按 id 恢复会话。"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from openab.agents import claude
+from openab.agents.claude_sessions import manager
+
+# 替身 CLI：每条 stdin 消息输出一段文本增量后结束本轮；消息含 "slow" 时先停住，被中断（SIGINT）后再输出一段并结束本轮
+_FAKE_CLAUDE = '''
+import json, sys, time
+
+def delta(text):
+    event = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": text}}
+    print(json.dumps({"type": "stream_event", "session_id": "s-1", "event": event}), flush=True)
+
+for line in sys.stdin:
+    text = json.loads(line)["message"]["content"][0]["text"]
+    delta("partial " + text)
+    if "slow" in text:
+        try:
+            time.sleep(30)
+        except KeyboardInterrupt:
+            delta(" (interrupted)")
+    print(json.dumps({"type": "result", "session_id": "s-1", "result": ""}), flush=True)
+'''
+
+
+def _config(tmp_path: Path) -> dict:
+    script = tmp_path / "claude"
+    script.write_text(f"#!{sys.executable}\n" + _FAKE_CLAUDE)
+    os.chmod(script, 0o755)
+    return {"claude": {"cmd": str(script), "resident": True}, "agent": {"hard_timeout": 4}, "_session_key": "tg:1:2"}
+
+
+def test_resident_turn_completes(tmp_path: Path) -> None:
+    async def run() -> str:
+        try:
+            return await claude.run_async("hi", timeout=10, agent_config=_config(tmp_path))
+        finally:
+            manager.close_all()
+
+    reply = asyncio.run(run())
+    assert str(reply) == "partial hi" and not reply.truncated
+
+
+def test_resident_turn_truncated_at_soft_deadline(tmp_path: Path) -> None:
+    async def run() -> str:
+        try:
+            return await claude.run_async("slow", timeout=1, agent_config=_config(tmp_path))
+        finally:
+            manager.close_all()
+
+    started = time.monotonic()
+    reply = asyncio.run(run())
+    # 软期限时先中断（SIGINT），收下中断后的输出，不必等到硬期限
+    assert time.monotonic() - started < 4
+    assert reply.truncated
+    assert str(reply).startswith("partial slow (interrupted)\n\n")
+
+
+def test_print_mode_resume_keeps_session_persistence() -> None:
+    fresh = claude._build_args("hi", None, {})
+    assert "--no-session-persistence" in fresh and "--resume" not in fresh
+    resumed = claude._build_args("hi", None, {}, resume_id="s-1")
+    assert "--no-session-persistence" not in resumed
+    assert resumed[resumed.index("--resume") + 1] == "s-1"
+
+
+def test_resident_process_gets_the_run_priority(tmp_path: Path, monkeypatch) -> None:
+    from openab.agents import claude_sessions
+
+    spawned: list = []
+    create = claude_sessions.create_process
+
+    async def recording_create(args, **kwargs):
+        proc = await create(args, **{**kwargs, "limits": None})
+        spawned.append((proc, kwargs.get("limits")))
+        return proc
+
+    monkeypatch.setattr(claude_sessions, "create_process", recording_create)
+    config = _config(tmp_path)
+    config["agent"]["priority"] = {"frontends": {"telegram": "bulk"}, "classes": {"bulk": {"nice": 15, "cpu_weight": 20}}}
+    config["_frontend"] = "tg"
+
+    async def run() -> int:
+        try:
+            await claude.run_async("hi", timeout=10, agent_config=config)
+            return os.getpriority(os.PRIO_PROCESS, spawned[0][0].pid)
+        finally:
+            manager.close_all()
+
+    assert asyncio.run(run()) == 15
+    assert ("CPUWeight", "20") in spawned[0][1].cgroup
@@ -0,0 +1,26 @@
+"""detect_cli：core 层不依赖 agents；已注册后端的命令名由 agents 层传入。"""
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+from openab.agents import registry
+from openab.core import detect_cli
+
+
+def test_core_does_not_import_agents() -> None:
+    code = "import sys, openab.core.detect_cli; sys.exit('openab.agents' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[1]).returncode == 0
+
+
+def test_static_names_match_builtin_registry() -> None:
+    assert list(detect_cli.BACKEND_CLI_NAMES) == registry.cli_names()[: len(detect_cli.BACKEND_CLI_NAMES)]
+
+
+def test_injected_names(tmp_path, monkeypatch) -> None:
+    cli = tmp_path / "mycli"
+    cli.write_text("#!/bin/sh\n")
+    cli.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path))
+    assert detect_cli.detect_available_backends([("mine", "mycli"), ("claude", "claude")]) == [("mine", str(cli))]
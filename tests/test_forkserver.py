@@ -0,0 +1,57 @@
+"""fork server：启动的 CLI 不继承服务端忽略的 SIGINT；启动失败的服务端被回收。"""
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import subprocess
+from pathlib import Path
+
+from openab.agents import forkserver
+
+
+def _ignored(status: str) -> int:
+    for line in status.splitlines():
+        if line.startswith("SigIgn:"):
+            return int(line.split()[1], 16)
+    raise AssertionError("no SigIgn line")
+
+
+async def _child_status() -> str:
+    child = await forkserver.spawn(
+        ["cat", "/proc/self/status"], env=None, cwd=None,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    with os.fdopen(child.pipes[1], "rb") as out:
+        status = out.read().decode()
+    code, _ = await child.wait_exit()
+    assert code == 0
+    return status
+
+
+def test_spawned_cli_has_default_sigint(tmp_path: Path) -> None:
+    assert forkserver.start(str(tmp_path / "fs.sock")) is not None
+    try:
+        server = Path(f"/proc/{forkserver._server.pid}/status").read_text()
+        assert _ignored(server) & (1 << (signal.SIGINT - 1))
+        status = asyncio.run(_child_status())
+    finally:
+        forkserver.stop()
+    assert not _ignored(status) & (1 << (signal.SIGINT - 1))
+
+
+def test_server_that_never_becomes_ready_is_reaped(tmp_path: Path, monkeypatch) -> None:
+    started: list[subprocess.Popen] = []
+    popen = subprocess.Popen
+
+    def never_ready(args, **kwargs):
+        proc = popen(["sleep", "30"], **kwargs)
+        started.append(proc)
+        return proc
+
+    monkeypatch.setattr(forkserver.subprocess, "Popen", never_ready)
+    monkeypatch.setattr(forkserver, "_START_TIMEOUT", 0.2)
+    assert forkserver.start(str(tmp_path / "fs.sock")) is None
+    # 已被 wait 回收：不留僵尸进程
+    assert started[0].returncode is not None
+    assert not os.path.exists(f"/proc/{started[0].pid}")
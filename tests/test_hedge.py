@@ -0,0 +1,24 @@
+"""对冲只用于不共享会话的运行：延续最近会话的 API 调用需 continue_session: false 才会对冲。"""
+from __future__ import annotations
+
+from openab.agents import hedge, serialize
+
+
+def test_api_calls_continuing_latest_session_are_not_hedgeable() -> None:
+    assert serialize.session_key("cursor", {}) == "cursor:latest"
+    assert serialize.session_key("codex", {}) == "codex:latest"
+
+
+def test_api_calls_without_continuation_are_hedgeable() -> None:
+    assert serialize.session_key("cursor", {"cursor": {"continue_session": False}}) is None
+    assert serialize.session_key("codex", {"codex": {"continue_session": False}}) is None
+
+
+def test_skipped_latest_session_is_logged_once_per_backend(monkeypatch) -> None:
+    logged: list[tuple] = []
+    monkeypatch.setattr(hedge, "_skipped_logged", set())
+    monkeypatch.setattr(hedge.logger, "info", lambda *args: logged.append(args))
+    hedge.skipped("cursor", "cursor:latest")
+    hedge.skipped("cursor", "cursor:latest")
+    hedge.skipped("cursor", "cursor:tg:1:2")
+    assert len(logged) == 1 and "continue_session" in logged[0][0]
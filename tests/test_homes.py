@@ -0,0 +1,48 @@
+"""凭据目录池：会话固定关系持久化，触发限流的目录进入退避。"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from openab.agents import breaker, homes
+from openab.agents.result import AgentReply
+
+
+def _setup(tmp_path: Path, monkeypatch) -> dict:
+    state = tmp_path / "homes.json"
+    monkeypatch.setenv("OPENAB_HOMES_STATE", str(state))
+    monkeypatch.setattr(homes, "_pins", None)
+    monkeypatch.setattr(homes, "_states", {})
+    monkeypatch.setattr(homes, "_rr", {})
+    monkeypatch.setattr(breaker, "_circuits", {})
+    return {"codex": {"homes": [str(tmp_path / "a"), str(tmp_path / "b")], "home_backoff": 60}}
+
+
+def test_session_pins_are_saved_and_reloaded(tmp_path: Path, monkeypatch) -> None:
+    config = _setup(tmp_path, monkeypatch)
+    with homes.home_lease("codex", config, "codex:tg:1") as lease:
+        lease.config["_pin_session"]("abc")
+    saved = json.loads((tmp_path / "homes.json").read_text(encoding="utf-8"))
+    assert saved == {"codex:tg:1": lease.home, "codex:resume:abc": lease.home}
+
+    # 模拟重启：从状态文件重新加载
+    monkeypatch.setattr(homes, "_pins", None)
+    for _ in range(3):
+        with homes.home_lease("codex", config, "codex:resume:abc") as again:
+            pass
+        assert again.home == lease.home
+
+
+def test_rate_limited_home_backs_off(tmp_path: Path, monkeypatch) -> None:
+    config = _setup(tmp_path, monkeypatch)
+    with homes.home_lease("codex", config, "codex:tg:1") as limited:
+        limited.feed(AgentReply("", error="429 Too Many Requests"))
+    assert limited.error_class == "rate_limit"
+    assert not homes._available("codex", limited.home)
+
+    # 新会话都避开退避中的目录
+    for user in range(2, 5):
+        with homes.home_lease("codex", config, f"codex:tg:{user}") as lease:
+            pass
+        assert lease.home != limited.home
+    assert not homes.backed_off("codex", config)
@@ -0,0 +1,169 @@
+"""OpenClaw Gateway 连接池：对本地的替身网关测试 keep-alive 复用、chunked 响应体、读响应体超时与连接被关闭；流式回复过滤 MEDIA: 行。"""
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from openab.agents import openclaw_gateway as gw
+
+Respond = Callable[[asyncio.StreamWriter, int], Awaitable[bool]]
+
+
+def _completion(text: str) -> bytes:
+    return json.dumps({"choices": [{"message": {"content": text}}]}).encode()
+
+
+async def _serve(respond: Respond, run: Callable[[gw.GatewayConfig], Awaitable[None]]) -> list[int]:
+    """启动替身网关（respond 返回 False 时关闭连接），以其地址执行 run；返回每个连接上处理的请求数。"""
+    served: list[int] = []
+    handlers: set[asyncio.Task] = set()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handlers.add(asyncio.current_task())  # type: ignore[arg-type]
+        served.append(0)
+        index = len(served) - 1
+        try:
+            while True:
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        return
+                    if line in (b"\r\n", b"\n"):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                served[index] += 1
+                if not await respond(writer, served[index]):
+                    return
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        await run(gw.GatewayConfig(url=f"http://127.0.0.1:{port}"))
+    finally:
+        gw.close_all()
+        if handlers:
+            await asyncio.wait(handlers, timeout=5)
+        server.close()
+        await server.wait_closed()
+    return served
+
+
+async def _content_length(writer: asyncio.StreamWriter, n: int) -> bool:
+    body = _completion(f"reply {n}")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+    await writer.drain()
+    return True
+
+
+def test_keep_alive_connection_is_reused() -> None:
+    replies: list[str] = []
+
+    async def run(config: gw.GatewayConfig) -> None:
+        for _ in range(3):
+            replies.append(await gw.complete("hi", config, timeout=5))
+
+    served = asyncio.run(_serve(_content_length, run))
+    assert replies == ["reply 1", "reply 2", "reply 3"]
+    assert served == [3]
+
+
+def test_chunked_body() -> None:
+    async def respond(writer: asyncio.StreamWriter, n: int) -> bool:
+        body = _completion("chunked reply")
+        head, tail = body[:10], body[10:]
+        writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for part in (head, tail):
+            writer.write(b"%x\r\n%s\r\n" % (len(part), part))
+            await writer.drain()
+            await asyncio.sleep(0.05)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    replies: list[str] = []
+
+    async def run(config: gw.GatewayConfig) -> None:
+        for _ in range(2):
+            replies.append(await gw.complete("hi", config, timeout=5))
+
+    served = asyncio.run(_serve(respond, run))
+    assert replies == ["chunked reply", "chunked reply"]
+    assert served == [2]
+
+
+def test_timeout_mid_body_raises_timeout_error() -> None:
+    async def respond(writer: asyncio.StreamWriter, n: int) -> bool:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n{\"choices\"")
+        await writer.drain()
+        await asyncio.sleep(1)
+        return False
+
+    errors: list[BaseException] = []
+
+    async def run(config: gw.GatewayConfig) -> None:
+        try:
+            await gw.complete("hi", config, timeout=0.5)
+        except BaseException as e:  # noqa: BLE001
+            errors.append(e)
+
+    asyncio.run(_serve(respond, run))
+    assert len(errors) == 1
+    assert isinstance(errors[0], asyncio.TimeoutError) and not isinstance(errors[0], gw.GatewayError)
+
+
+def test_connection_closed_by_gateway() -> None:
+    async def close_after_reply(writer: asyncio.StreamWriter, n: int) -> bool:
+        await _content_length(writer, n)
+        return False
+
+    replies: list[str] = []
+
+    async def run(config: gw.GatewayConfig) -> None:
+        for _ in range(2):
+            replies.append(await gw.complete("hi", config, timeout=5))
+
+    # 网关在回复后关闭了空闲连接：下一次请求换新连接
+    served = asyncio.run(_serve(close_after_reply, run))
+    assert replies == ["reply 1", "reply 1"]
+    assert served == [1, 1]
+
+    async def close_mid_body(writer: asyncio.StreamWriter, n: int) -> bool:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n{\"choices\"")
+        await writer.drain()
+        return False
+
+    errors: list[BaseException] = []
+
+    async def run_once(config: gw.GatewayConfig) -> None:
+        try:
+            await gw.complete("hi", config, timeout=5)
+        except gw.GatewayError as e:
+            errors.append(e)
+
+    asyncio.run(_serve(close_mid_body, run_once))
+    assert len(errors) == 1 and "interrupted" in str(errors[0])
+
+
+def test_stream_mode_drops_media_lines(monkeypatch) -> None:
+    from openab.agents import openclaw
+
+    async def stream(prompt, config, **kwargs):
+        for delta in ("Here is ", "the chart:\nMED", "IA: /tmp/chart.png\nDone", "."):
+            yield delta
+
+    monkeypatch.setattr(gw, "get_gateway_config", lambda cfg: gw.GatewayConfig())
+    monkeypatch.setattr(gw, "stream", stream)
+
+    async def collect() -> list[str]:
+        return [str(d) async for d in openclaw.run_stream_async("hi", agent_config={})]
+
+    deltas = asyncio.run(collect())
+    assert "".join(deltas) == "Here is the chart:\nDone.\n"
+    assert not any("MEDIA" in d for d in deltas)
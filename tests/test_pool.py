@@ -0,0 +1,23 @@
+"""预热进程池：env / cwd 或 argv 按会话而异时不建池。"""
+from __future__ import annotations
+
+from openab.agents.pool import PoolConfig, get_pool_config
+
+
+def test_pool_enabled_for_shared_environment() -> None:
+    assert get_pool_config({"agent": {"pool": {"size": 2}}}, "codex") == PoolConfig(size=2)
+
+
+def test_pool_disabled_with_user_homes() -> None:
+    config = {"agent": {"pool": {"size": 2}, "user_homes": True}, "_user_id": "tg:1"}
+    assert get_pool_config(config, "codex") is None
+    # 没有聊天用户（API 调用）时仍共用默认目录
+    assert get_pool_config({"agent": config["agent"]}, "codex") is not None
+
+
+def test_pool_disabled_with_workspace_pool() -> None:
+    assert get_pool_config({"agent": {"pool": {"size": 2}, "workspace_pool": True}}, "codex") is None
+
+
+def test_pool_skipped_when_resuming_a_session() -> None:
+    assert get_pool_config({"agent": {"pool": {"size": 2}}, "_resume_id": "thread-1"}, "codex") is None
@@ -0,0 +1,54 @@
+"""残留进程回收：会话 id（首进程 pid）被复用后不再向它发信号；每个残留进程只计数一次。"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+from openab.agents import process
+
+
+def test_reused_pid_is_no_longer_tracked(monkeypatch) -> None:
+    monkeypatch.setattr(process, "_finished", {})
+    monkeypatch.setattr(process, "_ensure_reaper", lambda: None)
+
+    async def run() -> None:
+        proc = await process.create_process(["true"], stdout=process.DEVNULL, stderr=process.DEVNULL, backend="test")
+        await proc.wait()
+        assert proc.pid in process._finished
+        # 内核把同一 pid 分给了新进程：旧会话已不存在
+        process.AgentProcess(proc.pid, backend="test")
+        assert proc.pid not in process._finished
+
+    asyncio.run(run())
+
+
+def test_empty_session_is_dropped_at_once(monkeypatch) -> None:
+    monkeypatch.setattr(process, "_finished", {})
+    signalled: list[int] = []
+    monkeypatch.setattr(os, "kill", lambda pid, sig: signalled.append(pid))
+    monkeypatch.setattr(os, "killpg", lambda pgid, sig: signalled.append(pgid))
+    monkeypatch.setattr(process, "_session_members", lambda sids: {})
+    monkeypatch.setattr(process, "_group_alive", lambda pgid: False)
+    process._finished[2 ** 22 + 7] = ("test", time.monotonic(), set())
+    assert process.reap_orphans() == 0
+    assert not process._finished and not signalled
+
+
+def test_each_leftover_process_is_counted_once(monkeypatch) -> None:
+    sid = 2 ** 22 + 7
+    monkeypatch.setattr(process, "_finished", {sid: ("test", time.monotonic(), set())})
+    monkeypatch.setattr(process.os.path, "isdir", lambda path: True)
+    # 101 扛过了 SIGTERM，下一轮仍在；102 在发信号前已退出
+    monkeypatch.setattr(process, "_session_members", lambda sids: {sid: [101, 102]})
+
+    def kill(pid: int, sig: int) -> None:
+        if pid == 102:
+            raise ProcessLookupError(pid)
+
+    counted: list[int] = []
+    monkeypatch.setattr(os, "kill", kill)
+    monkeypatch.setattr(process.metrics, "inc", lambda name, value=1, **labels: counted.append(value))
+    assert process.reap_orphans() == 1
+    assert process.reap_orphans() == 1
+    assert sum(counted) == 1
@@ -0,0 +1,73 @@
+"""按会话串行：同一会话的运行依次执行，不同会话并行；已知会话 ID 时按 ID 排队。"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Mapping
+
+from openab.agents import serialize
+
+
+async def _overlap(*configs: Mapping[str, Any]) -> int:
+    """同时在各配置上运行，返回同一时刻运行数的最大值。"""
+    running = peak = 0
+
+    async def run(cfg: Mapping[str, Any]) -> None:
+        nonlocal running, peak
+        async with serialize.session_turn("cursor", cfg):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+
+    await asyncio.gather(*(run(cfg) for cfg in configs))
+    return peak
+
+
+def test_same_session_runs_one_at_a_time() -> None:
+    cfg = {"_resume_id": "chat-1"}
+    assert asyncio.run(_overlap(cfg, cfg, cfg)) == 1
+
+
+def test_different_sessions_run_in_parallel() -> None:
+    assert asyncio.run(_overlap({"_resume_id": "chat-1"}, {"_resume_id": "chat-2"}, {"_session_key": "tg:1:2"})) == 3
+
+
+def test_chat_user_and_api_call_on_the_same_session_share_a_key() -> None:
+    chat = {"_session_key": "tg:1:2", "_resume_id": "chat-1"}
+    other_chat = {"_session_key": "tg:1:3", "_resume_id": "chat-1"}
+    api = {"_resume_id": "chat-1"}
+    assert serialize.session_key("cursor", chat) == serialize.session_key("cursor", api) == "cursor:resume:chat-1"
+    assert asyncio.run(_overlap(chat, other_chat, api)) == 1
+    # 工作区仍按聊天用户复用
+    assert serialize.owner_key("cursor", chat) == "cursor:tg:1:2"
+
+
+def test_session_pinned_while_queued_is_locked_by_its_id() -> None:
+    pinned: list[str] = []
+    user = {"_session_key": "tg:1:2", "_current_session": lambda: pinned[0] if pinned else None}
+
+    async def run() -> list[str]:
+        order: list[str] = []
+
+        async def first() -> None:
+            async with serialize.session_turn("cursor", user):
+                await asyncio.sleep(0.05)
+                pinned.append("chat-1")
+                order.append("first")
+
+        async def second() -> None:
+            async with serialize.session_turn("cursor", user) as cfg:
+                assert cfg["_resume_id"] == "chat-1"
+                order.append("second:start")
+                await asyncio.sleep(0.1)
+                order.append("second:end")
+
+        async def api() -> None:
+            await asyncio.sleep(0.1)
+            async with serialize.session_turn("cursor", {"_resume_id": "chat-1"}):
+                order.append("api")
+
+        await asyncio.gather(first(), second(), api())
+        return order
+
+    assert asyncio.run(run()) == ["first", "second:start", "second:end", "api"]
@@ -0,0 +1,39 @@
+"""聊天用户的会话：尚未固定时开新会话，而不是接续全局「最近一次会话」。"""
+from __future__ import annotations
+
+from openab.agents import codex, cursor, serialize
+
+
+def _pinnable(**extra) -> dict:
+    return {"_session_key": "tg:1:2", "_pin_session": lambda session_id: None, **extra}
+
+
+def test_cursor_unpinned_user_starts_new_session() -> None:
+    args = cursor._build_args("hi", None, _pinnable())
+    assert "--continue" not in args and "--resume" not in args
+    assert not cursor.continues_latest(_pinnable())
+
+
+def test_cursor_pinned_user_resumes_pinned_session() -> None:
+    args = cursor._build_args("hi", None, _pinnable(_resume_id="chat-1"))
+    assert args[args.index("--resume") + 1] == "chat-1"
+
+
+def test_cursor_without_pinning_continues_latest() -> None:
+    assert "--continue" in cursor._build_args("hi", None, {})
+    assert serialize.session_key("cursor", {}) == "cursor:latest"
+
+
+def test_codex_unpinned_user_starts_new_session() -> None:
+    args = codex._build_args("hi", None, _pinnable())
+    assert args[1] == "exec" and "resume" not in args and "--last" not in args
+    assert not codex.continues_latest(_pinnable())
+
+
+def test_codex_pinned_user_resumes_pinned_session() -> None:
+    args = codex._build_args("hi", None, _pinnable(_resume_id="thread-1"))
+    assert args[1:4] == ["exec", "resume", "thread-1"]
+
+
+def test_codex_without_pinning_continues_latest() -> None:
+    assert codex._build_args("hi", None, {})[1:4] == ["exec", "resume", "--last"]
@@ -0,0 +1,57 @@
+"""stream_subprocess：看门狗只作用于事件流输出。"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from openab.agents.stream import stream_subprocess
+
+
+def _script(tmp_path: Path, body: str) -> str:
+    path = tmp_path / "cli"
+    path.write_text("#!/bin/sh\n" + body)
+    os.chmod(path, 0o755)
+    return str(path)
+
+
+async def _collect(args: list[str], **kwargs) -> list[str]:
+    return [str(d) async for d in stream_subprocess(args, backend="test", timeout=10, **kwargs)]
+
+
+def test_slow_plain_text_cli_is_not_watchdogged(tmp_path: Path) -> None:
+    cli = _script(tmp_path, "sleep 2\necho answer\n")
+    config = {"agent": {"first_output_timeout": 1}}
+    deltas = asyncio.run(_collect([cli], parse_line=lambda line: line, agent_config=config))
+    assert "".join(deltas).strip() == "answer"
+
+
+def test_silent_event_stream_cli_is_watchdogged(tmp_path: Path) -> None:
+    cli = _script(tmp_path, "sleep 5\necho answer\n")
+    config = {"agent": {"first_output_timeout": 1}}
+    started = time.monotonic()
+    deltas = asyncio.run(_collect([cli], parse_line=lambda line: line, events=True, agent_config=config))
+    assert time.monotonic() - started < 5
+    assert "answer" not in "".join(deltas)
+
+
+def test_stalled_run_reports_structured_outcome(tmp_path: Path) -> None:
+    cli = _script(tmp_path, "sleep 5\n")
+    config = {"agent": {"first_output_timeout": 1}}
+
+    async def last() -> object:
+        deltas = [d async for d in stream_subprocess([cli], backend="test", timeout=10, parse_line=lambda line: line,
+                                                     events=True, agent_config=config)]
+        return deltas[-1]
+
+    assert getattr(asyncio.run(last()), "outcome", None) == "stalled"
+
+
+def test_silent_cli_reports_no_output(tmp_path: Path) -> None:
+    cli = _script(tmp_path, "exit 0\n")
+
+    async def last() -> object:
+        return [d async for d in stream_subprocess([cli], backend="test", timeout=10)][-1]
+
+    assert getattr(asyncio.run(last()), "outcome", None) == "no_output"
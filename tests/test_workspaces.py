@@ -0,0 +1,98 @@
+"""工作区池：各会话的视图互相隔离、按 max_views 回收；创建视图时不阻塞其他会话。"""
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+from openab.agents import workspaces
+from openab.agents.workspaces import WorkspacePool, WorkspacePoolConfig
+
+
+def _pool(tmp_path: Path, **config) -> WorkspacePool:
+    base = tmp_path / "repo"
+    base.mkdir()
+    (base / "file.txt").write_text("base\n")
+    return WorkspacePool(base, WorkspacePoolConfig(mode="copy", warm=0, root=tmp_path / "views", **config))
+
+
+def test_slow_view_creation_does_not_block_reusing_other_views(tmp_path: Path) -> None:
+    pool = _pool(tmp_path)
+    create = pool._create
+
+    async def slow_create(path: Path) -> str:
+        if path == pool._session_path("slow"):
+            await asyncio.sleep(2)
+        return await create(path)
+
+    pool._create = slow_create  # type: ignore[method-assign]
+
+    async def run() -> float:
+        async with pool.view("a"):
+            pass
+        slow = asyncio.ensure_future(_hold(pool, "slow"))
+        await asyncio.sleep(0.2)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with pool.view("a"):
+            waited = loop.time() - started
+        await slow
+        return waited
+
+    assert asyncio.run(run()) < 1.0
+
+
+async def _hold(pool: WorkspacePool, key: str) -> None:
+    async with pool.view(key):
+        pass
+
+
+def test_all_views_in_use_logs_that_max_views_is_exceeded(tmp_path: Path, monkeypatch) -> None:
+    pool = _pool(tmp_path, max_views=1)
+    warnings: list[str] = []
+    monkeypatch.setattr(workspaces.logger, "warning", lambda msg, *args: warnings.append(msg % args))
+
+    async def run() -> None:
+        async with pool.view("a"):
+            async with pool.view("b") as b:
+                assert b.is_dir()
+
+    asyncio.run(run())
+    assert any("exceeds max_views" in w for w in warnings)
+
+
+def test_views_are_isolated_per_session(tmp_path: Path) -> None:
+    pool = _pool(tmp_path)
+
+    async def run() -> tuple[Path, Path, Path]:
+        async with pool.view("a") as a:
+            (a / "file.txt").write_text("edited by a\n")
+        async with pool.view("b") as b:
+            assert (b / "file.txt").read_text() == "base\n"
+        async with pool.view("a") as again:
+            assert (again / "file.txt").read_text() == "edited by a\n"
+        return a, b, again
+
+    a, b, again = asyncio.run(run())
+    assert a != b and a == again
+    assert (tmp_path / "repo" / "file.txt").read_text() == "base\n"
+
+
+def test_least_recently_used_idle_view_is_evicted(tmp_path: Path) -> None:
+    pool = _pool(tmp_path, max_views=2)
+
+    async def run() -> tuple[Path, Path, Path]:
+        async with pool.view("a") as a:
+            pass
+        async with pool.view("b") as b:
+            pass
+        async with pool.view("a"):
+            pass
+        async with pool.view("c") as c:
+            pass
+        await asyncio.gather(*pool._removing.values())
+        return a, b, c
+
+    a, b, c = asyncio.run(run())
+    assert set(pool._views) == {"a", "c"}
+    assert a.is_dir() and c.is_dir()
+    assert not b.exists()